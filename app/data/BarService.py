@@ -0,0 +1,95 @@
+from collections import defaultdict
+from data.codec import decode_entry
+from db.redis import get_redis_connection, get_stream_keys, get_bar_group_name, get_bar_consumer_name, read_streams, ack_entries
+from db.bar_store import append_bars
+from utils.bar import get_bar_key, snapshot_key, update_bars
+from utils.tick import aggregate_ticks_by_second
+from utils.log import get_module_logger
+
+class BarService:
+    """
+    共用的 K 棒合成階段:
+    每批新 tick 只讀取、聚合一次, 依 (broker, code, 週期) 合成 K 棒並寫入 get_bar_key 的列表,
+    同一商品同一週期的策略共用同一份 K 棒, 策略端只依自己的 K_time 讀取(訂閱)需要的週期
+    使用獨立的 consumer group 讀取 tick stream, 不影響各策略項目自己的 group
+    """
+    def __init__(self, redis_cli=None):
+        self.log = get_module_logger('data/bar_service')
+        self.redis = redis_cli or get_redis_connection()
+        self._migrated = set()  # 已檢查過舊版各策略獨立 K 棒的 key
+
+    @staticmethod
+    def collect(items):
+        """整理所有策略訂閱的週期 => {(broker, symbol): {code: {interval: {strategy, ...}}}}"""
+        subscriptions = defaultdict(lambda: defaultdict(lambda: defaultdict(set)))
+        for symbol, item_list in items.items():
+            for item in item_list:
+                params = item.get('params', {})
+                for code in item.get('code', []):
+                    subscriptions[(params['broker'], symbol)][code][params.get('K_time', 1)].add(item['strategy'])
+        return subscriptions
+
+    def run_once(self, items):
+        """讀取各商品新的 tick, 合成所有訂閱的週期, 回傳 {bar_key: [完成的 K 棒]}"""
+        published = {}
+
+        for (broker, symbol), codes in self.collect(items).items():
+            group = get_bar_group_name(broker, symbol)
+            consumer = get_bar_consumer_name(broker, symbol)
+            tick_keys = {code: keys[0] for code, keys in get_stream_keys(broker, symbol, list(codes)).items()}
+
+            try:
+                messages = read_streams(self.redis, group, consumer, list(tick_keys.values()), block=0)
+
+                for code, data_redis_key in tick_keys.items():
+                    data = messages.get(data_redis_key, [])
+                    if not data:
+                        continue
+
+                    # 同一批 tick 只聚合一次, 供所有週期使用
+                    ticks = aggregate_ticks_by_second([decode_entry(message[1]) for message in data])
+                    ticks.sort(key=lambda x: x['ts'])
+
+                    for interval, strategies in codes[code].items():
+                        bar_key = get_bar_key(broker, code, interval)
+                        self.migrate(bar_key, [f"{code}_{strategy}_{interval}k" for strategy in strategies])
+                        finished = update_bars(self.redis, bar_key, interval, ticks)
+                        if finished:
+                            append_bars(self.redis, bar_key, finished)  # 同步寫入二進位環狀緩衝
+                            published[bar_key] = finished
+
+                    # 該商品的 K 棒已寫入, 立即確認, 之後其他商品出錯也不影響
+                    ack_entries(self.redis, {(data_redis_key, group): [message[0] for message in data]})
+
+            except Exception as e:
+                # 出錯的商品(與之後尚未處理的商品)不確認: 條目留在 PEL, 之後只讀取新條目不會重新合成,
+                # 直到重新啟動且 STREAM_RECOVER_PENDING=true 時才由 recover_pending 確認清除
+                self.log.error(f"K 棒合成失敗: {broker}, {symbol}, {e}")
+
+        if published:
+            self.log.info(f"本次完成的 K 棒: { {key: len(bars) for key, bars in published.items()} }")
+        return published
+
+    def migrate(self, bar_key, legacy_keys):
+        """共用 K 棒尚不存在時, 沿用舊版各策略獨立合成的 K 棒中最長的一份(每個程序只檢查一次)"""
+        if bar_key in self._migrated:
+            return
+        self._migrated.add(bar_key)
+
+        if self.redis.exists(bar_key):
+            return
+
+        lengths = {key: self.redis.llen(key) for key in legacy_keys}
+        source = max(lengths, key=lengths.get, default=None)
+        if not source or not lengths[source]:
+            return
+
+        bars = self.redis.lrange(source, 0, -1)
+        snapshot = self.redis.get(snapshot_key(source))
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(bar_key, *bars)
+        if snapshot:
+            pipe.set(snapshot_key(bar_key), snapshot)
+        pipe.execute()
+        self.log.info(f"沿用舊版 K 棒: {source} => {bar_key}, 筆數: {len(bars)}")
@@ -2,8 +2,7 @@ from data.broker.load import load_datasources
 import threading, os, time
 from distutils.util import strtobool
 from db.redis import set_redis_consumer
-from collections import defaultdict
-import pandas as pd
+from utils.tick import aggregate_ticks_by_second, tick_type_summary
 
 class DatasourceFactory:
     _datasource_classes = None  # 存放資料源類別字典
@@ -80,34 +79,9 @@ class DatasourceFactory:
     def aggregate_ticks_by_second(tick_data):
         """
         實際運行交易的實盤中, 將 tick_data 依照相同秒數進行合併，回傳合併後的 tick 資料
+        (ts 為秒級字串, 直接以字串分組並單次走訪計算, 詳見 utils/tick.py)
         """
-        tick_buffer = defaultdict(list)
-
-        # 整理 tick_data，依照 timestamp 分組
-        for tick in tick_data:
-            ts = pd.to_datetime(tick['ts']).floor('s')  # 轉換為秒級別時間戳
-            tick_buffer[ts].append(tick)
-
-        aggregated_ticks = []
-
-        for ts, ticks in tick_buffer.items():
-            aggregated_tick = {
-                'ts': ts.strftime('%Y-%m-%d %H:%M:%S'),
-                'code': ticks[0]['code'],  # 假設相同秒數內都是相同 code
-                'close': ticks[-1]['close'],  # 取最後一筆 close
-                'high': max(t['high'] for t in ticks),
-                'low': min(t['low'] for t in ticks),
-                'volume': sum(int(t['volume']) for t in ticks),
-                'bid_price': tuple(sorted(set(t['bid_side_total_vol'] for t in ticks if t['bid_side_total_vol'] != 0))),
-                'bid_volume': sum(int(t['bid_side_total_vol']) for t in ticks),
-                'ask_price': tuple(sorted(set(t['ask_side_total_vol'] for t in ticks if t['ask_side_total_vol'] != 0))),
-                'ask_volume': sum(int(t['ask_side_total_vol']) for t in ticks),
-                'tick_type': DatasourceFactory.analyze_tick_types([t['tick_type'] for t in ticks], type='list')  # 計算 tick_type
-            }
-
-            aggregated_ticks.append(aggregated_tick)
-
-        return aggregated_ticks
+        return aggregate_ticks_by_second(tick_data)
         
     @staticmethod
     def analyze_tick_types(tick_types, type='list'):
@@ -119,15 +93,7 @@ class DatasourceFactory:
         if type == "pandas":
             tick_types = tick_types.tolist()  # 轉換為列表（回測用 Pandas）
         
-        outer_trades = tick_types.count(1)  # 外盤成交數量
-        inner_trades = tick_types.count(-1)  # 內盤成交數量
-        net_trades = outer_trades - inner_trades  # 淨成交量
-        dominant = "外盤" if net_trades > 0 else "內盤" if net_trades < 0 else "均衡"
-        return {
-            "outer_trades": outer_trades,
-            "inner_trades": inner_trades,
-            "dominant": dominant
-        }
+        return tick_type_summary(tick_types.count(1), tick_types.count(-1))  # 外盤, 內盤成交數量
     
     @staticmethod
     def calculate_ohlcv_from_data(data):
@@ -1 +1,2 @@
-from .DatasourceFactory import DatasourceFactory
\ No newline at end of file
+from .DatasourceFactory import DatasourceFactory
+from .BarService import BarService
\ No newline at end of file
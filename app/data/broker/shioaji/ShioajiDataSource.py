@@ -1,8 +1,9 @@
-import json, pytz
+import pytz
 from datetime import datetime, time
 from data.broker.abc.AbstractDatasource import AbstractDatasource
+from db.stream import get_stream_writer
+from data.codec import encode_entry, FUTURE_TICK, STOCK_TICK, FUTURE_BIDASK, STOCK_BIDASK
 from shioaji import TickFOPv1, TickSTKv1, Exchange, BidAskFOPv1, BidAskSTKv1
-from decimal import Decimal
 import shioaji as sj
 from utils.log import get_module_logger
 from dotenv import load_dotenv
@@ -14,6 +15,7 @@ class ShioajiDataSource(AbstractDatasource):
         self.api = brokers['shioaji'].api
         self.log = get_module_logger('data/shioaji_data')
         self.subscribe_product = None
+        self.stream_writer = get_stream_writer()  # 批次寫入 Stream, 避免回調執行緒等待 Redis 往返
         self._init_callbacks()
 
     def _init_callbacks(self):
@@ -161,21 +163,21 @@ class ShioajiDataSource(AbstractDatasource):
             self.log.info(f"股票資料(tick)為試搓{tick.simtrade}或停牌{tick.suspend}: {code}")
             return
 
-        # XADD: 新增一個 Stream 條目
-        return self.redis.xadd(f'shioaji_stock_{code}_stream', {
+        # XADD: 放入批次緩衝區, 由 StreamWriter 透過 pipeline 寫入 Stream
+        return self.stream_writer.xadd(f'shioaji_stock_{code}_stream', encode_entry(STOCK_TICK, {
             'ts': tick.datetime.strftime('%Y-%m-%d %H:%M:%S'),  # 確保 datetime 轉為 ISO 格式的字符串
             'code': code,
-            'open': str(tick.open) if isinstance(tick.open, Decimal) else tick.open,
-            'close': str(tick.close) if isinstance(tick.close, Decimal) else tick.close,
-            'high': str(tick.high) if isinstance(tick.high, Decimal) else tick.high,
-            'low': str(tick.low) if isinstance(tick.low, Decimal) else tick.low,
+            'open': tick.open,
+            'close': tick.close,
+            'high': tick.high,
+            'low': tick.low,
             'volume': tick.volume,
             'total_volume': tick.total_volume,
-            'amount': str(tick.amount) if isinstance(tick.amount, Decimal) else tick.amount,
-            'total_amount': str(tick.total_amount) if isinstance(tick.total_amount, Decimal) else tick.total_amount,
+            'amount': tick.amount,
+            'total_amount': tick.total_amount,
             'tick_type': tick.tick_type,
             'chg_type': tick.chg_type,
-            'price_chg': str(tick.price_chg) if isinstance(tick.price_chg, Decimal) else tick.price_chg,
+            'price_chg': tick.price_chg,
             'percent_chg': round(float(tick.pct_chg), 2),  # 確保百分比是浮點數並保留兩位小數
             'simtrade': tick.simtrade,
             'suspend': tick.suspend,
@@ -186,7 +188,7 @@ class ShioajiDataSource(AbstractDatasource):
             'ask_side_total_cnt': tick.ask_side_total_cnt,
             'closing_oddlot_shares': tick.closing_oddlot_shares,
             'fixed_trade_vol': tick.fixed_trade_vol
-        })
+        }))
         
     def process_stock_bidask(self, exchange:Exchange, bidask:BidAskSTKv1):
         code = self.code_mapping.get(bidask.code, bidask.code)
@@ -194,31 +196,22 @@ class ShioajiDataSource(AbstractDatasource):
         if bidask.simtrade == True or bidask.suspend == True:
             self.log.info(f"股票五檔(bidask)資料為試搓{bidask.simtrade}或停牌{bidask.suspend}: {code}")
             return
- 
-        # 轉換數據格式，確保 Decimal 數據存儲時是字符串
-        bid_prices = [str(price) if isinstance(price, Decimal) else price for price in bidask.bid_price]
-        bid_volumes = [volume for volume in bidask.bid_volume]
-        diff_bid_vols = [diff for diff in bidask.diff_bid_vol]
 
-        ask_prices = [str(price) if isinstance(price, Decimal) else price for price in bidask.ask_price]
-        ask_volumes = [volume for volume in bidask.ask_volume]
-        diff_ask_vols = [diff for diff in bidask.diff_ask_vol]
-
-        # 存入 Redis Stream
-        return self.redis.xadd(f'shioaji_stock_{code}_bidask_stream', {
+        # 存入 Redis Stream (Decimal 與五檔陣列的轉換由 codec 處理)
+        return self.stream_writer.xadd(f'shioaji_stock_{code}_bidask_stream', encode_entry(STOCK_BIDASK, {
             'ts': bidask.datetime.strftime('%Y-%m-%d %H:%M:%S'),  # 確保格式
             'code': code,
             'exchange': str(exchange),
-            'bid_prices': json.dumps(bid_prices),  # JSON 字符串存儲
-            'bid_volumes': json.dumps(bid_volumes),
-            'diff_bid_vols': json.dumps(diff_bid_vols),  # 委買變化量
-            'ask_prices': json.dumps(ask_prices),
-            'ask_volumes': json.dumps(ask_volumes),
-            'diff_ask_vols': json.dumps(diff_ask_vols),  # 委賣變化量
+            'bid_prices': list(bidask.bid_price),
+            'bid_volumes': list(bidask.bid_volume),
+            'diff_bid_vols': list(bidask.diff_bid_vol),  # 委買變化量
+            'ask_prices': list(bidask.ask_price),
+            'ask_volumes': list(bidask.ask_volume),
+            'diff_ask_vols': list(bidask.diff_ask_vol),  # 委賣變化量
             'suspend': bidask.suspend,  # 停牌資訊
             'simtrade': bidask.simtrade,  # 是否為模擬交易
             'intraday_odd': bidask.intraday_odd  # 是否為盤中零股交易
-        })
+        }))
     
     def process_future_tick(self, exchange: Exchange, tick: TickFOPv1):
         code = self.code_mapping.get(tick.code, tick.code)
@@ -227,28 +220,28 @@ class ShioajiDataSource(AbstractDatasource):
             self.log.info(f"期貨資料(tick)為試搓{tick.simtrade}: {code}")
             return
 
-        # XADD: 新增一個 Stream 條目
-        return self.redis.xadd(f'shioaji_future_{code}_stream', {
+        # XADD: 放入批次緩衝區, 由 StreamWriter 透過 pipeline 寫入 Stream
+        return self.stream_writer.xadd(f'shioaji_future_{code}_stream', encode_entry(FUTURE_TICK, {
             'ts': tick.datetime.strftime('%Y-%m-%d %H:%M:%S'),  # 確保 datetime 轉為 ISO 格式的字符串
             'code': code,
-            'open': str(tick.open) if isinstance(tick.open, Decimal) else tick.open,
-            'close': str(tick.close) if isinstance(tick.close, Decimal) else tick.close,
-            'high': str(tick.high) if isinstance(tick.high, Decimal) else tick.high,
-            'low': str(tick.low) if isinstance(tick.low, Decimal) else tick.low,
+            'open': tick.open,
+            'close': tick.close,
+            'high': tick.high,
+            'low': tick.low,
             'volume': tick.volume,
             'total_volume': tick.total_volume,
-            'amount': str(tick.amount) if isinstance(tick.amount, Decimal) else tick.amount,
-            'total_amount': str(tick.total_amount) if isinstance(tick.total_amount, Decimal) else tick.total_amount,
+            'amount': tick.amount,
+            'total_amount': tick.total_amount,
             'tick_type': tick.tick_type,
             'chg_type': tick.chg_type,
-            'price_chg': str(tick.price_chg) if isinstance(tick.price_chg, Decimal) else tick.price_chg,
+            'price_chg': tick.price_chg,
             'percent_chg': round(float(tick.pct_chg), 2),  # 確保百分比是浮點數並保留兩位小數
             'simtrade': tick.simtrade,
             'ask_side_total_vol': tick.ask_side_total_vol,
             'bid_side_total_vol': tick.bid_side_total_vol,
-            'avg_price': str(tick.avg_price) if isinstance(tick.avg_price, Decimal) else tick.avg_price,
-            'underlying_price': str(tick.underlying_price) if isinstance(tick.underlying_price, Decimal) else tick.underlying_price
-        })
+            'avg_price': tick.avg_price,
+            'underlying_price': tick.underlying_price
+        }))
 
     def process_future_bidask(self, exchange:Exchange, bidask:BidAskFOPv1):
         code = self.code_mapping.get(bidask.code, bidask.code)
@@ -257,31 +250,22 @@ class ShioajiDataSource(AbstractDatasource):
             self.log.info(f"期貨五檔(bidask)資料為試搓{bidask.simtrade}: {code}")
             return
 
-        # 轉換數據格式，確保 Decimal 數據存儲時是字符串
-        bid_prices = [str(price) if isinstance(price, Decimal) else price for price in bidask.bid_price]
-        bid_volumes = [volume for volume in bidask.bid_volume]
-        diff_bid_vols = [diff for diff in bidask.diff_bid_vol]
-
-        ask_prices = [str(price) if isinstance(price, Decimal) else price for price in bidask.ask_price]
-        ask_volumes = [volume for volume in bidask.ask_volume]
-        diff_ask_vols = [diff for diff in bidask.diff_ask_vol]
-
-        # 存入 Redis Stream
-        return self.redis.xadd(f'shioaji_future_{code}_bidask_stream', {
+        # 存入 Redis Stream (Decimal 與五檔陣列的轉換由 codec 處理)
+        return self.stream_writer.xadd(f'shioaji_future_{code}_bidask_stream', encode_entry(FUTURE_BIDASK, {
             'ts': bidask.datetime.strftime('%Y-%m-%d %H:%M:%S'),  # 確保格式
             'code': code,
             'bid_total_vol': bidask.bid_total_vol,  # 委買總量
             'ask_total_vol': bidask.ask_total_vol,  # 委賣總量
-            'bid_prices': json.dumps(bid_prices),  # 存 JSON 字符串
-            'bid_volumes': json.dumps(bid_volumes),
-            'diff_bid_vols': json.dumps(diff_bid_vols),  # 委買變化量
-            'ask_prices': json.dumps(ask_prices),
-            'ask_volumes': json.dumps(ask_volumes),
-            'diff_ask_vols': json.dumps(diff_ask_vols),  # 委賣變化量
-            'first_derived_bid_price': str(bidask.first_derived_bid_price) if isinstance(bidask.first_derived_bid_price, Decimal) else bidask.first_derived_bid_price,
-            'first_derived_ask_price': str(bidask.first_derived_ask_price) if isinstance(bidask.first_derived_ask_price, Decimal) else bidask.first_derived_ask_price,
+            'bid_prices': list(bidask.bid_price),
+            'bid_volumes': list(bidask.bid_volume),
+            'diff_bid_vols': list(bidask.diff_bid_vol),  # 委買變化量
+            'ask_prices': list(bidask.ask_price),
+            'ask_volumes': list(bidask.ask_volume),
+            'diff_ask_vols': list(bidask.diff_ask_vol),  # 委賣變化量
+            'first_derived_bid_price': bidask.first_derived_bid_price,
+            'first_derived_ask_price': bidask.first_derived_ask_price,
             'first_derived_bid_vol': bidask.first_derived_bid_vol,
             'first_derived_ask_vol': bidask.first_derived_ask_vol,
-            'underlying_price': str(bidask.underlying_price) if isinstance(bidask.underlying_price, Decimal) else bidask.underlying_price,
+            'underlying_price': bidask.underlying_price,
             'simtrade': bidask.simtrade,  # 是否為模擬交易
-        })
+        }))
@@ -0,0 +1,162 @@
+import os, json, struct, base64
+from decimal import Decimal
+from dotenv import load_dotenv
+load_dotenv()
+
+"""
+Stream 條目編碼:
+binary 模式下每筆條目只有一個欄位 'd', 內容為 base64(版本 + 種類 + 固定寬度數值欄位)
+(連線使用 decode_responses=True, 原始 bytes 無法直接存取, 因此以 base64 包裝)
+string 模式維持原本逐欄位字串化 + 五檔陣列 json.dumps 的格式, 作為回退方案
+decode_entry 兩種格式皆可解析, 切換模式時舊資料仍可讀取
+"""
+
+CODEC_VERSION = 1
+BINARY_FIELD = 'd'
+
+# 條目種類
+FUTURE_TICK = 1
+STOCK_TICK = 2
+FUTURE_BIDASK = 3
+STOCK_BIDASK = 4
+
+DEPTH = 5  # 五檔
+
+# 欄位順序與格式 (s: 定長字串, d: 浮點數, q: 整數, b: 小整數, ?: 布林, 數字前綴: 五檔陣列)
+_LAYOUTS = {
+    FUTURE_TICK: (
+        ('ts', '19s'), ('code', '16s'),
+        ('open', 'd'), ('close', 'd'), ('high', 'd'), ('low', 'd'),
+        ('volume', 'q'), ('total_volume', 'q'), ('amount', 'd'), ('total_amount', 'd'),
+        ('tick_type', 'b'), ('chg_type', 'b'), ('price_chg', 'd'), ('percent_chg', 'd'),
+        ('simtrade', '?'), ('ask_side_total_vol', 'q'), ('bid_side_total_vol', 'q'),
+        ('avg_price', 'd'), ('underlying_price', 'd')
+    ),
+    STOCK_TICK: (
+        ('ts', '19s'), ('code', '16s'),
+        ('open', 'd'), ('close', 'd'), ('high', 'd'), ('low', 'd'),
+        ('volume', 'q'), ('total_volume', 'q'), ('amount', 'd'), ('total_amount', 'd'),
+        ('tick_type', 'b'), ('chg_type', 'b'), ('price_chg', 'd'), ('percent_chg', 'd'),
+        ('simtrade', '?'), ('suspend', '?'), ('intraday_odd', '?'),
+        ('bid_side_total_vol', 'q'), ('ask_side_total_vol', 'q'),
+        ('bid_side_total_cnt', 'q'), ('ask_side_total_cnt', 'q'),
+        ('closing_oddlot_shares', 'q'), ('fixed_trade_vol', 'q')
+    ),
+    FUTURE_BIDASK: (
+        ('ts', '19s'), ('code', '16s'),
+        ('bid_total_vol', 'q'), ('ask_total_vol', 'q'),
+        ('bid_prices', f'{DEPTH}d'), ('bid_volumes', f'{DEPTH}q'), ('diff_bid_vols', f'{DEPTH}q'),
+        ('ask_prices', f'{DEPTH}d'), ('ask_volumes', f'{DEPTH}q'), ('diff_ask_vols', f'{DEPTH}q'),
+        ('first_derived_bid_price', 'd'), ('first_derived_ask_price', 'd'),
+        ('first_derived_bid_vol', 'q'), ('first_derived_ask_vol', 'q'),
+        ('underlying_price', 'd'), ('simtrade', '?')
+    ),
+    STOCK_BIDASK: (
+        ('ts', '19s'), ('code', '16s'), ('exchange', '16s'),
+        ('bid_prices', f'{DEPTH}d'), ('bid_volumes', f'{DEPTH}q'), ('diff_bid_vols', f'{DEPTH}q'),
+        ('ask_prices', f'{DEPTH}d'), ('ask_volumes', f'{DEPTH}q'), ('diff_ask_vols', f'{DEPTH}q'),
+        ('suspend', '?'), ('simtrade', '?'), ('intraday_odd', '?')
+    )
+}
+
+# string 模式下以 json.dumps 存放的五檔欄位
+ARRAY_FIELDS = ('bid_prices', 'bid_volumes', 'diff_bid_vols', 'ask_prices', 'ask_volumes', 'diff_ask_vols')
+
+_HEADER = struct.Struct('<BB')
+
+def _compile(layout):
+    fmt = '<' + ''.join(f for _, f in layout)
+    columns = []  # (欄位名稱, 類型, 陣列長度)
+    for name, f in layout:
+        if f.endswith('s'):
+            columns.append((name, 's', 1))
+        elif len(f) > 1:
+            columns.append((name, f[-1], int(f[:-1])))
+        else:
+            columns.append((name, f, 0))
+    return struct.Struct(fmt), tuple(columns)
+
+_STRUCTS = {kind: _compile(layout) for kind, layout in _LAYOUTS.items()}
+
+def get_codec_mode():
+    return os.getenv('STREAM_CODEC', 'binary').lower()
+
+def _num(value, type):
+    if value is None or value == '':
+        return 0 if type != 'd' else 0.0
+    if type == 'd':
+        return float(value)
+    if type == '?':
+        return bool(value)
+    return int(value)
+
+def pack(kind, values):
+    """依照種類打包成 base64 字串"""
+    body, columns = _STRUCTS[kind]
+    args = []
+    for name, type, size in columns:
+        value = values.get(name)
+        if type == 's':
+            args.append(str(value or '').encode('utf-8'))
+        elif size:
+            seq = list(value or [])[:size]
+            seq += [0] * (size - len(seq))
+            args.extend(_num(v, type) for v in seq)
+        else:
+            args.append(_num(value, type))
+
+    raw = _HEADER.pack(CODEC_VERSION, kind) + body.pack(*args)
+    return base64.b64encode(raw).decode('ascii')
+
+def unpack(payload):
+    """解析 base64 字串, 回傳數值型別的 dict"""
+    raw = base64.b64decode(payload)
+    version, kind = _HEADER.unpack_from(raw)
+    if version != CODEC_VERSION:
+        raise ValueError(f"不支援的 stream 編碼版本: {version}")
+
+    body, columns = _STRUCTS[kind]
+    flat = body.unpack_from(raw, _HEADER.size)
+
+    result, i = {}, 0
+    for name, type, size in columns:
+        if type == 's':
+            result[name] = flat[i].rstrip(b'\x00').decode('utf-8')
+            i += 1
+        elif size:
+            result[name] = list(flat[i:i + size])
+            i += size
+        else:
+            result[name] = flat[i]
+            i += 1
+    return result
+
+def _stringify(values):
+    """string 模式: 維持原本的欄位格式(Decimal 轉字串, 五檔 json.dumps)"""
+    fields = {}
+    for name, value in values.items():
+        if name in ARRAY_FIELDS:
+            fields[name] = json.dumps([str(v) if isinstance(v, Decimal) else v for v in value])
+        elif isinstance(value, Decimal):
+            fields[name] = str(value)
+        elif isinstance(value, bool):
+            fields[name] = int(value)  # redis 不接受布林值
+        else:
+            fields[name] = value
+    return fields
+
+def encode_entry(kind, values):
+    """將回調資料轉為要 XADD 的欄位"""
+    if get_codec_mode() == 'string':
+        return _stringify(values)
+    return {BINARY_FIELD: pack(kind, values)}
+
+def decode_entry(fields):
+    """解析 stream 條目, 支援 binary 與 string 兩種格式"""
+    if BINARY_FIELD in fields and len(fields) == 1:
+        return unpack(fields[BINARY_FIELD])
+
+    for name in ARRAY_FIELDS:
+        if name in fields and isinstance(fields[name], str):
+            fields[name] = json.loads(fields[name])
+    return fields
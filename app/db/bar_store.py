@@ -0,0 +1,93 @@
+import os, json
+import numpy as np
+import pandas as pd
+from db.redis import get_redis_connection
+from utils.log import get_module_logger
+from dotenv import load_dotenv
+load_dotenv()
+
+"""
+K 棒環狀緩衝:
+每根完成的 K 棒以固定寬度的二進位紀錄(ts, open, high, low, close, volume)存放在 {K 棒 key}_ring 列表中,
+只保留最近 BAR_RING_SIZE 根; 讀取時以 LRANGE 取出最近 N 筆後直接 np.frombuffer, 不需逐筆 json.loads 與 strptime
+原本的 JSON K 棒列表仍保留(跨日保存、歷史回補使用), 環狀緩衝落後時會由 JSON 列表重建
+"""
+
+BAR_DTYPE = np.dtype([
+    ('ts', '<M8[s]'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'), ('volume', '<i8')
+])
+RING_SIZE = int(os.getenv('BAR_RING_SIZE', 20000))
+
+log = get_module_logger('db/bar_store')
+
+def ring_key(redis_k_key):
+    """環狀緩衝的 key, 以 hash tag 與 K 棒列表、快照放在同一個 slot"""
+    return f"{{{redis_k_key}}}_ring"
+
+def pack_bars(bars):
+    """將 K 棒 dict 列表打包為固定寬度的二進位紀錄列表"""
+    array = np.array(
+        [(bar['ts'][:19], bar['open'], bar['high'], bar['low'], bar['close'], int(bar['volume'])) for bar in bars],
+        dtype=BAR_DTYPE
+    )
+    raw, size = array.tobytes(), BAR_DTYPE.itemsize
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+def append_bars(redis_cli, redis_k_key, bars):
+    """寫入完成的 K 棒並裁剪為最近 RING_SIZE 根"""
+    if not bars:
+        return
+
+    key = ring_key(redis_k_key)
+    pipe = redis_cli.pipeline(transaction=False)
+    pipe.rpush(key, *pack_bars(bars))
+    pipe.ltrim(key, -RING_SIZE, -1)
+    pipe.execute()
+
+def rebuild_ring(redis_cli, redis_k_key):
+    """由 JSON K 棒列表重建環狀緩衝(首次使用或由跨日保存資料重新寫入時)"""
+    bars = [json.loads(record) for record in redis_cli.lrange(redis_k_key, -RING_SIZE, -1)]
+    bars.sort(key=lambda bar: bar['ts'])
+
+    key = ring_key(redis_k_key)
+    pipe = redis_cli.pipeline(transaction=False)
+    pipe.delete(key)
+    if bars:
+        pipe.rpush(key, *pack_bars(bars))
+    pipe.execute()
+    log.info(f"重建 K 棒環狀緩衝: {redis_k_key}, 筆數: {len(bars)}")
+
+def load_bars(redis_k_key, count=None, frame=False):
+    """
+    讀取最近 count 根 K 棒(None 為全部), 回傳 NumPy 結構化陣列, frame=True 時回傳 DataFrame
+    單次 pipeline 同時檢查環狀緩衝是否落後於 JSON 列表
+    """
+    bars = load_bars_many([redis_k_key], count)[redis_k_key]
+    if not frame:
+        return bars
+
+    df = pd.DataFrame(bars)
+    df['ts'] = df['ts'].astype('datetime64[ns]')
+    return df
+
+def load_bars_many(redis_k_keys, count=None):
+    """以單次 pipeline 讀取多個 K 棒 key 最近 count 根, 回傳 {key: 結構化陣列}"""
+    binary = get_redis_connection(decode_responses=False)
+    start = -count if count else 0
+
+    pipe = binary.pipeline(transaction=False)
+    for redis_k_key in redis_k_keys:
+        key = ring_key(redis_k_key)
+        pipe.llen(key)
+        pipe.llen(redis_k_key)
+        pipe.lrange(key, start, -1)
+    replies = pipe.execute()
+
+    result = {}
+    for i, redis_k_key in enumerate(redis_k_keys):
+        ring_len, list_len, records = replies[i * 3:i * 3 + 3]
+        if ring_len < min(list_len, RING_SIZE):
+            rebuild_ring(get_redis_connection(), redis_k_key)
+            records = binary.lrange(ring_key(redis_k_key), start, -1)
+        result[redis_k_key] = np.frombuffer(b''.join(records), dtype=BAR_DTYPE)
+    return result
@@ -0,0 +1,57 @@
+from utils.log import get_module_logger
+
+class CycleState:
+    """
+    策略每輪計算的 Redis hash 狀態快照:
+    - prefetch: 一次 pipeline 批次 HGETALL 本輪宣告的所有 key (叢集模式下 redis-py 會依 slot 分組送往各節點)
+    - hgetall: 之後的讀取直接使用快照, 未宣告的 key 才退回單次讀取並加入快照
+    - hset: 寫入先暫存並同步更新快照, 本輪結束時 flush 以一次 pipeline 寫回
+    """
+    def __init__(self, redis_cli):
+        self.redis = redis_cli
+        self.log = get_module_logger('db/cycle_state')
+        self._data = {}  # {key: {field: value}}
+        self._writes = {}  # {key: {field: value}}
+
+    def prefetch(self, keys):
+        keys = [key for key in dict.fromkeys(keys) if key and key not in self._data]
+        if not keys:
+            return self
+
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+
+        for key, data in zip(keys, pipe.execute()):
+            self._data[key] = data or {}
+        return self
+
+    def hgetall(self, key):
+        if key not in self._data:
+            self._data[key] = self.redis.hgetall(key) or {}
+            self._data[key].update(self._writes.get(key, {}))  # 尚未寫回的欄位
+        return self._data[key]
+
+    def hset(self, key, mapping):
+        self._writes.setdefault(key, {}).update(mapping)
+        if key in self._data:
+            self._data[key].update(mapping)
+
+    def invalidate(self, key):
+        """key 已由其他路徑直接寫入 Redis(例如倉位), 下次讀取時重新取得"""
+        self._data.pop(key, None)
+
+    def flush(self):
+        if not self._writes:
+            return
+
+        writes, self._writes = self._writes, {}
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, mapping in writes.items():
+                pipe.hset(key, mapping=mapping)
+            pipe.execute()
+        except Exception as e:
+            self.log.error(f"寫回策略狀態失敗: {list(writes)}, {e}")
+            for key, mapping in writes.items(): # 保留未寫回的欄位, 下次 flush 重試
+                self._writes[key] = {**mapping, **self._writes.get(key, {})}
@@ -2,31 +2,41 @@ import os, json, redis, pytz, ast, shutil
 import pandas as pd
 from datetime import timedelta, datetime, time
 from pathlib import Path
+from collections import defaultdict
 from utils.log import get_module_logger
 from utils.k import convert_ohlcv
+from utils.bar import get_bar_key
 from utils.file import open_json_file
 import shioaji as sj
+from distutils.util import strtobool
 from dotenv import load_dotenv
 load_dotenv()
 
 log = get_module_logger('redis')
 _redis_instance = None  # 用於存儲 Redis 單例實例
+_binary_instance = None  # 不解碼回應的連線, 讀取二進位資料(K 棒環狀緩衝)使用
 
-def get_redis_connection():
-    global _redis_instance
-    if _redis_instance is None:  # 如果尚未創建連線，則創建
+def get_redis_connection(decode_responses=True):
+    global _redis_instance, _binary_instance
+    instance = _redis_instance if decode_responses else _binary_instance
+    if instance is None:  # 如果尚未創建連線，則創建
         if os.getenv('REDIS_HOST') in ['redis', '127.0.0.1']:
-            _redis_instance = redis.StrictRedis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), decode_responses=True)
+            instance = redis.StrictRedis(host=os.getenv('REDIS_HOST'), port=os.getenv('REDIS_PORT'), decode_responses=decode_responses)
         else:
-            _redis_instance = redis.RedisCluster(
+            instance = redis.RedisCluster(
                 host=os.getenv("REDIS_HOST"),
                 port=os.getenv("REDIS_PORT"),
-                decode_responses=True,
+                decode_responses=decode_responses,
                 skip_full_coverage_check=True,
                 readonly_mode=True  # 可選：讀取分擔到從節點
             )
+
+        if decode_responses:
+            _redis_instance = instance
+        else:
+            _binary_instance = instance
         
-    return _redis_instance  # 返回已存在的連線實例
+    return instance  # 返回已存在的連線實例
 
 # 判斷是否需要 night 過濾（下午 2:00 後）
 def night_filter(current_time):
@@ -43,6 +53,7 @@ def set_redis_consumer(item, redis_cli=None):
         redis_cli = get_redis_connection()
     
     log.info("即將創建redis的consumer_gruop去讀取redis_stream")
+    recover = strtobool(os.getenv('STREAM_RECOVER_PENDING', 'false'))
     
     # 獲取當前時間（考慮時區）
     current_time = datetime.now(pytz.timezone("Asia/Taipei")).time()
@@ -55,20 +66,98 @@ def set_redis_consumer(item, redis_cli=None):
                 log.info(f"跳過 strategy: {sub_item['strategy']}，night 未設定或為 False")
                 continue
             
-            for code in sub_item['code']:
+            # 同一個策略項目的所有 stream 使用同一個 group / consumer, 才能以單次 XREADGROUP 讀取
+            broker = sub_item['params']['broker']
+            group = get_group_name(broker, symbol, sub_item['strategy'])
+            consumer = get_consumer_name(broker, symbol, sub_item['strategy'])
+            
+            for code, (data_redis_key, bidask_redis_key) in get_stream_keys(broker, symbol, sub_item['code']).items():
                 log.info(f"當前創建的stream為: {code}")
-                data_redis_key = f"{sub_item['params']['broker']}_{symbol}_{code}_stream"
-                data_group_name = f"{sub_item['params']['broker']}_{symbol}_{code}_{sub_item['strategy']}_group"
-                bidask_redis_key = f"{sub_item['params']['broker']}_{symbol}_{code}_bidask_stream"
-                bidask_group_name = f"{sub_item['params']['broker']}_{symbol}_{code}_{sub_item['strategy']}_group"
+                create_consumer_group(redis_cli, data_redis_key, group=group)
+                create_consumer_group(redis_cli, bidask_redis_key, group=group)
+                create_consumer_group(redis_cli, data_redis_key, group=get_bar_group_name(broker, symbol))  # K 棒合成
                 
-                create_consumer_group(redis_cli, data_redis_key, group=data_group_name)
-                create_consumer_group(redis_cli, bidask_redis_key, group=bidask_group_name)
+                if recover: # 回收上次執行遺留在 PEL 中的條目
+                    recover_pending(redis_cli, data_redis_key, group, consumer)
+                    recover_pending(redis_cli, bidask_redis_key, group, consumer)
+                    recover_pending(redis_cli, data_redis_key, get_bar_group_name(broker, symbol), get_bar_consumer_name(broker, symbol))
                 
                 log.info(f"當前 {code} 已經創建完畢, 將創建下一個\n")
     
     return
 
+def get_stream_keys(broker, symbol, codes):
+    """回傳 {code: (tick_stream, bidask_stream)}"""
+    return {code: (f"{broker}_{symbol}_{code}_stream", f"{broker}_{symbol}_{code}_bidask_stream") for code in codes}
+
+def get_group_name(broker, symbol, strategy):
+    return f"{broker}_{symbol}_{strategy}_group"
+
+def get_consumer_name(broker, symbol, strategy):
+    return f"consumer_{broker}_{symbol}_{strategy}"
+
+def get_bar_group_name(broker, symbol):
+    """BarService 讀取 tick stream 使用的 group"""
+    return f"{broker}_{symbol}_bar_group"
+
+def get_bar_consumer_name(broker, symbol):
+    return f"consumer_{broker}_{symbol}_bar"
+
+def read_streams(redis_cli, group, consumer, stream_keys, block=None, count=None, max_rounds=None, max_count=None):
+    """
+    讀取同一個 group 下的多個 stream, 最多只等待一次 block 毫秒:
+    單機模式以一次 XREADGROUP 讀取全部 stream
+    集群模式下 stream 分散在不同 slot, 依 slot 分組後以 pipeline 做非阻塞讀取(同一 slot 的 stream 一次讀取),
+    全部為空時各組輪流阻塞等待 block / 組數 毫秒, 任一組收到資料即停止, 總等待不超過 block
+    若有 stream 讀滿 count 筆, 代表仍有積壓, 以加倍的 count 繼續非阻塞讀取(最多 max_rounds 輪)
+    回傳 {stream_key: [(entry_id, fields), ...]}
+    """
+    block = (int(os.getenv('STREAM_READ_BLOCK_MS', 100)) if block is None else block) or None  # 0 代表不阻塞(XREADGROUP 的 BLOCK 0 為永久等待)
+    count = int(os.getenv('STREAM_READ_COUNT', 10)) if count is None else count
+    max_rounds = int(os.getenv('STREAM_READ_MAX_ROUNDS', 4)) if max_rounds is None else max_rounds
+    max_count = int(os.getenv('STREAM_READ_MAX_COUNT', 1000)) if max_count is None else max_count
+    standalone = isinstance(redis_cli, redis.StrictRedis)
+    slots = defaultdict(list)
+    if not standalone:
+        for key in stream_keys:
+            slots[redis_cli.keyslot(key)].append(key)
+    
+    def read_once(read_count, read_block):
+        if standalone:
+            response = redis_cli.xreadgroup(group, consumer, streams={key: '>' for key in stream_keys}, count=read_count, block=read_block)
+            return {key: messages for key, messages in response or []}
+        
+        pipe = redis_cli.pipeline(transaction=False)
+        for keys in slots.values():
+            pipe.xreadgroup(group, consumer, streams={key: '>' for key in keys}, count=read_count)
+        result = {key: messages for response in pipe.execute() for key, messages in response or []}
+        
+        if not result and read_block: # 全部為空時, 各 slot 組輪流阻塞等待
+            slot_block = max(read_block // len(slots), 1)
+            for keys in slots.values():
+                response = redis_cli.xreadgroup(group, consumer, streams={key: '>' for key in keys}, count=read_count, block=slot_block)
+                result = {key: messages for key, messages in response or []}
+                if result: # 等到資料後, 其他 stream 可能也已寫入
+                    for key, messages in read_once(read_count, None).items():
+                        result.setdefault(key, []).extend(messages)
+                    break
+        return result
+    
+    messages = defaultdict(list)
+    read_count, read_block = count, block
+    for _ in range(max(max_rounds, 1)):
+        result = read_once(read_count, read_block)
+        for key, entries in result.items():
+            messages[key].extend(entries)
+        
+        # 沒有任何 stream 讀滿, 代表已讀完積壓資料
+        if not any(len(entries) >= read_count for entries in result.values()):
+            break
+        
+        read_count, read_block = min(read_count * 2, max_count), None
+    
+    return dict(messages)
+
 def create_consumer_group(redis_cli, stream_key, group):
     try:
         log.info(f"創建consumer_gruop中: {stream_key} / {group}")
@@ -81,6 +170,52 @@ def create_consumer_group(redis_cli, stream_key, group):
         else:
             raise  # 其他錯誤則重新拋出
         
+def recover_pending(redis_cli, stream_key, group, consumer, min_idle_time=None, count=1000):
+    """
+    以 XAUTOCLAIM 接手閒置超過 min_idle_time 毫秒的 pending 條目並直接 XACK
+    (行情資料過期後已無重新計算的意義, 只需將 PEL 清空), 回傳回收筆數
+    """
+    if min_idle_time is None:
+        min_idle_time = int(os.getenv('STREAM_RECOVER_IDLE_MS', 60000))
+    
+    start_id, recovered = '0-0', 0
+    try:
+        while True:
+            result = redis_cli.xautoclaim(stream_key, group, consumer, min_idle_time, start_id=start_id, count=count, justid=True)
+            start_id, claimed = result[0], result[1]
+            if claimed:
+                recovered += redis_cli.xack(stream_key, group, *claimed)
+            if start_id in ('0-0', b'0-0'):
+                break
+    except redis.exceptions.ResponseError as e:
+        log.error(f"回收 pending 條目失敗: {stream_key} / {group}, {e}")
+    
+    if recovered:
+        log.info(f"回收 pending 條目: {stream_key} / {group}, 筆數: {recovered}")
+    return recovered
+
+def ack_entries(redis_cli, acks):
+    """
+    批次 XACK 並回傳各 group 的 PEL 大小
+    acks: {(stream_key, group): [entry_id, ...]}
+    """
+    if not acks:
+        return {}
+    
+    pipe = redis_cli.pipeline(transaction=False)
+    pairs = [pair for pair, ids in acks.items() if ids]
+    for (stream_key, group) in pairs:
+        pipe.xack(stream_key, group, *acks[(stream_key, group)])
+    for (stream_key, group) in pairs:
+        pipe.xpending(stream_key, group)
+    results = pipe.execute()
+    
+    pel_sizes = {f"{stream_key}|{group}": (pending or {}).get('pending', 0) for (stream_key, group), pending in zip(pairs, results[len(pairs):])}
+    if pel_sizes: # PEL 大小指標
+        redis_cli.hset('stream_pel_sizes', mapping=pel_sizes)
+    
+    return pel_sizes
+
 async def clear_redis(lock, output_dir="data/preserve"):
     """
     定時清理redis任務:
@@ -325,7 +460,7 @@ async def clear_redis(lock, output_dir="data/preserve"):
     def fetch_data(output_dir):
         clean_k_folders(output_dir)
         result = []
-        seen_pairs = set()  # 去重 (code, strategy, timeframe)
+        seen_pairs = set()  # 去重 (broker, code, timeframe), K 棒由 BarService 統一合成, 各策略共用
         current_time = datetime.now(pytz.timezone("Asia/Taipei")).time()
 
         for item_key, item_list in items.items():
@@ -336,53 +471,30 @@ async def clear_redis(lock, output_dir="data/preserve"):
                 if night_filter(current_time) and not params.get("night", False):
                     log.info(f"當前判斷是否要列入重新獲取的清單, 跳過 strategy: {item['strategy']}，night 未設定或為 False")
                     continue
+
+                # 只有 cross_day=True 的項目需要保留跨日 K 棒
+                if params.get('cross_day') is not True:
+                    continue
                 
                 k_time = params.get('K_time', 1)
                 for code in item['code']:
                     # 去重
-                    pair = (code, item['strategy'], k_time)
+                    pair = (params.get('broker'), code, k_time)
                     if pair in seen_pairs:
                         continue
                     seen_pairs.add(pair)
 
-                    # 添加到結果，包含完整鍵
+                    full_key = get_bar_key(params.get('broker'), code, k_time)  # 例如 shioaji_MXFR1_60k
                     result.append({
                         'code': code,
                         'strategy': item['strategy'],
                         'timeframe': k_time,
-                        'full_key': f"{code}_{item['strategy']}_{k_time}k"  # 拼接原始key，例如 MXFR1_statarb1_60k
+                        'full_key': full_key,
+                        'item_key': item_key,  # 商品類型（例如 'future'）
+                        'output_path': os.path.join(output_dir, 'bars', full_key)
                     })
 
-        # 驗證 code 和 strategy 是否在 cross_day=True 的 items 中
-        valid_result = []
-        for pair in result:
-            code = pair['code']
-            strategy = pair['strategy']
-            full_key = pair['full_key']
-            
-            # 檢查 items 中是否有匹配的 code 和 strategy 且 cross_day=True
-            is_valid = False
-            for item_key, item_list in items.items():
-                for item in item_list:
-                    if (isinstance(item.get('params'), dict) and 
-                        item['params'].get('cross_day') is True and
-                        code in item.get('code', []) and 
-                        item.get('strategy') == strategy):
-                        is_valid = True
-                        pair['item_key'] = item_key  # 儲存商品類型（例如 'future'）
-                        pair['output_path'] = os.path.join(output_dir, strategy, full_key)
-                        break
-                    
-                if is_valid:
-                    break
-                
-            if is_valid:
-                valid_result.append(pair)
-                
-            else:
-                log.warning(f"code {code} 和 strategy {strategy} 未找到對應的 cross_day=True item")
-
-        return valid_result # 返回 [{'code': 'TMFR1', 'strategy': 'bilateral', 'timeframe': '1', 'full_key': 'TMFR1_bilateral_1k', 'item_key': 'future', 'output_path': 'data/preserve/future/TMFR1_bilateral_1k'}, ...]
+        return result # 返回 [{'code': 'TMFR1', 'strategy': 'bilateral', 'timeframe': '1', 'full_key': 'shioaji_TMFR1_1k', 'item_key': 'future', 'output_path': 'data/preserve/bars/shioaji_TMFR1_1k'}, ...]
     
     def reinsert_data(output_dir):
         for root, _, files in os.walk(output_dir):
@@ -487,6 +599,24 @@ async def clear_redis(lock, output_dir="data/preserve"):
         log.info(f"所有的redis_key:{all_keys}")     
         return all_keys
                         
+    def archive_streams():
+        from db.stream import get_stream_retention  # 避免循環引用
+        
+        retention = get_stream_retention()
+        if not retention.archive:
+            return
+        
+        for key in scan_all_key():
+            if not key.endswith('_stream') or redis_conn.type(key) != 'stream':
+                continue
+            try:
+                archived = retention.archive_stream(key)
+                log.info(f"清空前歸檔 stream: {key}, 筆數: {archived}")
+            except Exception as e:
+                log.error(f"歸檔 stream {key} 失敗: {e}")
+        
+        return
+                        
     # -----------------  清理資料主程序 ------------------
     # 儲存保留的鍵和重新獲取歷史資料
     preserved_data = {}
@@ -553,6 +683,9 @@ async def clear_redis(lock, output_dir="data/preserve"):
     refetch_list = fetch_data(output_dir)
     history_refetch(refetch_list)
     
+    # 清空前將 stream 剩餘的條目寫入歸檔
+    archive_streams()
+    
     # 清空 Redis 資料庫
     try:
         redis_conn.flushall()
@@ -0,0 +1,374 @@
+import os, threading, time, json, pytz
+from datetime import datetime
+from collections import defaultdict
+from distutils.util import strtobool
+from db.redis import get_redis_connection
+from utils.log import get_module_logger
+from dotenv import load_dotenv
+load_dotenv()
+
+log = get_module_logger('db/stream')
+_stream_writer = None  # 用於存儲 StreamWriter 單例實例
+_stream_retention = None  # 用於存儲 StreamRetention 單例實例
+_stream_lock = threading.Lock()  # 資料源執行緒與主程序可能同時取得單例
+
+class StreamWriter:
+    """
+    批次寫入 Redis Stream:
+    行情回調只把資料放進記憶體緩衝區(依 stream key 分組), 由獨立的 flusher 執行緒
+    在累積到 batch_size 筆或超過 flush_interval 時, 透過 pipeline 一次送出 XADD
+    緩衝區已滿(max_pending)時回調最多等待 block_timeout 秒, 仍然滿則丟棄該筆並計數
+    寫入失敗的條目放回緩衝區最前面, 於下一次 flush 重試; 放回後超過 max_pending 的部分(較舊的條目)才丟棄
+    """
+    def __init__(self, redis_cli=None, batch_size=64, flush_interval=0.005, max_pending=10000, block_timeout=0.05, stats_interval=60, retention=None):
+        self.redis = redis_cli or get_redis_connection()
+        self.retention = retention  # 保留策略(未啟用歸檔時於 XADD 帶上 MAXLEN/MINID)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+
+        self._buffer = defaultdict(list)  # {stream_key: [fields, ...]}
+        self._keys = set()  # 寫入過的 stream key
+        self._listeners = []  # flush 完成後的回調, 參數為本次寫入的 stream key
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._retry_delay = 0  # 寫入失敗後下一次 flush 前的等待秒數(每次失敗加倍, 最多 1 秒)
+
+        # 統計數據
+        self._stats = {
+            'flushes': 0,         # flush 次數
+            'entries': 0,         # 成功寫入筆數
+            'dropped': 0,         # 背壓或寫入失敗無法重新排入而丟棄的筆數
+            'errors': 0,          # flush 失敗筆數
+            'requeued': 0,        # 寫入失敗後重新排入緩衝區的筆數
+            'last_flush_size': 0, # 最近一次 flush 筆數
+            'max_flush_size': 0,  # 單次 flush 最大筆數
+            'last_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+            'total_latency_ms': 0.0
+        }
+        self._last_report = time.monotonic()
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+
+        self._thread = threading.Thread(target=self._run, name='stream-writer', daemon=True)
+        self._thread.start()
+        log.info(f"StreamWriter 啟動, batch_size: {self.batch_size}, flush_interval: {self.flush_interval}s, max_pending: {self.max_pending}")
+        return self
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+        self._flush()  # 送出剩餘資料
+        if self._pending:
+            log.warning(f"StreamWriter 停止時仍有 {self._pending} 筆資料未寫入")
+        log.info(f"StreamWriter 停止, 統計: {self.stats()}")
+
+    def xadd(self, stream_key, fields):
+        """放入緩衝區, 回傳是否成功排入(背壓逾時則回傳 False)"""
+        with self._cond:
+            if self._pending >= self.max_pending:
+                deadline = time.monotonic() + self.block_timeout
+                while self._pending >= self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['dropped'] += 1
+                        if self._stats['dropped'] % 1000 == 1:
+                            log.warning(f"StreamWriter 緩衝區已滿({self._pending}), 丟棄資料: {stream_key}, 累計丟棄: {self._stats['dropped']}")
+                        return False
+                    self._cond.wait(remaining)
+
+            self._buffer[stream_key].append(fields)
+            self._keys.add(stream_key)
+            self._pending += 1
+
+            if self._pending >= self.batch_size:
+                self._cond.notify_all()
+
+        return True
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def keys(self):
+        with self._cond:
+            return list(self._keys)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+
+        stats['avg_latency_ms'] = round(stats['total_latency_ms'] / stats['flushes'], 3) if stats['flushes'] else 0.0
+        stats['avg_flush_size'] = round(stats['entries'] / stats['flushes'], 2) if stats['flushes'] else 0.0
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and self._retry_delay: # 寫入失敗後退避, 避免 Redis 異常時連續重試
+                    deadline = time.monotonic() + self._retry_delay
+                    while self._running and time.monotonic() < deadline:
+                        self._cond.wait(deadline - time.monotonic())
+                elif self._running and self._pending < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+
+                if not self._running:
+                    break
+
+            self._flush()
+            self._report()
+
+    def _flush(self):
+        with self._cond:
+            if not self._pending:
+                return
+            batch, self._buffer = self._buffer, defaultdict(list)
+            size, self._pending = self._pending, 0
+            self._cond.notify_all()  # 喚醒因背壓等待的回調
+
+        start = time.perf_counter()
+        commands = [(stream_key, fields) for stream_key, entries in batch.items() for fields in entries]
+        try:
+            options = self.retention.xadd_options() if self.retention else {}
+            pipe = self.redis.pipeline(transaction=False)
+            for stream_key, fields in commands:
+                pipe.xadd(stream_key, fields, **options)
+            results = pipe.execute(raise_on_error=False)  # 個別指令失敗時只重試失敗的條目
+            failed = [command for command, result in zip(commands, results) if isinstance(result, Exception)]
+            error = next((result for result in results if isinstance(result, Exception)), None)
+        except Exception as e: # 連線錯誤等, 整批重試
+            failed, error = commands, e
+
+        keys = list(batch.keys())
+        if failed:
+            self._requeue(failed, error)
+            if len(failed) == size:
+                return
+            keys = list(dict.fromkeys(stream_key for (stream_key, _), result in zip(commands, results) if not isinstance(result, Exception)))
+            size -= len(failed)
+
+        latency = (time.perf_counter() - start) * 1000
+        with self._cond:
+            self._retry_delay = 0 if not failed else self._retry_delay
+            self._stats['flushes'] += 1
+            self._stats['entries'] += size
+            self._stats['last_flush_size'] = size
+            self._stats['max_flush_size'] = max(self._stats['max_flush_size'], size)
+            self._stats['last_latency_ms'] = round(latency, 3)
+            self._stats['max_latency_ms'] = round(max(self._stats['max_latency_ms'], latency), 3)
+            self._stats['total_latency_ms'] += latency
+
+        for callback in self._listeners:
+            try:
+                callback(keys)
+            except Exception as e:
+                log.error(f"StreamWriter 通知 flush 失敗: {e}")
+
+    def _requeue(self, failed, error):
+        """把寫入失敗的條目(依原順序)放回緩衝區最前面, 緩衝區放不下的較舊條目才丟棄"""
+        with self._cond:
+            room = max(self.max_pending - self._pending, 0)
+            dropped, kept = failed[:max(len(failed) - room, 0)], failed[max(len(failed) - room, 0):]
+
+            requeue = defaultdict(list)
+            for stream_key, fields in kept:
+                requeue[stream_key].append(fields)
+            for stream_key, entries in requeue.items():
+                self._buffer[stream_key][:0] = entries
+
+            self._pending += len(kept)
+            self._retry_delay = min(max(self._retry_delay * 2, self.flush_interval), 1.0)
+            self._stats['errors'] += len(failed)
+            self._stats['requeued'] += len(kept)
+            self._stats['dropped'] += len(dropped)
+
+        log.error(f"StreamWriter flush 失敗 {len(failed)} 筆, 重新排入: {len(kept)} 筆, 丟棄: {len(dropped)} 筆: {error}")
+
+    def _report(self):
+        if not self.stats_interval or time.monotonic() - self._last_report < self.stats_interval:
+            return
+        self._last_report = time.monotonic()
+        log.info(f"StreamWriter 統計: {self.stats()}")
+
+class StreamRetention:
+    """
+    Stream 保留策略:
+    未啟用歸檔時, 直接在 XADD 帶上近似的 MAXLEN 或 MINID 修剪
+    啟用歸檔時, 寫入不修剪, 改由背景執行緒定期把超出保留範圍的條目依日期寫入
+    {archive_dir}/{YYYY-MM-DD}/{stream_key}.jsonl, 寫入成功後才以 XTRIM MINID 修剪, 確保未歸檔的資料不會被刪除
+    """
+    OFFSET_KEY = 'stream_archive_offsets'  # 每個 stream 最後歸檔的 id
+
+    def __init__(self, redis_cli=None, maxlen=0, minid_minutes=0, archive=False, archive_dir='data/archive', interval=60, page_size=1000):
+        self.redis = redis_cli or get_redis_connection()
+        self.maxlen = maxlen
+        self.minid_minutes = minid_minutes
+        self.archive = archive
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.page_size = page_size
+        self.tz = pytz.timezone('Asia/Taipei')
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return bool(self.maxlen or self.minid_minutes)
+
+    def _minid(self):
+        return f"{int((time.time() - self.minid_minutes * 60) * 1000)}-0"
+
+    @staticmethod
+    def _id_tuple(entry_id):
+        ms, _, seq = entry_id.partition('-')
+        return int(ms), int(seq or 0)
+
+    def xadd_options(self):
+        """寫入時的修剪參數, 歸檔模式下由背景執行緒修剪"""
+        if self.archive or not self.enabled:
+            return {}
+        if self.minid_minutes:
+            return {'minid': self._minid(), 'approximate': True}
+        return {'maxlen': self.maxlen, 'approximate': True}
+
+    def cutoff(self, stream_key):
+        """計算保留範圍的起點 id, 早於此 id 的條目可歸檔並修剪"""
+        candidates = []
+        if self.minid_minutes:
+            candidates.append(self._minid())
+        if self.maxlen:
+            excess = self.redis.xlen(stream_key) - self.maxlen  # 超出 maxlen 的筆數, 這些條目本來就要歸檔
+            if excess > 0:
+                first_kept = self._nth_id(stream_key, excess)
+                if first_kept:
+                    candidates.append(first_kept)
+        return max(candidates, key=self._id_tuple) if candidates else None
+
+    def _nth_id(self, stream_key, n):
+        """由最舊算起第 n 筆(0 起算)條目的 id, 只分頁讀取前 n + 1 筆(不讀取保留範圍內的 maxlen 筆)"""
+        lower = '-'
+        while True:
+            entries = self.redis.xrange(stream_key, min=lower, count=min(n + 1, self.page_size))
+            if not entries:
+                return None
+            if n < len(entries):
+                return entries[n][0]
+            n -= len(entries)
+            lower = f"({entries[-1][0]}"
+
+    def archive_stream(self, stream_key, cutoff=None):
+        """把 (最後歸檔 id, cutoff) 之間的條目寫入歸檔, cutoff 為 None 時歸檔全部, 回傳筆數"""
+        last_id = self.redis.hget(self.OFFSET_KEY, stream_key) or '-'
+        upper = f"({cutoff}" if cutoff else '+'
+        total = 0
+
+        while True:
+            lower = f"({last_id}" if last_id != '-' else '-'
+            entries = self.redis.xrange(stream_key, min=lower, max=upper, count=self.page_size)
+            if not entries:
+                break
+
+            files = defaultdict(list)
+            for entry_id, fields in entries:
+                day = datetime.fromtimestamp(self._id_tuple(entry_id)[0] / 1000, self.tz).strftime('%Y-%m-%d')
+                files[day].append(json.dumps({'id': entry_id, 'fields': fields}, ensure_ascii=False))
+
+            for day, lines in files.items():
+                day_dir = os.path.join(self.archive_dir, day)
+                os.makedirs(day_dir, exist_ok=True)
+                with open(os.path.join(day_dir, f"{stream_key}.jsonl"), 'a', encoding='utf-8') as f:
+                    f.write('\n'.join(lines) + '\n')
+
+            last_id = entries[-1][0]
+            self.redis.hset(self.OFFSET_KEY, stream_key, last_id)
+            total += len(entries)
+
+            if len(entries) < self.page_size:
+                break
+
+        return total
+
+    def trim(self, stream_key):
+        """歸檔後修剪單一 stream"""
+        cutoff = self.cutoff(stream_key)
+        if not cutoff:
+            return 0
+
+        archived = self.archive_stream(stream_key, cutoff)
+        self.redis.xtrim(stream_key, minid=cutoff, approximate=True)
+        return archived
+
+    def run_once(self, keys):
+        for stream_key in keys:
+            try:
+                archived = self.trim(stream_key)
+                if archived:
+                    log.info(f"Stream 歸檔並修剪: {stream_key}, 歸檔筆數: {archived}")
+            except Exception as e:
+                log.error(f"Stream 歸檔失敗: {stream_key}, {e}")
+
+    def start(self, keys_fn):
+        """啟動背景歸檔執行緒, keys_fn 回傳要處理的 stream key"""
+        if not (self.archive and self.enabled) or self._thread:
+            return self
+
+        def _run():
+            while not self._stop.wait(self.interval):
+                self.run_once(keys_fn())
+
+        self._thread = threading.Thread(target=_run, name='stream-retention', daemon=True)
+        self._thread.start()
+        log.info(f"Stream 歸檔啟動, maxlen: {self.maxlen}, minid_minutes: {self.minid_minutes}, 目錄: {self.archive_dir}")
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+def get_stream_retention():
+    global _stream_retention
+    if _stream_retention is None:  # 如果尚未創建, 依照環境變數設定
+        _stream_retention = StreamRetention(
+            maxlen=int(os.getenv('STREAM_MAXLEN', 0)),
+            minid_minutes=int(os.getenv('STREAM_RETENTION_MINUTES', 0)),
+            archive=bool(strtobool(os.getenv('STREAM_ARCHIVE', 'false'))),
+            archive_dir=os.getenv('STREAM_ARCHIVE_DIR', 'data/archive'),
+            interval=int(os.getenv('STREAM_ARCHIVE_SECONDS', 60))
+        )
+
+    return _stream_retention
+
+def get_stream_writer():
+    global _stream_writer
+    with _stream_lock:
+        if _stream_writer is None:  # 如果尚未創建, 依照環境變數設定後啟動
+            _stream_writer = _create_stream_writer()
+
+    return _stream_writer
+
+def _create_stream_writer():
+    retention = get_stream_retention()
+    writer = StreamWriter(
+        batch_size=int(os.getenv('STREAM_BATCH_SIZE', 64)),
+        flush_interval=float(os.getenv('STREAM_FLUSH_MS', 5)) / 1000,
+        max_pending=int(os.getenv('STREAM_MAX_PENDING', 10000)),
+        block_timeout=float(os.getenv('STREAM_BLOCK_MS', 50)) / 1000,
+        stats_interval=int(os.getenv('STREAM_STATS_SECONDS', 60)),
+        retention=retention
+    ).start()
+    retention.start(writer.keys)
+    return writer
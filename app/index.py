@@ -1,12 +1,16 @@
-import multiprocessing, threading, asyncio
+import multiprocessing, threading, asyncio, os
+from distutils.util import strtobool
 from datetime import datetime
-from data import DatasourceFactory
+from data import DatasourceFactory, BarService
 from notify import DC
 import concurrent.futures
 from main import process_item
+from strategy.worker import StrategyWorkerPool
+from strategy.statarb_engine import StatarbEngine
 from utils.file import open_json_file
 from broker.load import load_brokers
 from utils.scheduler import TaskScheduler
+from utils.dispatcher import get_dispatcher
 from utils.log import start_queue_listener, stop_all_listeners
 
 # 同時運行 Discord 客戶端和主函數
@@ -21,7 +25,10 @@ async def run_all():
         # 運行數據源獲取
         datasources = DatasourceFactory.run_data_sources(items, brokers)
         main_logger, _ = start_queue_listener('main', multiprocessing.Queue())
-        process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)  # 進程池
+        if os.getenv('WORKER_MODE', 'actor').lower() == 'actor': # 常駐 worker, 策略實例跨輪保留
+            process_pool = StrategyWorkerPool(max_workers=2, log=main_logger).start()
+        else:
+            process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=2)  # 進程池
         thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)  # 線程池
         order_status, pending_task = multiprocessing.Manager().dict(), multiprocessing.Manager().dict()
         process_lock, async_lock  = multiprocessing.Manager().Lock(), asyncio.Lock()
@@ -40,19 +47,34 @@ async def run_all():
 
         scheduler = TaskScheduler(process_lock=process_lock, brokers=brokers, datasources=datasources)
         scheduler.start()
+        dispatcher = get_dispatcher()  # event 模式下只排程有新行情的策略
+        bar_service = BarService()  # 每批 tick 只合成一次 K 棒, 供所有策略共用
+        statarb_engine = StatarbEngine() if strtobool(os.getenv('STATARB_ENGINE', 'true')) else None  # 所有配對一次向量化計算
         
         while True:
+            if dispatcher:
+                dirty, timer = await dispatcher.wait()
+
             with process_lock:
                 items = {k: v for k, v in open_json_file()['items'].items() if v}
 
+            if dispatcher: # 只計算收到新資料的策略, 定時執行時另外計算有倉位的策略(依時間出場)
+                items = await asyncio.to_thread(dispatcher.select, items, dirty, timer)
+                if not items:
+                    continue
+
             async with async_lock: # 使用鎖來確保 process_item 只有一個實例在執行
+                await asyncio.to_thread(bar_service.run_once, items)  # 先更新 K 棒, 策略再讀取
+                if statarb_engine:
+                    await asyncio.to_thread(statarb_engine.run_once, items)
                 await process_item(
                     items, queue, process_pool, thread_pool,
                     brokers, process_lock, brokers_lock,
                     order_status, strategy_lock, pending_task, main_logger
                 )
 
-            await asyncio.sleep(1) # 有上鎖故可以調快秒速增加運算次數
+            if not dispatcher:
+                await asyncio.sleep(1) # 有上鎖故可以調快秒速增加運算次數
 
     finally:
         await bot.shutdown_bot()
@@ -1,9 +1,11 @@
-import asyncio, json, datetime, pytz
+import asyncio, datetime, pytz
 from datetime import datetime, time
 from collections import defaultdict
 from data import DatasourceFactory
+from data.codec import decode_entry
 from strategy import Strategy
-from db.redis import get_redis_connection
+from strategy.worker import StrategyWorkerPool
+from db.redis import get_redis_connection, ack_entries, read_streams, get_stream_keys, get_group_name, get_consumer_name
 from utils.file import update_settings
 from dotenv import load_dotenv
 load_dotenv()
@@ -11,38 +13,34 @@ load_dotenv()
 # -------------- 訊號計算與下單 ---------------------
 
 # 訊號計算與判斷（CPU 密集型任務）
-def check_signal(symbol, item, log):
+def check_signal(symbol, item, log, strategies=None):
     redis_cli = get_redis_connection()
     data_list = {}
+    acks = {}  # {(stream_key, group): [entry_id, ...]}
   
-    # 如果是正式環境, 依照symbol和code來所生成的獨立stream進行讀取(EX: stock_2330_stream), conusmer和gruop也要一個個對應        
+    # 如果是正式環境, 依照symbol和code來所生成的獨立stream進行讀取(EX: stock_2330_stream), 同一項目共用一個 group 與 consumer
     log.info(f"開始檢查訊號: {symbol}, \n計算商品: {item}")
     try:
-        for code in item['code']:
-            data_redis_key = f"{item['params']['broker']}_{symbol}_{code}_stream"
-            data_group_name = f"{item['params']['broker']}_{symbol}_{code}_{item['strategy']}_group"
-            data_consumer_name = f"consumer_{item['params']['broker']}_{symbol}_{code}_{item['strategy']}"
-
-            bidask_redis_key = f"{item['params']['broker']}_{symbol}_{code}_bidask_stream"
-            bidask_group_name = f"{item['params']['broker']}_{symbol}_{code}_{item['strategy']}_group"
-            bidask_consumer_name = f"consumer_{item['params']['broker']}_{symbol}_{code}_{item['strategy']}_bidask"
-
-            data = redis_cli.xreadgroup(data_group_name, data_consumer_name, streams={data_redis_key: '>'}, block=1000, count=10)
-            bid_ask = redis_cli.xreadgroup(bidask_group_name, bidask_consumer_name, streams={bidask_redis_key: '>'}, block=1000, count=10)
+        broker = item['params']['broker']
+        group = get_group_name(broker, symbol, item['strategy'])
+        consumer = get_consumer_name(broker, symbol, item['strategy'])
+        stream_keys = get_stream_keys(broker, symbol, item['code'])
+        
+        # 單次讀取該項目所有商品的 tick 與 bidask stream
+        messages = read_streams(redis_cli, group, consumer, [key for keys in stream_keys.values() for key in keys])
+        
+        for code, (data_redis_key, bidask_redis_key) in stream_keys.items():
+            data = messages.get(data_redis_key, [])
+            bid_ask = messages.get(bidask_redis_key, [])
+            
+            # 記錄讀取到的條目 id, 本次計算完成後統一 XACK
+            acks[(data_redis_key, group)] = [message[0] for message in data]
+            acks[(bidask_redis_key, group)] = [message[0] for message in bid_ask]
 
             if data:
-                # 提取 tick 和 bidask 數據
-                tick_data = [message[1] for _, messages in data for message in messages]
-                bidask_data = [message[1] for _, messages in bid_ask for message in messages]
-
-                # 清理 bidask_data 中的字串化列表
-                for bd in bidask_data:
-                    bd['bid_prices'] = json.loads(bd['bid_prices'])
-                    bd['bid_volumes'] = json.loads(bd['bid_volumes'])
-                    bd['diff_bid_vols'] = json.loads(bd['diff_bid_vols'])
-                    bd['ask_prices'] = json.loads(bd['ask_prices'])
-                    bd['ask_volumes'] = json.loads(bd['ask_volumes'])
-                    bd['diff_ask_vols'] = json.loads(bd['diff_ask_vols'])
+                # 提取 tick 和 bidask 數據(binary 或 string 格式皆由 codec 解析)
+                tick_data = [decode_entry(message[1]) for message in data]
+                bidask_data = [decode_entry(message[1]) for message in bid_ask]
 
                 # 按秒聚合 tick_data
                 aggregated_ticks = DatasourceFactory.aggregate_ticks_by_second(tick_data)
@@ -74,11 +72,24 @@ def check_signal(symbol, item, log):
 
         if not data_list: # 如果沒有數據, 則返回預設的結構, 等待下一次
             log.info(f"\n當前data_list沒有從redis的stream中獲得任何資料, 等待下一次檢查\n")
+            acknowledge(redis_cli, acks, log)  # 只有 bidask 的條目不會再被使用
             return [(symbol, item, False, {}, {}, {})]
             
         # 可以傳入多筆{data1: [], data2: []}
-        result = Strategy(symbol, item, data_list).execute()
+        if strategies is None:
+            result = Strategy(symbol, item, data_list).execute()
+        else: # 常駐 worker 模式, 重用該項目的策略實例
+            strategy_key = f"{symbol}:{item['strategy']}"
+            if strategy_key in strategies:
+                strategies[strategy_key].update(data_list, item)
+            else:
+                strategies[strategy_key] = Strategy(symbol, item, data_list)
+            result = strategies[strategy_key].execute()
         log.info(f"當前策略回傳結果: {result}")
+        
+        # 策略已消化本次資料, 確認條目
+        # 出錯時不確認: 條目留在 PEL, 之後只讀取新條目不會重新處理, 直到重新啟動且 STREAM_RECOVER_PENDING=true 時才由 recover_pending 確認清除(不重新計算)
+        acknowledge(redis_cli, acks, log)
 
         # 回傳結果 [(symbol, item, 下單行為(詳情看AbstractStrategy), {}修改參數, {}推播內容, {}訂單參數)...]
         return result
@@ -87,6 +98,14 @@ def check_signal(symbol, item, log):
         log.error(f"當前check_siganl出錯: {e}")
         return [(symbol, item, False, {}, {}, {})]
 
+def acknowledge(redis_cli, acks, log):
+    try:
+        pel_sizes = ack_entries(redis_cli, acks)
+        if pel_sizes:
+            log.info(f"XACK 完成, 當前 PEL 大小: {pel_sizes}")
+    except Exception as e:
+        log.error(f"XACK 失敗: {e}")
+
 # 下單（I/O 密集型任務）symbol: 商品種類, item: 商品代號詳情, result_type: 下多空單, order_params: 訂單參數(止盈止損價)
 def place_order(order_params, brokers, result_type, broker_lock, order_status, strategy_lock, pending_task, log):
     # 從 order_params 中提取 broker, stratgey
@@ -226,9 +245,9 @@ async def process_item(items, queue, process_pool, thread_pool, brokers, p_lock,
 
     loop = asyncio.get_event_loop()
     
-    # 提交訊號計算任務到進程池
+    # 提交訊號計算任務到進程池(常駐 worker 模式下交給固定的 worker)
     tasks = [
-        loop.run_in_executor(process_pool, check_signal, symbol, item, log)
+        process_pool.submit(symbol, item) if isinstance(process_pool, StrategyWorkerPool) else loop.run_in_executor(process_pool, check_signal, symbol, item, log)
         for symbol, item_list in stock_codes.items()
         for item in item_list
     ]
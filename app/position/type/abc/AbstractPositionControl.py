@@ -3,6 +3,7 @@ import redis
 from redis.lock import Lock
 from db.redis import get_redis_connection
 import json, ast, os, time
+from contextlib import nullcontext
 from utils.log import get_module_logger
 from dotenv import load_dotenv
 load_dotenv()
@@ -36,13 +37,14 @@ class AbstractPositionControl(ABC):
         self.log = get_module_logger(f"position/{redis_key.replace(':', '_')}")
         self._lua_script = self.redis.register_script(self._LUA_SCRIPT)
 
-    def get_position(self):
-        lock = Lock(self.redis, f"lock:{self.redis_key}", timeout=5)
+    def get_position(self, raw_data=None):
+        # raw_data: 策略本輪已批次取得的倉位 hash(HGETALL 本身即為原子操作, 不需再取得鎖)
+        lock = Lock(self.redis, f"lock:{self.redis_key}", timeout=5) if raw_data is None else nullcontext()
         
         try:
             with lock:
                 # 從 Redis 取得指定 key 的所有哈希欄位和值
-                raw_data = self.redis.hgetall(self.redis_key)
+                raw_data = self.redis.hgetall(self.redis_key) if raw_data is None else dict(raw_data)
 
                 formatted_data = {
                     k: (ast.literal_eval(v) if isinstance(v, str) else v.decode('utf-8') if isinstance(v, bytes) else 
@@ -414,7 +416,7 @@ class AbstractPositionControl(ABC):
     def check_action(self, type, **params):
         """執行艙位控制行為"""
         if type == 'check':
-            return self.get_position() or False
+            return self.get_position(params.get('raw_data')) or False
         elif type == 'set':
             return self.set_position(**params)
         elif type == 'calculate':
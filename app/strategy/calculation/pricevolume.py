@@ -1,6 +1,6 @@
 from .abc.AbstractCalculation import AbstractCalculation
+from utils.price_levels import PriceLevels
 from datetime import datetime
-import copy
 
 class Pricevolume(AbstractCalculation):
     def execute(self, params, datas):
@@ -12,23 +12,24 @@ class Pricevolume(AbstractCalculation):
         redis_pop = super().check_redis_pop(redis_key)
         
         previous_ts = redis_pop['ts']
-        previous_pv_list = redis_pop['pv_list']
+        levels = PriceLevels.load(redis_pop['pv_list'])
+        previous_highest = levels.highest()  # 套用本批成交前的最高價位
         short_signal, long_signal = 0, 0 # 初始化信号和计数器，默认为 0
         short_counter = redis_pop.get('short_counter', 0)
         long_counter = redis_pop.get('long_counter', 0)
-        current_pv_list = self.calculation(previous_pv_list, datas)
+        self.calculation(levels, datas)
         
         # 如果要計算空
         if params.get('short') is True:
-            short_signal, short_counter = self.short_signal(current_ts, previous_ts, current_pv_list, previous_pv_list, vol_threshold, monitor_period, short_counter)
+            short_signal, short_counter = self.short_signal(current_ts, previous_ts, levels, previous_highest, vol_threshold, monitor_period, short_counter)
         
         # 如果要計算多
         if params.get('long') is True:
-            long_signal, long_counter = self.long_signal(current_ts, previous_ts, current_pv_list, previous_pv_list, vol_threshold, monitor_period, long_counter)
+            long_signal, long_counter = self.long_signal(current_ts, previous_ts, levels, previous_highest, vol_threshold, monitor_period, long_counter)
         
         self.save_to_redis(redis_key, {
             'ts': current_ts,
-            'pv_list': current_pv_list,
+            'pv_list': levels.to_dict(),
             'short_counter': short_counter,
             'long_counter': long_counter
         })
@@ -36,46 +37,15 @@ class Pricevolume(AbstractCalculation):
         limit_up = 10000
         limit_down = 10
         
-        return short_signal, long_signal, {'pv': current_pv_list, 'limit_up': limit_up, 'limit_down': limit_down}
+        return short_signal, long_signal, {'pv': levels, 'limit_up': limit_up, 'limit_down': limit_down}
         
-    def calculation(self, pre_data, datas):
+    def calculation(self, levels, datas):
         '''
-        計算價量
-        pre_data: 前一筆Redis中的資料
+        計算價量: 將本批成交依收盤價累加到各價位(PriceLevels, 依價格排序)
+        levels: 前一筆Redis中的價量資料
         datas: 當前API請求獲得的資料
         '''
-        
-        pv_list = copy.deepcopy(pre_data)
-        print(f'\nThis Time The Datas Are: {datas}\n')
-
-        # 遍历 datas 进行处理
-        for data in datas:
-            close_price = data['close']
-            volume = data['volume']
-            
-            # 当 redis_data 为空时，直接插入数据
-            if not pv_list:
-                pv_list.append((close_price, volume))
-                continue  # 继续处理下一条数据
-
-            # 将新的 (close, volume) 插入到 order_list 中，保持按照 close 降序排序
-            inserted = False
-            for i, (price, vol) in enumerate(pv_list):
-                if close_price == price: # 如果价格相同，累加成交量
-                    pv_list[i] = (price, vol + volume)
-                    inserted = True
-                    break
-                
-                elif close_price > price: # 如果当前价格大于列表中的价格，插入到当前位置
-                    pv_list.insert(i, (close_price, volume))
-                    inserted = True
-                    break
-
-            # 如果没有找到合适的位置，则将数据添加到末尾
-            if not inserted:
-                pv_list.append((close_price, volume))
-            
-        return pv_list
+        return levels.update(datas)
 
     def pop_from_redis(self, redis_key):
         return super().pop_from_redis(redis_key)
@@ -96,19 +66,17 @@ class Pricevolume(AbstractCalculation):
         # 计算时间差
         return int((cur_ts_dt - pre_ts_dt).total_seconds())
   
-    def short_signal(self, cur_ts, pre_ts, cur_pv_list, pre_pv_list, vol_threshold, monitor_period, counter):
+    def short_signal(self, cur_ts, pre_ts, levels, pre_highest, vol_threshold, monitor_period, counter):
         # 计算时间差
         time_diff = self.time_diff(cur_ts, pre_ts)
         
-        # 取得當前的最高價量(list of tuple)與, 前一個時刻的最高價量(list of tuple), 第一筆資料為(0, 0)
-        cur_highest_price, cur_highest_volume = max(cur_pv_list, key=lambda x: x[0])
-        pre_high_price, _ = max(pre_pv_list, key=lambda x: x[0]) if pre_pv_list else (0, 0)
+        # 取得當前的最高價量與前一個時刻的最高價量, 第一筆資料為(0, 0)
+        cur_highest_price, cur_highest_volume = levels.highest()
+        pre_high_price, _ = pre_highest
 
         # 初始化返回信号
         signal = 0
         
-        print('the price pair', cur_highest_price, pre_high_price)
-        
         # 判断是否符合条件最高價量在條件內 
         if cur_highest_price == pre_high_price and cur_highest_volume < vol_threshold:
             # 条件符合，开始累加秒數, 如果 counter 为 0，则counter從1開始
@@ -119,14 +87,13 @@ class Pricevolume(AbstractCalculation):
                 signal = -1
                 
         else: # 条件不符合，重置 counter
-            print('reset the counter')
             counter = 0
             signal = 0
             
         return signal, counter
     
-    def long_signal(self, cur_ts, pre_ts, cur_pv_list, pre_pv_list, vol_threshold, monitor_period, counter):
+    def long_signal(self, cur_ts, pre_ts, levels, pre_highest, vol_threshold, monitor_period, counter):
         # 初始化返回信号
         signal = 0
         
-        return signal, counter
\ No newline at end of file
+        return signal, counter
@@ -1,11 +1,17 @@
 from .abc.AbstractCalculation import AbstractCalculation
 import pandas as pd
+from utils.rolling import RsvKernel, get_kernel
 from utils.log import get_module_logger
 
 class Rsv(AbstractCalculation):
     def __init__(self, params, data, log_name):
         super().__init__(params, data)
         self.log = get_module_logger(f"{log_name}/rsv")
+        self.series_key = None
+
+    def bind_state(self, state, redis_key):
+        """以策略的 key 識別序列, 啟用跨輪保存、逐根更新的滾動最高/最低"""
+        self.series_key = redis_key
     
     def execute(self):
         if self.params['rsv_low'] <= self.calculation() <= self.params['rsv_high']:
@@ -16,6 +22,10 @@ class Rsv(AbstractCalculation):
     
     def calculation(self):
         self.data[['open', 'close', 'high', 'low']] = self.data[['open', 'close', 'high', 'low']].apply(pd.to_numeric)
+
+        if self.series_key is not None and 'ts' in self.data.columns: # 新 K 棒 O(1) 更新
+            kernel = get_kernel((self.series_key, 'rsv', self.params['long_window']), lambda: RsvKernel(self.params['long_window']))
+            return kernel.sync(self.data['ts'].to_numpy(), *(self.data[column].to_numpy(dtype=float) for column in ('high', 'low', 'close')))
         
         self.data['lowest_low'] = self.data['low'].rolling(window=self.params['long_window']).min()
         self.data['highest_high'] = self.data['high'].rolling(window=self.params['long_window']).max()
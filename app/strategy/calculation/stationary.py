@@ -3,12 +3,18 @@ from scipy import stats
 from statsmodels.tsa.stattools import adfuller, acf, pacf
 import numpy as np
 import pandas as pd
+from utils.stationarity import get_stationarity_service
 from utils.log import get_module_logger
 
 class Stationary(AbstractCalculation):
     def __init__(self, params, data, log_name):
         super().__init__(params, data)
         self.log = get_module_logger(f"{log_name}/stationary")
+        self.series_key = None
+
+    def bind_state(self, state, redis_key):
+        """以策略的 key 識別序列, 啟用跨輪的平穩性快取與逐根更新的 ACF"""
+        self.series_key = redis_key
     
     def execute(self):
         return self.calculation()
@@ -24,6 +30,17 @@ class Stationary(AbstractCalculation):
 
             return False
         
+        elif self.series_key is not None and 'ts' in self.data.columns:
+            result, detail = get_stationarity_service().verdict(
+                self.series_key, self.params.get('K_time', 1),
+                self.data['ts'].to_numpy()[-self.params['long_window']:], recent_data.to_numpy(dtype=float),
+                self.params['long_window'], self.params['long_lag'], stricter_confidence, adf_significance
+            )
+            if debug:
+                self.log.info(f"Time: {detail['ts']} | ADF p-value: {detail['adf_p_value']}, Is Stationary: 「{result}」, ACF in blue zone: {detail['acf_in_blue_zone']}, PACF in blue zone: {detail['pacf_in_blue_zone']}")
+
+            return result
+
         else:
             # 計算 ACF 和 PACF
             acf_values = acf(recent_data, nlags=self.params['long_lag'], fft=False)
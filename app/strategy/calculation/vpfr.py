@@ -1,19 +1,27 @@
 from .abc.AbstractCalculation import AbstractCalculation
 import pandas as pd
 import numpy as np
-import re
+from utils.volume_profile import VolumeProfile
+from utils.rolling import get_kernel
 from utils.log import get_module_logger
 
 class Vpfr(AbstractCalculation):
     def __init__(self, params, data, log_name):
         super().__init__(params, data)
         self.log = get_module_logger(f"{log_name}/vpfr")
+        self.series_key = None
+
+    def bind_state(self, state, redis_key):
+        """以策略的 key 識別序列, 成交量分佈跨輪保存並逐根更新"""
+        self.series_key = redis_key
 
     def execute(self, is_trend=False, debug=True):
         if not self.check_volume_slippage(debug=debug): # 當前成交量過少可能滑價
             return (False, 0)
 
         vpfr_data = self.calculation()
+        if vpfr_data is None:
+            return (False, 0)
         
         vpfr_check = self.check_vpfr(vpfr_data, self.data, is_trend=is_trend, debug=debug)
         
@@ -59,64 +67,32 @@ class Vpfr(AbstractCalculation):
         return (False, 0)
 
     def calculation(self):
-        self.data[['open', 'close', 'high', 'low']] = self.data[['open', 'close', 'high', 'low']].apply(pd.to_numeric)
-        
-        self.data['lowest_low'] = self.data['low'].rolling(window=self.params['long_window']).min()
-        self.data['highest_high'] = self.data['high'].rolling(window=self.params['long_window']).max()
-        
-        # 近期高低點
-        recent_low = self.data['lowest_low'].iloc[-1]
-        recent_high = self.data['highest_high'].iloc[-1]
-        
-        # 檢查數值是否合理
-        if pd.isna(recent_low) or pd.isna(recent_high) or recent_high <= recent_low:
-            self.log.info(f"當前價格範圍內, 沒有有效的數值, 回傳空物件, 當前數值: {self.data}, 近期高: {recent_high}, 近期低: {recent_low}")
-            return {}
+        """最近 long_window 根 K 棒的成交量分佈, 價格範圍無效時回傳 None"""
+        window = self.params['long_window']
+        columns = [pd.to_numeric(self.data[column]).to_numpy(dtype=float) for column in ('high', 'low', 'close', 'volume')]
+
+        if self.series_key is not None and 'ts' in self.data.columns: # 新 K 棒以 append 更新
+            profile = get_kernel((self.series_key, 'vpfr', window), lambda: VolumeProfile(window)).sync(self.data['ts'].to_numpy(), *columns)
         else:
-            # 計算VPFR
-            price_bins = pd.interval_range(
-                start=self.data['lowest_low'].iloc[-1], 
-                end=self.data['highest_high'].iloc[-1], 
-                freq=(self.data['highest_high'].iloc[-1] - self.data['lowest_low'].iloc[-1]) / self.params['long_window']
-            )
-
-            # 使用.copy()防止SettingWithCopyWarning
-            recent_data = self.data.iloc[-self.params['long_window']:].copy()
-
-            # 使用.loc確保安全賦值
-            recent_data.loc[:, 'price_bin'] = pd.cut(recent_data['close'], bins=price_bins)
-
-            # 修正 observed=True 警告
-            volume_distribution = recent_data.groupby('price_bin', observed=True)['volume'].sum()
-            total_volume = recent_data['volume'].sum()
-            vpfr = volume_distribution / total_volume
-
-            # 將VPFR作為字典傳回
-            return {str(bin): value for bin, value in vpfr.items()}
-    
-    def check_vpfr(self, vpfr, data, is_trend=False, debug=False):
-        total_volume_above_threshold = 0
-        total_volume_below_threshold = 0
+            profile = VolumeProfile.from_bars(*columns, window)
 
+        if not profile.valid:
+            self.log.info(f"當前價格範圍內, 沒有有效的數值, 當前數值: {self.data}")
+            return None
+
+        return profile
+    
+    def check_vpfr(self, profile, data, is_trend=False, debug=False):
         # 確保 data 是 Pandas DataFrame 格式
         if not isinstance(data, pd.DataFrame):
             self.log.info("Error: data 不是 DataFrame 格式!")
             return False
 
-        # 遍歷 DataFrame 中的每一行資料，判斷成交量是否超過閾值
-        for _, entry in data.iterrows():
-            volume = entry['volume']
-            if volume > self.params['volume_threshold']:
-                total_volume_above_threshold += 1
-            else:
-                total_volume_below_threshold += 1
-
         # 計算成交量超過閾值的比例
-        total_data_points = len(data)
-        if total_data_points == 0:
+        if len(data) == 0:
             return False  # 若無資料則不進行交易
 
-        volume_above_ratio = total_volume_above_threshold / total_data_points
+        volume_above_ratio = float((data['volume'].to_numpy() > self.params['volume_threshold']).mean())
 
         if debug:
             self.log.info(f"成交量超過閾值的比例: {(volume_above_ratio)*100}%")
@@ -137,14 +113,9 @@ class Vpfr(AbstractCalculation):
                 return False  # 不符合震盪盤條件
 
         # ------------ VPFR 標準差與集中度計算 --------------
-        price_ranges = []
-        volumes = []
-
-        # 將 vpfr 解析成數值列表
-        for key, volume in vpfr.items():
-            lower, upper = map(float, re.findall(r"\d+\.\d+", key))
-            price_ranges.append((lower + upper) / 2)  # 中位數作為代表價格
-            volumes.append(volume)
+        # 有成交的區間中位數作為代表價格
+        price_ranges = profile.mids[profile.observed]
+        volumes = profile.fractions[profile.observed]
 
         # 計算價格的均值與標準差
         mean_price = np.mean(price_ranges)
@@ -155,8 +126,8 @@ class Vpfr(AbstractCalculation):
         low_price_threshold = mean_price - std_dev_price
 
         # 計算高價與低價的VPFR成交量
-        high_price_vpfr = sum(vol for pr, vol in zip(price_ranges, volumes) if pr >= high_price_threshold)
-        low_price_vpfr = sum(vol for pr, vol in zip(price_ranges, volumes) if pr <= low_price_threshold)
+        high_price_vpfr = volumes[price_ranges >= high_price_threshold].sum()
+        low_price_vpfr = volumes[price_ranges <= low_price_threshold].sum()
 
         if debug:
             self.log.info(f"均值價格: {mean_price:.2f}, 標準差: {std_dev_price:.2f}")
@@ -189,28 +160,20 @@ class Vpfr(AbstractCalculation):
                     self.log.info("❌ 不符合震盪盤條件")
                 return False
 
-    def find_support_resistance_based_on_vpfr(self, vpfr, debug=False):
+    def find_support_resistance_based_on_vpfr(self, profile, debug=False):
         """
         根據VPFR成交量分佈來直接計算支撐位和壓力位。
 
-        :param vpfr: VPFR成交量分佈字典
+        :param profile: VolumeProfile 成交量分佈
         :return: 支撐位和壓力位
         """
-        # 初始化最小和最大價格
-        min_price = float('inf')  # 設置一個很大的初始最小價格
-        max_price = float('-inf')  # 設置一個很小的初始最大價格
-
-        # 遍歷所有區間，更新最小價格和最大價格
-        for price_range in vpfr:
-            lower_price, upper_price = price_range[1:-1].split(',')  # 提取區間中的價格
-            lower_price = float(lower_price)  # 轉換為浮點數
-            upper_price = float(upper_price)  # 轉換為浮點數
-
-            # 更新最小價格和最大價格
-            if lower_price < min_price:
-                min_price = lower_price
-            if upper_price > max_price:
-                max_price = upper_price
+        observed = profile.observed
+        if not observed.any():
+            return None
+
+        # 有成交區間的最低下緣與最高上緣
+        min_price = float(profile.edges[:-1][observed].min())
+        max_price = float(profile.edges[1:][observed].max())
 
         # 計算支撐與壓力區間 (加上 buffer)
         buffer = self.params['oscillation_buffer']
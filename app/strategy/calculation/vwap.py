@@ -1,6 +1,7 @@
 from .abc.AbstractCalculation import AbstractCalculation
 import pandas as pd
 import numpy as np
+from utils.rolling import VwapKernel, get_kernel
 from utils.log import get_module_logger
 
 class Vwap(AbstractCalculation):
@@ -8,6 +9,11 @@ class Vwap(AbstractCalculation):
         super().__init__(params, data)
         self.log = get_module_logger(f"{log_name}/vwap")
         self.timeframe = ''
+        self.series_key = None
+
+    def bind_state(self, state, redis_key):
+        """以策略的 key 識別序列, 各時間級別的 VWAP 跨輪保存並逐根更新"""
+        self.series_key = redis_key
 
     def execute(self, **kwargs):
         window = kwargs.get('timeframe_window')
@@ -27,7 +33,7 @@ class Vwap(AbstractCalculation):
         
         # 當前5分或15分價格回踩OB, 即將進行vwap判斷
         self.calculate_vwap(window, self.timeframe == '5min')
-        self.log.info(f"VWAP計算完畢, 當前的dataframe: {self.data.head(5)}\n\n")
+        self.log.info(f"VWAP計算完畢, 最新一根: {self.data.iloc[-1].to_dict()}\n\n")
         signal = self.execute_signal()
         
         if signal == 0:
@@ -60,6 +66,17 @@ class Vwap(AbstractCalculation):
                 if self.data[col].isna().any():
                     self.log.warning(f"Column {col} 在轉換後有NAN: {self.data[col][self.data[col].isna()]}")
         
+        if self.series_key is not None and 'ts' in self.data.columns: # 新 K 棒 O(1) 更新, 只計算最新一根
+            kernel = get_kernel((self.series_key, 'vwap', self.timeframe, window), lambda: VwapKernel(window))
+            vwap, std = kernel.sync(self.data['ts'].to_numpy(), *(self.data[column].to_numpy(dtype=float) for column in ('high', 'low', 'close', 'volume')))
+
+            last = self.data.index[-1]
+            self.data.loc[last, 'vwap'] = vwap
+            if include_std_bands:
+                self.data.loc[last, 'vwap_upper_2std'] = vwap + 2 * std
+                self.data.loc[last, 'vwap_lower_2std'] = vwap - 2 * std
+            return self.data
+
         # 計算典型價格 (High + Low + Close) / 3
         self.data['typical_price'] = (self.data['high'] + self.data['low'] + self.data['close']) / 3
 
@@ -1,19 +1,39 @@
 from .abc.AbstractCalculation import AbstractCalculation
+import json
+import pandas as pd
 from utils.technical_indicator.bias import calculate_bias_ratio
 from utils.technical_indicator.diff import shift_log, diff_change, diff_change_shift
+from utils.rolling import RollingZscore, RecursiveBeta
 from utils.log import get_module_logger
 
 class Zscore(AbstractCalculation):
     def __init__(self, params, data, log_name):
         super().__init__(params, data)
         self.log = get_module_logger(f"{log_name}/zscore")
+        self.state = None
+        self.redis_key = None
         
+    def bind_state(self, state, redis_key):
+        """綁定策略本輪的狀態快照, 啟用跨輪保存的滾動 z-score"""
+        self.state = state
+        self.redis_key = redis_key
+
     def execute(self):
         return self.calculation()
 
     def calculation(self):
         self.log.info(f"當前計算方式: {self.params['statarb_type']}")
         
+        # 有 K 棒時間且已綁定狀態時, 優先沿用 StatarbEngine 對同一根 K 棒的計算, 否則使用滾動 z-score(每根新 K 棒 O(1) 更新)
+        # 線上避險比例(beta_mode: rls)每根 K 棒都會改變價差定義, 改以當前 beta 重算視窗內的殘差
+        # bias 的 EMA 在每個視窗開頭重新起算, 沒有引擎結果時以整段視窗計算(與引擎相同)
+        if self.state is not None and 'ts' in self.data.columns and not self.online_beta:
+            engine_zscore = self.engine_zscore()
+            if engine_zscore is not None:
+                return self.generate_signal(engine_zscore)
+            if self.params['statarb_type'] != 'bias':
+                return self.generate_signal(self.rolling_zscore())
+
         if self.params['statarb_type'] == 'beta':
             return self.generate_signal(self.zscore(self.beta_sereis()))
         elif self.params['statarb_type'] == 'bias':
@@ -53,10 +73,50 @@ class Zscore(AbstractCalculation):
             return 0
         
         # Compute residuals
-        residuals = self.data['B'] - self.params['beta'] * self.data['A']
+        beta = self.rls_beta() if self.online_beta else self.params['beta']
+        residuals = self.data['B'] - beta * self.data['A']
         self.log.info(f"Residual 計算完畢,\n 當前數值: {residuals}\n")
         return residuals
 
+    @property
+    def online_beta(self):
+        return (
+            self.params['statarb_type'] == 'beta' and self.params.get('beta_mode') == 'rls'
+            and self.state is not None and 'ts' in self.data.columns
+        )
+
+    def rls_beta(self):
+        """以 RLS 逐根更新避險比例, 狀態保存於 _rolling hash 的 beta 欄位, setting 的 beta 作為錨點"""
+        estimator = RecursiveBeta.from_json(self.params, self.state.hgetall(self.redis_key).get('beta'))
+        applied = estimator.sync(self.data['ts'].to_numpy(), self.data['A'].to_numpy(), self.data['B'].to_numpy())
+        self.state.hset(self.redis_key, {'beta': estimator.to_json()})
+
+        beta = estimator.beta(self.params['beta'])
+        self.log.info(f"線上避險比例更新 {applied} 根 K 棒, 錨點: {self.params['beta']}, 當前 beta: {beta}")
+        return beta
+
+    def engine_zscore(self):
+        payload = self.state.hgetall(self.redis_key).get('engine')
+        if not payload:
+            return None
+
+        result = json.loads(payload)
+        latest = str(pd.Timestamp(self.data['ts'].iloc[-1]).to_datetime64().astype('datetime64[s]'))
+        if result.get('ts') != latest: # 尚未計算到本輪最新的 K 棒
+            return None
+
+        self.log.info(f"沿用 StatarbEngine 計算結果: {result}")
+        return result['zscore']
+
+    def rolling_zscore(self):
+        engine = RollingZscore.from_json(self.params, self.state.hgetall(self.redis_key).get('zscore'))
+        applied = engine.sync(self.data['ts'].to_numpy(), self.data['A'].to_numpy(), self.data['B'].to_numpy())
+        self.state.hset(self.redis_key, {'zscore': engine.to_json()})
+
+        current_zscore = engine.zscore()
+        self.log.info(f"滾動 Z-score 統計完畢, 新增 {applied} 根 K 棒, 視窗 {len(engine.window)} 筆,\n {current_zscore}\n")
+        return current_zscore
+
     def zscore(self, series):
         self.log.info(series)
 
@@ -0,0 +1,197 @@
+import json
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from db.redis import get_redis_connection
+from db.bar_store import load_bars_many
+from utils.bar import get_bar_key
+from utils.technical_indicator.ema import calculate_ema
+from utils.technical_indicator.streaming import IndicatorSeries, Rsi
+from utils.rolling import get_kernel
+from utils.log import get_module_logger
+
+class StatarbEngine:
+    """
+    多配對的 statarb 計算:
+    將同一 (broker, 週期, 輸入序列, 視窗) 的所有配對商品組成對齊的收盤價矩陣(列: K 棒, 欄: 商品),
+    以 NumPy 廣播一次算出所有配對的價差序列、z-score 與進出場訊號, 結果寫入各策略的 _rolling hash (engine 欄位),
+    各策略的 Zscore 在 K 棒時間相同時直接沿用, 下單、推播與倉位邏輯維持在各策略中
+    序列定義與舊版 Zscore 相同(各 statarb_type、RSI/EMA 輸入、依位置對齊最近的 K 棒)
+    """
+    def __init__(self, redis_cli=None):
+        self.log = get_module_logger('strategy/statarb_engine')
+        self.redis = redis_cli or get_redis_connection()
+
+    @staticmethod
+    def input_spec(params):
+        """策略使用的輸入序列: close / rsi / ema 與所需的額外 K 棒數"""
+        if 'rsi' in params.get('indicator', {}):
+            return 'rsi', params['indicator']['rsi']
+        if 'ema_period' in params:
+            return 'ema', params['ema_period']
+        return 'close', 0
+
+    def collect(self, items):
+        """依 (broker, 週期, 輸入, 期間, z_window) 分組所有使用 zscore 的配對項目"""
+        groups = defaultdict(list)
+        for symbol, item_list in items.items():
+            for item in item_list:
+                params = item.get('params', {})
+                if 'zscore' not in item.get('calculation', []) or len(item.get('code', [])) != 2:
+                    continue
+                if params.get('statarb_type') == 'beta' and params.get('beta_mode') == 'rls':
+                    continue  # 線上避險比例由各策略的 Zscore 逐根更新
+
+                kind, period = self.input_spec(params)
+                groups[(params['broker'], params.get('K_time', 1), kind, period, params['z_window'])].append((symbol, item))
+        return groups
+
+    def run_once(self, items):
+        """計算所有配對並寫回, 回傳 {rolling key: 結果}"""
+        results = {}
+        for (broker, interval, kind, period, z_window), pairs in self.collect(items).items():
+            try:
+                results.update(self.run_group(broker, interval, kind, period, z_window, pairs))
+            except Exception as e:
+                self.log.error(f"statarb 配對計算失敗: {broker}, {interval}k, {kind}, {e}")
+
+        if results:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, result in results.items():
+                pipe.hset(key, 'engine', json.dumps(result))
+            pipe.execute()
+            self.log.info(f"statarb 配對計算完成: {len(results)} 組")
+        return results
+
+    def run_group(self, broker, interval, kind, period, z_window, pairs):
+        codes = sorted({code for _, item in pairs for code in item['code']})
+        count = z_window + period
+        bars = load_bars_many([get_bar_key(broker, code, interval) for code in codes], count)
+        bars = {code: bars[get_bar_key(broker, code, interval)] for code in codes}
+
+        # K 棒不足的商品不參與本輪計算
+        codes = [code for code in codes if len(bars[code]) >= count]
+        column = {code: i for i, code in enumerate(codes)}
+        pairs = [(symbol, item) for symbol, item in pairs if all(code in column for code in item['code'])]
+        if not pairs:
+            return {}
+
+        closes = np.column_stack([bars[code]['close'] for code in codes])  # (count, 商品數), 依位置對齊
+        times = np.column_stack([bars[code]['ts'] for code in codes])
+        if kind == 'rsi': # RSI 以逐根指標續算, 每輪只計算新的 K 棒
+            values = self.rsi_series(broker, interval, period, z_window, bars, codes)
+        else:
+            values = self.input_series(closes, kind, period)[-z_window:]
+        times = times[-len(values):]
+
+        index_a = np.array([column[item['code'][0]] for _, item in pairs])
+        index_b = np.array([column[item['code'][1]] for _, item in pairs])
+        params = [item['params'] for _, item in pairs]
+
+        zscores = self.evaluate(values[:, index_a], values[:, index_b], params)
+        thresholds = np.array([p['threshold'] for p in params], dtype=float)
+        signals = self.signals(zscores, thresholds)
+        latest = np.maximum(times[-1, index_a], times[-1, index_b])  # 配對最新一根的時間(與策略端相同)
+
+        return {
+            f"{symbol}:{item['strategy']}:{'_'.join(item['code'])}_rolling": {
+                'ts': str(latest[i]), 'zscore': float(zscores[i]), 'signal': int(signals[i])
+            }
+            for i, (symbol, item) in enumerate(pairs)
+        }
+
+    @staticmethod
+    def rsi_series(broker, interval, period, z_window, bars, codes):
+        """
+        各商品最近 z_window 根的 RSI(列: K 棒, 欄: 商品), 以每個進程快取的 IndicatorSeries 逐根更新(與策略端共用同一個 key),
+        與 DataFrame.dropna 相同去除任一商品無法計算的列
+        """
+        values = np.column_stack([
+            get_kernel((get_bar_key(broker, code, interval), 'rsi', period, z_window), lambda: IndicatorSeries(Rsi(period), z_window))
+            .sync(bars[code]['ts'], bars[code]['close'])
+            for code in codes
+        ])
+        return values[~np.isnan(values).any(axis=1)]
+
+    @staticmethod
+    def input_series(closes, kind, period):
+        """
+        輸入序列, EMA 以 DataFrame 逐欄計算(所有商品一次完成)
+        EMA 在每個視窗開頭重新起算(與策略端相同), 無法以逐根指標續算
+        """
+        if kind == 'ema':
+            return calculate_ema(pd.DataFrame(closes), period).to_numpy()
+        return closes
+
+    @staticmethod
+    def spreads(a, b, params):
+        """
+        所有配對的 z-score 序列(列: K 棒, 欄: 配對), 同一 statarb_type 的配對一起計算
+        無法計算的值為 NaN(等同舊版 dropna), 無窮大為 0(等同舊版 replace)
+        """
+        series = np.full(a.shape, np.nan)
+        types = np.array([p['statarb_type'] for p in params])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for statarb_type in np.unique(types):
+                cols = np.flatnonzero(types == statarb_type)
+                A, B = a[:, cols], b[:, cols]
+
+                if statarb_type == 'beta':
+                    beta = np.array([params[i]['beta'] for i in cols], dtype=float)
+                    series[:, cols] = B - beta * A
+                    continue
+
+                if statarb_type == 'bias':
+                    ratio = np.array([bool(params[i]['use_ratio']) for i in cols])
+                    alpha = np.array([2 / (params[i]['bias_period'] + 1) for i in cols])
+                    spread = np.where(ratio, B / A, B - A)
+                    ema = np.empty_like(spread)
+                    ema[0] = spread[0]
+                    for t in range(1, len(spread)): # EWM(adjust=False), 逐列計算但跨配對向量化
+                        ema[t] = alpha * spread[t] + (1 - alpha) * ema[t - 1]
+                    series[:, cols] = (spread - ema) / ema * 100
+                    continue
+
+                if statarb_type == 'shift_log':
+                    use_log = np.array([bool(params[i]['use_log']) for i in cols])
+                    ra, rb = A[1:] / A[:-1], B[1:] / B[:-1]
+                    value = np.where(use_log, np.log(rb) - np.log(ra), rb / ra)
+                elif statarb_type == 'diff_change':
+                    use_pct = np.array([bool(params[i]['use_pct']) for i in cols])
+                    spread = B - A
+                    value = np.where(use_pct, spread[1:] / spread[:-1] - 1, spread[1:] - spread[:-1])
+                elif statarb_type == 'diff_change_shift':
+                    ratio = B / A
+                    value = (ratio[1:] - ratio[:-1]) / ratio[:-1]
+                else:
+                    raise ValueError(f"不支援的 statarb_type: {statarb_type}")
+
+                series[1:, cols] = np.where(np.isinf(value), 0.0, value)
+
+        return series
+
+    @classmethod
+    def evaluate(cls, a, b, params):
+        """所有配對最新值的 z-score, 資料不足為 NaN, 標準差為 0 時為 0"""
+        series = cls.spreads(a, b, params)
+        valid = ~np.isnan(series)
+        n = valid.sum(axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.nansum(series, axis=0) / n
+            std = np.sqrt(np.nansum((series - mean) ** 2, axis=0) / (n - 1))
+            last = series[len(series) - 1 - np.argmax(valid[::-1], axis=0), np.arange(series.shape[1])]  # 每欄最後一個有效值
+            zscores = (last - mean) / std
+
+        zscores = np.where(std == 0, 0.0, zscores)
+        return np.where(n < 2, np.nan, zscores)
+
+    @staticmethod
+    def signals(zscores, thresholds):
+        """與 Zscore.generate_signal 相同(-1, 1: 偏離進場, 2: 回歸平倉, 0: 無訊號)"""
+        return np.select(
+            [zscores > thresholds, zscores < -thresholds, np.abs(zscores) < 0.1],
+            [-1, 1, 2],
+            default=0
+        )
@@ -1,8 +1,13 @@
 from abc import ABC, abstractmethod
 from db.redis import get_redis_connection
-from data.DatasourceFactory import DatasourceFactory
+from db.bar_store import load_bars, load_bars_many
+from db.cycle_state import CycleState
 from position.load import load_position_controls
-from datetime import datetime, timedelta
+from utils.bar import get_bar_key
+from utils.rolling import get_kernel
+from utils.technical_indicator.streaming import IndicatorSeries, Rsi
+from datetime import datetime
+import numpy as np
 import pandas as pd
 from utils.log import get_module_logger
 import importlib, json, pytz, uuid
@@ -24,6 +29,21 @@ class AbstractStrategy(ABC):
         self.insert_data()
         self.last_data = self.get_last_ts_data()
         
+        self.trade_args = (profit_stop, stop_loss, tick_size)
+        self.set_trade_params(profit_stop, stop_loss, tick_size)
+
+        self.calculate = []
+        self.order = [] # 組裝訂單
+        self.position_control_classes = load_position_controls()  # 加載所有艙位控制
+        self.position_redis_key = f"{self.symbol}:{self.item['strategy']}:{self.process_redis_key()}"
+        self.analyze_redis_key = f"{self.symbol}:{self.item['strategy']}:{self.process_redis_key()}_analyze"
+        self.rolling_redis_key = f"{self.symbol}:{self.item['strategy']}:{self.process_redis_key()}_rolling"
+        self.build_position_control()
+        self.tz = pytz.timezone(f"{self.params['tz']}")
+        self.current_time = datetime.now(tz=self.tz)
+        self.begin_cycle()
+
+    def set_trade_params(self, profit_stop, stop_loss, tick_size):
         # 處理 profit_stop 參數
         if profit_stop == 0:
             self.profit_stop = 0
@@ -64,14 +84,46 @@ class AbstractStrategy(ABC):
         else:
             self.tick_size = self.params[tick_size]
 
+    def reload(self, datas, item):
+        """
+        常駐 worker 模式下重複使用策略實例: 以新一輪的資料與最新的 setting 重設每輪狀態
+        (保留 redis 連線、logger 與已載入的倉位控制類別), 子類別的每輪狀態於 reset_state 重設
+        """
+        self.item = item
+        self.data = datas
+        self.params = item['params']
+        self.interval = self.params.get('K_time', self.interval)
+        self.insert_data()
+        self.last_data = self.get_last_ts_data()
+        self.set_trade_params(*self.trade_args)
+
         self.calculate = []
-        self.order = [] # 組裝訂單
-        self.position_controls = load_position_controls()  # 加載所有艙位控制
+        self.order = []
         self.position_redis_key = f"{self.symbol}:{self.item['strategy']}:{self.process_redis_key()}"
         self.analyze_redis_key = f"{self.symbol}:{self.item['strategy']}:{self.process_redis_key()}_analyze"
+        self.rolling_redis_key = f"{self.symbol}:{self.item['strategy']}:{self.process_redis_key()}_rolling"
         self.build_position_control()
         self.tz = pytz.timezone(f"{self.params['tz']}")
         self.current_time = datetime.now(tz=self.tz)
+        self.begin_cycle()
+        self.reset_state()
+        return self
+
+    def reset_state(self):
+        """子類別每輪需要重設的狀態"""
+        pass
+
+    def state_keys(self):
+        """本輪需要讀取的 Redis hash key, 子類別加入自己的 key (last_k_ts、flag...)"""
+        return [self.position_redis_key, self.rolling_redis_key]
+
+    def begin_cycle(self):
+        # 每輪開始時以單次 pipeline 取得所有宣告的狀態, 之後的 get_from_redis 直接讀取快照
+        self.state = CycleState(self.redis).prefetch(self.state_keys())
+
+    def end_cycle(self):
+        # 本輪暫存的 save_to_redis(set) 一次寫回
+        self.state.flush()
 
     def process_redis_key(self):
         # 檢查 self.item['code'] 是否為列表
@@ -226,25 +278,8 @@ class AbstractStrategy(ABC):
         return
 
     def insert_data(self):
-        redis_k_keys = {}  # 用來收集每個 code 對應的 redis_k_key
-
-        for code, records in self.data.items():  # key 是 'TMFR1'，records 是列表
-            redis_calculate_key = f"{code}_{self.item['strategy']}_calculate"
-            redis_k = f"{code}_{self.item['strategy']}_{self.interval}k"
-            
-            # 儲存每個 code 對應的 redis_k_key
-            redis_k_keys[code] = redis_k
-
-            # 遍歷每筆記錄
-            for record in records:
-                # 提取 tick 數據
-                ticks = record.get('tick', [])  # 使用 get 避免 KeyError，默認為空列表
-                if ticks:  # 如果 tick 不為空
-                    for tick in ticks:
-                        # 將單個 tick 記錄存入 Redis
-                        self.save_to_redis(redis_calculate_key, tick)
-                        # 計算 OHLCV
-                        self.calculate_ohlcv(redis_calculate_key, redis_k)
+        # K 棒由 BarService 依 (broker, code, 週期) 統一合成, 這裡只取得本策略週期對應的 K 棒 key
+        redis_k_keys = {code: get_bar_key(self.params['broker'], code, self.interval) for code in self.item['code']}
 
         # 根據資料種類的數量決定 self.redis_k_key 是字串還是陣列
         if len(redis_k_keys) == 1:
@@ -255,7 +290,7 @@ class AbstractStrategy(ABC):
         return
 
     def get_from_redis(self, redis_key):
-        data = self.redis.hgetall(redis_key)
+        data = self.state.hgetall(redis_key)
 
         # 如果返回的資料是空字典，代表該 key 不存在
         if not data:
@@ -284,99 +319,22 @@ class AbstractStrategy(ABC):
     def lrange_of_redis(self, redis_key, start, end):
         return self.redis.lrange(redis_key, start, end)
     
+    def load_bars_of_redis(self, redis_key, count=None, frame=False):
+        # 從 K 棒環狀緩衝讀取最近 count 根, 回傳結構化陣列(frame=True 為 DataFrame), 已按時間排序
+        return load_bars(redis_key, count, frame)
+    
     def ltrim_of_redis(self, redis_key, start, end):
         return self.redis.ltrim(redis_key, start, end)
     
     def save_to_redis(self, redis_key, dict_data, type='list'):
         if type == 'list':
             self.redis.rpush(redis_key, json.dumps(dict_data))
-        elif type== 'set':
-            self.redis.hset(redis_key, mapping={key: str(value) for key, value in dict_data.items()})
+        elif type== 'set': # 暫存至本輪狀態, 於 end_cycle 寫回
+            self.state.hset(redis_key, {key: str(value) for key, value in dict_data.items()})
 
     def clear_redis_list(self, redis_key):
         return self.redis.delete(redis_key)
     
-    def calculate_ohlcv(self, redis_calculate_key, redis_k_key):
-        # 從 Redis 獲取數據
-        data = self.lrange_of_redis(redis_calculate_key, 0, -1)
-        if not data:
-            return
-
-        # 解析數據
-        recent_data = [json.loads(record) for record in data]
-
-        # 按 K 線窗口分組
-        kline_windows = {}  # 格式: {k_start: [records]}
-        for record in recent_data:
-            record_ts = datetime.strptime(record['ts'], "%Y-%m-%d %H:%M:%S")
-            # 計算所屬的 K 線窗口起始時間
-            k_start = self.get_kline_window_start(record_ts)
-            if k_start not in kline_windows:
-                kline_windows[k_start] = []
-            kline_windows[k_start].append(record)
-
-        # 獲取當前時間（假設以最後一筆數據的時間為基準）
-        last_ts = datetime.strptime(recent_data[-1]['ts'], "%Y-%m-%d %H:%M:%S")
-        current_time = last_ts
-
-        # 找出所有已完成的時間窗口
-        completed_windows = []
-        for k_start in kline_windows.keys():
-            window_end = k_start + timedelta(minutes=self.interval) - timedelta(seconds=1)  # 窗口結束時間
-            if window_end <= current_time:
-                completed_windows.append(k_start)
-
-        # 計算並存儲已完成的 K 線
-        for k_start in completed_windows:
-            records = kline_windows[k_start]
-            if records:
-                ohlcv = DatasourceFactory.calculate_ohlcv_from_data(records)
-            else:
-                # 若無數據，沿用前一根 K 線的收盤價
-                ohlcv = self.use_previous_ohlcv(redis_k_key)
-
-            self.store_ohlcv_to_redis(ohlcv, redis_k_key)
-
-        # 從 Redis 中移除已處理的數據（只保留未完成窗口的數據）
-        data_to_keep = []
-        for record in recent_data:
-            record_ts = datetime.strptime(record['ts'], "%Y-%m-%d %H:%M:%S")
-            k_start = self.get_kline_window_start(record_ts)
-            if k_start not in completed_windows:
-                data_to_keep.append(record)
-
-        # 清空並重新寫入未處理的數據
-        self.clear_redis_list(redis_calculate_key)
-        for record in data_to_keep:
-            self.save_to_redis(redis_calculate_key, record)
-
-    def get_kline_window_start(self, record_ts):
-        """
-        根據 record_ts 和 self.interval 計算所屬的 K 線窗口起始時間。
-        """
-        # 計算窗口起始時間
-        interval_minutes = self.interval
-        window_start_minute = (record_ts.minute // interval_minutes) * interval_minutes
-        k_start = record_ts.replace(minute=window_start_minute, second=0, microsecond=0)
-        return k_start
-
-    def store_ohlcv_to_redis(self, ohlcv, redis_k_key):        
-        # 將 OHLCV 存入 Redis
-        return self.save_to_redis(redis_k_key, ohlcv)
-           
-    def use_previous_ohlcv(self, redis_k_key):
-        # 取出最後一根 K 線資料作為基礎
-        previous_data = self.lrange_of_redis(redis_k_key, -1, -1)
-    
-        if previous_data:
-            ohlcv = json.loads(previous_data[0])
-            # 將成交量設為 0
-            ohlcv["volume"] = 0
-            return ohlcv
-    
-        # 若沒有前一根 K 線資料，返回預設空數據
-        return {"ts": 0, "open": 0, "high": 0, "low": 0, "close": 0, "volume": 0}
-    
     def load_calculations(self, data):
         calculation_types = self.item['calculation']
         
@@ -394,12 +352,57 @@ class AbstractStrategy(ABC):
                 else:
                     calculation_instance = calculation_class(self.params, pd.DataFrame(data), f"strategy/{self.item['strategy']}")
 
+                if hasattr(calculation_instance, 'bind_state'): # 需要跨輪保存狀態的計算(滾動統計)
+                    calculation_instance.bind_state(self.state, self.rolling_redis_key)
+
                 self.calculate.append(calculation_instance)
             except ImportError:
                 raise ValueError(f"Calculation type '{calc_type}' 不存在.")
             except AttributeError:
                 raise ValueError(f"Calculation class '{calc_type.capitalize()}' 沒有找到 '{calc_type}'.")
 
+    def engine_bars(self):
+        """
+        StatarbEngine 已算出本配對最新一根 K 棒的結果時, 回傳各商品最新一根 K 棒 {code: 結構化陣列},
+        策略只需沿用引擎結果, 不再讀取整個視窗與計算指標; 尚未算到最新一根時回傳 None
+        """
+        if list(self.item['calculation']) != ['zscore']: # 其他計算仍需要完整的視窗資料
+            return None
+
+        payload = self.state.hgetall(self.rolling_redis_key).get('engine')
+        if not payload:
+            return None
+
+        keys = {code: self.redis_k_key.get(code) if isinstance(self.redis_k_key, dict) else self.redis_k_key for code in self.item['code']}
+        if not all(keys.values()):
+            return None
+
+        bars = load_bars_many(list(dict.fromkeys(keys.values())), 1)
+        latest = {code: bars[key] for code, key in keys.items()}
+        if not all(len(bar) for bar in latest.values()):
+            return None
+
+        latest_ts = max(bar['ts'][-1] for bar in latest.values())  # 配對最新一根的時間(與 pair_bar_ts 相同)
+        if json.loads(payload).get('ts') != str(latest_ts.astype('datetime64[s]')):
+            return None
+        return latest
+
+    def rsi_series(self, redis_k_key, period):
+        """
+        最近 z_window 根 K 棒的 RSI(索引為 self.k_data 的位置, 已去除無法計算的值),
+        以每個進程快取的 IndicatorSeries 逐根更新, 與 StatarbEngine 共用同一個 key
+        """
+        z_window = self.params['z_window']
+        values = get_kernel((redis_k_key, 'rsi', period, z_window), lambda: IndicatorSeries(Rsi(period), z_window)).sync(self.k_data['ts'], self.k_data['close'])
+        return pd.Series(values, index=range(len(self.k_data) - len(values), len(self.k_data))).dropna()
+
+    def pair_bar_ts(self, bar_ts):
+        # 各商品同一位置的 K 棒時間取較新者, 作為配對資料每一列的時間
+        values = list(bar_ts.values())
+        if isinstance(values[0], pd.Series):
+            return pd.concat(values, axis=1).max(axis=1)
+        return np.maximum.reduce(values)
+
     def get_last_ts_data(self):
         if not self.data:
             return {}
@@ -450,12 +453,16 @@ class AbstractStrategy(ABC):
         return result[codes[0]] if len(codes) == 1 else result
 
     def build_position_control(self):
-        self.position_controls = self.position_controls[self.params['position_type']](take_profit=self.profit_stop, stop_loss=self.stop_loss, tick_size=self.tick_size, symbol=self.symbol, redis_key=self.position_redis_key)
+        self.position_controls = self.position_control_classes[self.params['position_type']](take_profit=self.profit_stop, stop_loss=self.stop_loss, tick_size=self.tick_size, symbol=self.symbol, redis_key=self.position_redis_key)
         return
 
     def execute_position_control(self, type, **params):
         if hasattr(self, 'position_controls'):
             self.log.info(f"當前策略倉位為: {self.params['position_type']}")
+            if type == 'check': # 使用本輪快照中的倉位資料
+                params.setdefault('raw_data', self.state.hgetall(self.position_redis_key))
+            elif type == 'set':
+                self.state.invalidate(self.position_redis_key)
             position_data = self.position_controls.execute(type, **params)
             if not position_data: return {}
             return position_data
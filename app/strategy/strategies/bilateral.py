@@ -5,25 +5,30 @@ import json, ast
 class Bilateral(AbstractStrategy):
     def __init__(self, datas, item, symbol):
         super().__init__(datas, item, symbol, 'oscillation_profit_ratio1', 'oscillation_stop_ratio1')
+        self.reset_state()
+
+    def reset_state(self):
         self.last_k_ts = None if super().get_from_redis(f"last_k_ts_{self.item['code'][0]}_{self.item['strategy']}") is None else datetime.strptime(super().get_from_redis(f"last_k_ts_{self.item['code'][0]}_{self.item['strategy']}")['ts'], "%Y-%m-%d %H:%M:%S")
         self.total_bid_volume = 0
         self.total_ask_volume = 0
         self.k_data = []
 
+    def state_keys(self):
+        return super().state_keys() + [
+            f"last_k_ts_{self.item['code'][0]}_{self.item['strategy']}",
+            f"{self.item['strategy']}_{json.dumps(self.item['code'])}_sr"
+        ]
+
     def load_k(self):
-        k_amount = self.lrange_of_redis(self.redis_k_key, -self.params['long_window'], -1)
+        # 從環狀緩衝讀取最近 long_window 根 K 棒, 直接取得 DataFrame
+        self.k_data = self.load_bars_of_redis(self.redis_k_key, self.params['long_window'], frame=True)
         
-        if len(k_amount) < self.params['long_window']:
+        if len(self.k_data) < self.params['long_window']:
             return 0
         
-        # 只取最近 long_window 根 K 棒
-        recent_k_amount = k_amount[-self.params['long_window']:]
-        
-        # 將 JSON 字串轉換為資料結構
-        self.k_data = [json.loads(record) for record in recent_k_amount]
         self.log.info(f"當前的K棒時間序列: {self.k_data}")
         
-        latest_k_ts = datetime.strptime(self.k_data[-1]['ts'], "%Y-%m-%d %H:%M:%S")
+        latest_k_ts = self.k_data['ts'].iloc[-1].to_pydatetime()
         if self.last_k_ts is None:
             return super().save_to_redis(f"last_k_ts_{self.item['code'][0]}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')  # 存入 Redis
             
@@ -1,18 +1,28 @@
 from .abc.AbstractStrategy import AbstractStrategy
 from datetime import datetime, time
-import json
 
 class Statarb3(AbstractStrategy):
     def __init__(self, datas, item, symbol):
         super().__init__(datas, item, symbol, 0, ['stop_ratio1', 'stop_ratio2'], [{'tick_size': 'tick_size1', 'levearge': 'levearge1', 'symbol': 'fstock'}, {'tick_size': 'tick_size2', 'levearge': 'levearge2', 'symbol': 'fstock'}])
         self.code_mapping = {'QXFR1': 'A', 'DAFR1': 'B'}
+        self.reset_state()
+
+    def reset_state(self):
         self.current_position1 = None
         self.current_position2 = None
         self.k_data = []
 
+    def state_keys(self):
+        return super().state_keys() + [
+            key for code in self.item['code']
+            for key in (f"last_k_{code}_{self.item['strategy']}", f"flag_{code}_{self.item['strategy']}")
+        ]
+
     def load_k(self):
         df_dict = {}
+        bar_ts = {}  # 每個 code 對應資料的 K 棒時間, 供滾動 z-score 判斷新 K 棒
         ts_comparison = []  # 用於儲存每個 code 的 last_k_ts 和 latest_k_ts 比較結果
+        engine_bars = self.engine_bars()  # StatarbEngine 已算到最新一根 K 棒時只讀取最新一根, 不重算指標
 
         for code in self.item['code']:
             last_k_ts = None if super().get_from_redis(f"last_k_{code}_{self.item['strategy']}") is None else datetime.strptime(super().get_from_redis(f"last_k_{code}_{self.item['strategy']}")['ts'], "%Y-%m-%d %H:%M:%S")
@@ -23,18 +33,14 @@ class Statarb3(AbstractStrategy):
                 self.log.info(f"找不到對應的 redis_k_key: {code}")
                 continue  # 如果找不到對應的 redis_k_key，跳過該 code
             
-            k_amount = self.lrange_of_redis(redis_k_key, -self.params['z_window'], -1)
+            # 從環狀緩衝讀取最近 z_window 根 K 棒(已排序, 不需逐筆解析)
+            self.k_data = engine_bars[code] if engine_bars else self.load_bars_of_redis(redis_k_key, self.params['z_window'])
 
-            if len(k_amount) < self.params['z_window']:
-                self.log.info(f"當前K棒數量{len(k_amount)}小於{self.params['z_window']}")
+            if not engine_bars and len(self.k_data) < self.params['z_window']:
+                self.log.info(f"當前K棒數量{len(self.k_data)}小於{self.params['z_window']}")
                 continue
 
-            # 只取最近 long_window 根 K 棒
-            recent_k_amount = k_amount[-self.params['z_window']:]
-            
-            # 將 JSON 字串轉換為資料結構
-            self.k_data = [json.loads(record) for record in recent_k_amount]
-            latest_k_ts = datetime.strptime(self.k_data[-1]['ts'], "%Y-%m-%d %H:%M:%S")
+            latest_k_ts = self.k_data['ts'][-1].astype(datetime)
 
             if last_k_ts is None:
                 super().save_to_redis(f"last_k_{code}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')  # 存入 Redis
@@ -47,9 +53,9 @@ class Statarb3(AbstractStrategy):
             # 依照預設的對應關係將 code 換成 'A' 或 'B'
             mapped_code = self.code_mapping.get(code, code)  # 如果沒有對應關係，保持原代號
             
-            self.k_data = sorted(self.k_data, key=lambda x: datetime.strptime(x['ts'], '%Y-%m-%d %H:%M:%S'))
-            close_series = [float(record['close']) for record in self.k_data]
+            close_series = self.k_data['close'].tolist()
             self.log.info(f"當前的close時間序列:{close_series}")
+            bar_ts[mapped_code] = self.k_data['ts']
             # 將每個 code 對應的資料存儲到字典中，key 為映射後的代號
             df_dict[mapped_code] = close_series
 
@@ -61,6 +67,7 @@ class Statarb3(AbstractStrategy):
                 super().save_to_redis(f"last_k_{code}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')
 
         if ts_comparison and all(ts_comparison):
+            df_dict['ts'] = self.pair_bar_ts(bar_ts)
             return self.load_calculations(df_dict)
 
     def publish_order(self, action, **params):
@@ -1,20 +1,29 @@
 from .abc.AbstractStrategy import AbstractStrategy
 import pandas as pd
-from utils.technical_indicator.rsi import calculate_rsi
 from datetime import datetime, time
-import json
 
 class Statarb4(AbstractStrategy):
     def __init__(self, datas, item, symbol):
         super().__init__(datas, item, symbol, 0, ['stop_ratio1', 'stop_ratio2'], [{'tick_size': 'tick_size1', 'levearge': 'levearge1', 'symbol': 'fstock'}, {'tick_size': 'tick_size2', 'levearge': 'levearge2', 'symbol': 'fstock'}])
         self.code_mapping = {'CKFR1': 'A', 'DDFR1': 'B'}
+        self.reset_state()
+
+    def reset_state(self):
         self.current_position1 = None
         self.current_position2 = None
         self.k_data = []
 
+    def state_keys(self):
+        return super().state_keys() + [
+            key for code in self.item['code']
+            for key in (f"last_k_{code}_{self.item['strategy']}", f"flag_{code}_{self.item['strategy']}")
+        ]
+
     def load_k(self):
         df_dict = {}
+        bar_ts = {}  # 每個 code 對應資料的 K 棒時間, 供滾動 z-score 判斷新 K 棒
         ts_comparison = []  # 用於儲存每個 code 的 last_k_ts 和 latest_k_ts 比較結果
+        engine_bars = self.engine_bars()  # StatarbEngine 已算到最新一根 K 棒時只讀取最新一根, 不重算指標
 
         for code in self.item['code']:
             last_k_ts = None if super().get_from_redis(f"last_k_{code}_{self.item['strategy']}") is None else datetime.strptime(super().get_from_redis(f"last_k_{code}_{self.item['strategy']}")['ts'], "%Y-%m-%d %H:%M:%S")
@@ -26,19 +35,13 @@ class Statarb4(AbstractStrategy):
                 continue  # 如果找不到對應的 redis_k_key，跳過該 code
             
             minimount = (self.params['z_window'] + self.params['indicator']['rsi'])
-            k_amount = self.lrange_of_redis(redis_k_key, -minimount, -1)
+            self.k_data = engine_bars[code] if engine_bars else self.load_bars_of_redis(redis_k_key, minimount)  # 從環狀緩衝讀取, 已排序
 
-            if len(k_amount) < minimount:
-                self.log.info(f"當前K棒數量{len(k_amount)}小於{minimount}")
+            if not engine_bars and len(self.k_data) < minimount:
+                self.log.info(f"當前K棒數量{len(self.k_data)}小於{minimount}")
                 continue
 
-            # 只取最近 long_window 根 K 棒
-            recent_k_amount = k_amount[-minimount:]
-            
-            # 將 JSON 字串轉換為資料結構
-            self.k_data = [json.loads(record) for record in recent_k_amount]
-
-            latest_k_ts = datetime.strptime(self.k_data[-1]['ts'], "%Y-%m-%d %H:%M:%S")
+            latest_k_ts = self.k_data['ts'][-1].astype(datetime)
 
             if last_k_ts is None:
                 super().save_to_redis(f"last_k_{code}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')  # 存入 Redis
@@ -50,22 +53,22 @@ class Statarb4(AbstractStrategy):
 
             # 依照預設的對應關係將 code 換成 'A' 或 'B'
             mapped_code = self.code_mapping.get(code, code)  # 如果沒有對應關係，保持原代號
-            self.k_data = sorted(self.k_data, key=lambda x: datetime.strptime(x['ts'], '%Y-%m-%d %H:%M:%S'))
-            
-            # 將每個 code 對應的資料存儲到字典中，key 為映射後的代號, 計算 RSI
-            rsi_series = calculate_rsi(pd.Series([float(record['close']) for record in self.k_data]), self.params['indicator']['rsi'])
-            self.log.info(f"當前RSI序列: {rsi_series}")
             
-            if rsi_series.count() < self.params['z_window']:
-                self.log.info(f"當前的rsi時間序列資料共: {len(rsi_series)} 筆, 最低要求: {self.params['z_window']} 筆")
-                return
+            if engine_bars: # 沿用 StatarbEngine 的結果, Zscore 只需要最新一根的時間
+                df_dict[mapped_code] = self.k_data['close'].tolist()
+                bar_ts[mapped_code] = self.k_data['ts']
+            else:
+                # 將每個 code 對應的資料存儲到字典中，key 為映射後的代號, 計算 RSI
+                rsi_series = self.rsi_series(redis_k_key, self.params['indicator']['rsi'])
+                self.log.info(f"當前RSI序列: {rsi_series}")
             
-            # 如果 RSI 序列長度超過 z_window，選取最新的 z_window 個數值
-            if len(rsi_series) > self.params['z_window']:
-                rsi_series = rsi_series.tail(self.params['z_window'])
-                self.log.info(f"RSI序列已依照z_window進行裁剪 {self.params['z_window']} 筆: {rsi_series}")
+                if rsi_series.count() < self.params['z_window']:
+                    self.log.info(f"當前的rsi時間序列資料共: {len(rsi_series)} 筆, 最低要求: {self.params['z_window']} 筆")
+                    return
             
-            df_dict[mapped_code] = rsi_series
+                df_dict[mapped_code] = rsi_series
+                bar_ts[mapped_code] = pd.Series(self.k_data['ts'][rsi_series.index.to_numpy()], index=rsi_series.index)
+
             if super().get_from_redis(f"flag_{code}_{self.item['strategy']}") is None:
                 super().save_to_redis(f"flag_{code}_{self.item['strategy']}", {'flag': True}, type='set')
                 
@@ -74,6 +77,7 @@ class Statarb4(AbstractStrategy):
                 super().save_to_redis(f"last_k_{code}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')
 
         if ts_comparison and all(ts_comparison):
+            df_dict['ts'] = self.pair_bar_ts(bar_ts)
             return self.load_calculations(df_dict)
 
     def publish_order(self, action, **params):
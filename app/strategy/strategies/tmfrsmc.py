@@ -1,12 +1,18 @@
 from .abc.AbstractStrategy import AbstractStrategy
 from datetime import datetime, time, timedelta
 import pandas as pd
-from utils.k import convert_ohlcv
-import json
+import numpy as np
+from utils.k import MultiTimeframeBars
+from utils.rolling import get_kernel
+
+K_TAIL = 30  # 每輪讀取最近的 1 分 K 根數, 與快取不連續時才讀取全部
 
 class Tmfrsmc(AbstractStrategy):
     def __init__(self, datas, item, symbol):
         super().__init__(datas, item, symbol, 'profit_ratio1', 'stop_ratio1')
+        self.reset_state()
+
+    def reset_state(self):
         self.current_position1 = None
         
         # k棒VWAP計算時間窗口
@@ -17,37 +23,38 @@ class Tmfrsmc(AbstractStrategy):
         ]
         self.tuple_results = []
 
+    def state_keys(self):
+        return super().state_keys() + [f"last_k_1min_{self.item['code'][0]}_{self.item['strategy']}"]
+
     def load_k(self):
         try:
             last_1min_k = None if super().get_from_redis(f"last_k_1min_{self.item['code'][0]}_{self.item['strategy']}") is None else datetime.strptime(super().get_from_redis(f"last_k_1min_{self.item['code'][0]}_{self.item['strategy']}")['ts'], "%Y-%m-%d %H:%M:%S")
-            k_amount = self.lrange_of_redis(self.redis_k_key, 0, -1)  # 取出所有資料
-
-            if not k_amount:  # 如果 Redis 沒有資料，返回 0
-                self.log.info("當前redis無法取得k_amount")
-                return (False)
+            freqs = (self.params['k_time_long'], self.params['k_time_middle'], self.params['k_time_short'])
+            timeframes = get_kernel((self.rolling_redis_key, 'timeframes', freqs), lambda: MultiTimeframeBars(freqs))
 
-            # 將 JSON 字串轉為 Python 物件
-            self.k_data = [json.loads(record) for record in k_amount]
             start_time = (self.current_time - timedelta(days=1)).replace(hour=8, minute=45, second=0, microsecond=0)
 
-            # 轉換為 Pandas DataFrame
-            k_df = pd.DataFrame(self.k_data)
-
-            # 將 'ts' 欄位轉為 datetime 格式，移除時區並轉為 datetime64[ns]
-            k_df['ts'] = pd.to_datetime(k_df['ts'])
-            start_time = pd.Timestamp(start_time).tz_localize(None)
-            current_time = pd.Timestamp(self.current_time).tz_localize(None)
+            start_time = np.datetime64(pd.Timestamp(start_time).tz_localize(None), 's')
+            current_time = np.datetime64(pd.Timestamp(self.current_time).tz_localize(None), 's')
 
             # 過濾時間範圍：從昨天 08:45 到當前時刻
-            k_df = k_df[(k_df['ts'] >= start_time) & (k_df['ts'] <= current_time)]
+            def in_range(bars):
+                return bars[(bars['ts'] >= start_time) & (bars['ts'] <= current_time)]
+
+            bars = in_range(self.load_bars_of_redis(self.redis_k_key, K_TAIL))  # 只取最近幾根 1 分 K
+            if not timeframes.covers(bars['ts']):  # 快取尚未建立或中間有缺漏, 取出環狀緩衝中所有資料重建
+                bars = in_range(self.load_bars_of_redis(self.redis_k_key))
 
             # 如果沒有符合時間範圍的資料，返回 0
-            if k_df.empty:
+            if not len(bars):
                 self.log.info("當前取出的k棒資料, 無法過濾出近期一天的K棒")
                 return (False)
 
-            k_df.set_index('ts', inplace=True)
-            latest_k_ts = k_df.index[-1].to_pydatetime()
+            # 逐根更新 4 小時 / 15 分 / 5 分 K 棒, 只保留從昨天 08:45 開始的時段
+            timeframes.sync(bars['ts'], bars['open'], bars['high'], bars['low'], bars['close'], bars['volume'])
+            timeframes.trim(start_time)
+
+            latest_k_ts = pd.Timestamp(bars['ts'][-1]).to_pydatetime()
 
             if last_1min_k is None:
                 return super().save_to_redis(f"last_k_1min_{self.item['code'][0]}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')
@@ -55,11 +62,7 @@ class Tmfrsmc(AbstractStrategy):
             if latest_k_ts != last_1min_k:
                 super().save_to_redis(f"last_k_1min_{self.item['code'][0]}_{self.item['strategy']}", {'ts': latest_k_ts.strftime("%Y-%m-%d %H:%M:%S")}, type='set')
 
-                data1 = convert_ohlcv(k_df, self.params['k_time_long'])
-                data2 = convert_ohlcv(k_df, self.params['k_time_middle'])
-                data3 = convert_ohlcv(k_df, self.params['k_time_short'])
-
-                return (data1, data2, data3)
+                return tuple(timeframes.frame(freq) for freq in freqs)
 
             return (False)
         except Exception as e:
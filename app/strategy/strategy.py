@@ -31,9 +31,30 @@ class Strategy:
         
         return [(self.symbol, self.item, False, {}, {}, {})]
 
+    def update(self, datas, item):
+        """常駐 worker 模式: 重用已載入的策略實例, 只更新本輪資料與設定"""
+        self.item = item
+        self.data = datas
+
+        if not self.strategies:
+            self.load_strategy(item)
+            return self
+
+        try:
+            self.strategies.reload(datas, item)
+        except Exception as e:
+            self.log.error(f"Strategy 重新載入錯誤: {e}, 將重新建立實例")
+            self.strategies = None
+            self.load_strategy(item)
+
+        return self
+
     def execute(self):
         if not self.data or not self.strategies:
             self.log.info(f"當前無資料: {self.data}, 或沒加載策略: {self.strategies}")
             return [(self.symbol, self.item, False, {}, {}, {})]
         
-        return self.strategies.execute()
+        try:
+            return self.strategies.execute()
+        finally:
+            self.strategies.end_cycle()  # 寫回本輪暫存的策略狀態
@@ -0,0 +1,128 @@
+import asyncio, itertools, multiprocessing, queue, threading
+from utils.log import get_module_logger
+
+def _worker_main(inbox, outbox, log):
+    """
+    常駐 worker 進程: 保留分配到此進程的策略實例, 每輪只接收要計算的項目
+    """
+    from main import check_signal  # 延遲引用, 避免與 main 循環引用
+
+    strategies = {}  # {symbol:strategy: Strategy}
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+
+        request_id, symbol, item = message
+        try:
+            result = check_signal(symbol, item, log, strategies)
+        except Exception as e:
+            log.error(f"常駐 worker 計算失敗: {symbol}, {item.get('strategy')}, {e}")
+            result = [(symbol, item, False, {}, {}, {})]
+
+        outbox.put((request_id, result))
+
+class StrategyWorkerPool:
+    """
+    固定分配的常駐 worker:
+    每個策略項目(symbol:strategy)固定交給同一個 worker 進程, 策略實例、計算物件與快取的狀態保留在該進程中,
+    避免每輪重新 import、建立策略與倉位控制。submit 回傳 asyncio.Future, 可直接搭配 asyncio.as_completed
+    """
+    def __init__(self, max_workers=2, log=None):
+        self.log = get_module_logger('strategy/worker')
+        self.max_workers = max_workers
+        self.worker_log = log or self.log
+        self._results = multiprocessing.Queue()
+        self._inboxes = [multiprocessing.Queue() for _ in range(max_workers)]
+        self._processes = [None] * max_workers
+        self._assign = {}  # {symbol:strategy: worker index}
+        self._pending = {}  # {request_id: (loop, future, worker index, symbol, item)}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+        self._running = False
+
+    def start(self):
+        for index in range(self.max_workers):
+            self._spawn(index)
+
+        self._running = True
+        self._collector = threading.Thread(target=self._collect, name='strategy-worker-collector', daemon=True)
+        self._collector.start()
+        self.log.info(f"常駐 worker 啟動, 數量: {self.max_workers}")
+        return self
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(target=_worker_main, args=(self._inboxes[index], self._results, self.worker_log), daemon=True)
+        process.start()
+        self._processes[index] = process
+
+    def _worker_for(self, key):
+        if key not in self._assign: # 依序分配, 之後固定在同一個 worker
+            self._assign[key] = len(self._assign) % self.max_workers
+        return self._assign[key]
+
+    def submit(self, symbol, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        with self._lock:
+            request_id = next(self._ids)
+            index = self._worker_for(f"{symbol}:{item['strategy']}")
+            self._pending[request_id] = (loop, future, index, symbol, item)
+
+        self._inboxes[index].put((request_id, symbol, item))
+        return future
+
+    def _resolve(self, request_id, result):
+        with self._lock:
+            pending = self._pending.pop(request_id, None)
+        if not pending:
+            return
+
+        loop, future, _, _, _ = pending
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+    def _collect(self):
+        while self._running:
+            try:
+                message = self._results.get(timeout=1)
+            except queue.Empty:
+                self._check_workers()
+                continue
+
+            if message is None:
+                break
+
+            request_id, result = message
+            self._resolve(request_id, result)
+
+    def _check_workers(self):
+        """worker 異常結束時重新啟動, 並讓該 worker 尚未完成的請求回傳預設結果"""
+        for index, process in enumerate(self._processes):
+            if not self._running or process.is_alive():
+                continue
+
+            self.log.error(f"常駐 worker {index} 已結束(exitcode: {process.exitcode}), 重新啟動, 策略狀態將重新建立")
+            with self._lock:
+                lost = [(request_id, symbol, item) for request_id, (_, _, worker, symbol, item) in self._pending.items() if worker == index]
+
+            for request_id, symbol, item in lost:
+                self._resolve(request_id, [(symbol, item, False, {}, {}, {})])
+
+            self._spawn(index)
+
+    def shutdown(self, wait=True):
+        self._running = False
+        for inbox in self._inboxes:
+            inbox.put(None)
+
+        if wait:
+            for process in self._processes:
+                if process:
+                    process.join(5)
+
+        self._results.put(None)
+        if self._collector and wait:
+            self._collector.join(5)
+        self.log.info("常駐 worker 已停止")
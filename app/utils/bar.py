@@ -0,0 +1,193 @@
+import json, os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+load_dotenv()
+
+# K 棒合成的 Lua 腳本: 讀取快照、依序套用整批 tick、RPUSH 完成的 K 棒並寫回快照, 單次往返且具原子性
+# KEYS[1]: K 棒列表, KEYS[2]: 快照(以 hash tag 與 KEYS[1] 同 slot)
+# ARGV: 每筆 tick 5 個參數 (ts, 窗口起點, 窗口結束, close, volume), 窗口由客戶端計算
+_LUA_SCRIPT = """
+local windows = {}
+local snapshot = redis.call('GET', KEYS[2])
+if snapshot then
+    windows = cjson.decode(snapshot)
+end
+
+local finished = {}
+for i = 1, #ARGV, 5 do
+    local ts, start, stop = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    local close, volume = tonumber(ARGV[i + 3]), tonumber(ARGV[i + 4])
+    local found = false
+
+    for _, window in ipairs(windows) do
+        if window['start'] == start then
+            local bar = window['bar']
+            bar['close'] = close
+            if close > bar['high'] then bar['high'] = close end
+            if close < bar['low'] then bar['low'] = close end
+            bar['volume'] = bar['volume'] + volume
+            found = true
+            break
+        end
+    end
+
+    if not found then
+        table.insert(windows, {start = start, ['end'] = stop, bar = {ts = ts, open = close, close = close, high = close, low = close, volume = volume}})
+    end
+
+    local keep = {}
+    for _, window in ipairs(windows) do
+        if window['end'] <= ts then
+            table.insert(finished, cjson.encode(window['bar']))
+        else
+            table.insert(keep, window)
+        end
+    end
+    windows = keep
+end
+
+for i = 1, #finished, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(finished, i, math.min(i + 999, #finished)))
+end
+
+if #windows == 0 then
+    redis.call('SET', KEYS[2], '[]')
+else
+    redis.call('SET', KEYS[2], cjson.encode(windows))
+end
+return finished
+"""
+_scripts = {}  # {id(redis_cli): Script}
+_migrated = set()  # 已檢查過舊版 _calculate 暫存的 K 棒 key
+
+class BarBuilder:
+    """
+    串流 K 棒合成:
+    只保留尚未完成的 K 棒狀態(OHLCV), 每筆 tick 進來時更新, 完成的 K 棒直接輸出
+    窗口規則與舊版 calculate_ohlcv 相同:
+      - 窗口起點為同一小時內 minute // interval * interval
+      - 窗口結束為 起點 + interval - 1 秒, 當最新一筆 tick 的時間 >= 結束時間即完成
+      - K 棒 ts 為窗口第一筆資料的時間, open/close 為首/末筆 close, high/low 為 close 的最大/最小值
+      - 同時可能有多個未完成窗口(例如 45k 跨小時), 依開啟順序輸出
+    """
+    FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, interval, windows=None):
+        self.interval = int(interval)
+        self.windows = windows or []  # [{'start', 'end', 'bar'}], 依開啟順序
+
+    def window_start(self, ts):
+        minute = int(ts[14:16]) // self.interval * self.interval
+        return f"{ts[:14]}{minute:02d}:00"
+
+    def window_end(self, start):
+        end = datetime.strptime(start, self.FORMAT) + timedelta(minutes=self.interval) - timedelta(seconds=1)
+        return end.strftime(self.FORMAT)
+
+    def update(self, record):
+        """加入一筆 tick, 回傳因此完成的 K 棒列表"""
+        ts = record['ts'][:19]
+        start = self.window_start(ts)
+        close, volume = record['close'], int(record['volume'])
+
+        for window in self.windows:
+            if window['start'] == start:
+                bar = window['bar']
+                bar['close'] = close
+                if close > bar['high']:
+                    bar['high'] = close
+                if close < bar['low']:
+                    bar['low'] = close
+                bar['volume'] += volume
+                break
+        else:
+            self.windows.append({
+                'start': start,
+                'end': self.window_end(start),
+                'bar': {'ts': ts, 'open': close, 'close': close, 'high': close, 'low': close, 'volume': volume}
+            })
+
+        # 以最新一筆的時間判斷哪些窗口已完成
+        finished = [window['bar'] for window in self.windows if window['end'] <= ts]
+        if finished:
+            self.windows = [window for window in self.windows if window['end'] > ts]
+        return finished
+
+    def to_json(self):
+        return json.dumps(self.windows)
+
+    @classmethod
+    def from_json(cls, interval, payload):
+        return cls(interval, (json.loads(payload) or []) if payload else [])  # Lua cjson 會將空陣列編碼為 {}
+
+def get_bar_key(broker, code, interval):
+    """同一券商、商品與週期的 K 棒由 BarService 統一合成, 各策略共用"""
+    return f"{broker}_{code}_{interval}k"
+
+def snapshot_key(redis_k_key):
+    """未完成 K 棒的快照 key, 以 hash tag 與 K 棒列表放在同一個 slot"""
+    return f"{{{redis_k_key}}}_open"
+
+def get_bar_mode():
+    return os.getenv('BAR_BUILDER', 'lua').lower()
+
+def _get_script(redis_cli):
+    script = _scripts.get(id(redis_cli))
+    if script is None:
+        script = _scripts[id(redis_cli)] = redis_cli.register_script(_LUA_SCRIPT)
+    return script
+
+def _take_legacy(redis_cli, legacy_key):
+    """取出舊版逐筆暫存的資料(每個程序只檢查一次)並刪除"""
+    if not legacy_key or legacy_key in _migrated:
+        return []
+
+    _migrated.add(legacy_key)
+    pending = redis_cli.lrange(legacy_key, 0, -1)
+    if pending:
+        redis_cli.delete(legacy_key)
+    return [json.loads(record) for record in pending]
+
+def update_bars_lua(redis_cli, redis_k_key, interval, records, legacy_key=None):
+    """以 Lua 腳本在 Redis 端合成 K 棒, 整批 tick 一次往返, 回傳完成的 K 棒"""
+    builder = BarBuilder(interval)
+    ends = {}  # 窗口結束時間快取, 同一批 tick 通常只落在一兩個窗口
+    args = []
+
+    for record in _take_legacy(redis_cli, legacy_key) + list(records):
+        ts = record['ts'][:19]
+        start = builder.window_start(ts)
+        if start not in ends:
+            ends[start] = builder.window_end(start)
+        args.extend((ts, start, ends[start], record['close'], int(record['volume'])))
+
+    if not args:
+        return []
+
+    finished = _get_script(redis_cli)(keys=[redis_k_key, snapshot_key(redis_k_key)], args=args)
+    return [json.loads(bar) for bar in finished or []]
+
+def update_bars(redis_cli, redis_k_key, interval, records, legacy_key=None):
+    """
+    合成 K 棒並回傳完成的 K 棒, 依 BAR_BUILDER 選擇 Redis 端 Lua 腳本(lua)或本地合成(local)
+    legacy_key: 舊版逐筆暫存的 {code}_{strategy}_calculate, 若存在會先重放再刪除
+    """
+    if get_bar_mode() == 'lua':
+        return update_bars_lua(redis_cli, redis_k_key, interval, records, legacy_key)
+    return update_bars_local(redis_cli, redis_k_key, interval, records, legacy_key)
+
+def update_bars_local(redis_cli, redis_k_key, interval, records, legacy_key=None):
+    """讀取快照 -> 本地合成 -> 一次 pipeline 寫回完成的 K 棒與新的快照"""
+    open_key = snapshot_key(redis_k_key)
+    builder = BarBuilder.from_json(interval, redis_cli.get(open_key))
+    finished = []
+
+    for record in _take_legacy(redis_cli, legacy_key) + list(records):
+        finished.extend(builder.update(record))
+
+    pipe = redis_cli.pipeline(transaction=False)
+    if finished:
+        pipe.rpush(redis_k_key, *[json.dumps(bar) for bar in finished])
+    pipe.set(open_key, builder.to_json())
+    pipe.execute()
+    return finished
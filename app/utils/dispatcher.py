@@ -0,0 +1,94 @@
+import asyncio, os, time
+from db.redis import get_redis_connection, get_stream_keys
+from db.stream import get_stream_writer
+from utils.log import get_module_logger
+from dotenv import load_dotenv
+load_dotenv()
+
+class StreamDispatcher:
+    """
+    事件驅動的策略排程:
+    StreamWriter 每次 flush 完成後通知寫入的 stream key, 只排程這些 stream 所屬的策略項目
+    計算期間持續寫入的 key 會累積在同一個集合中, 下一輪每個項目只執行一次(合併突發行情)
+    另外保留定時器, 每 interval 秒執行有倉位或未完成訂單的項目, 供 force_close 等依時間出場的邏輯使用
+    (沒有倉位的項目只會進場, 進場只由新行情觸發, 定時器不需執行)
+    """
+    def __init__(self, loop=None, interval=1.0, coalesce=0.005, redis_cli=None):
+        self.log = get_module_logger('utils/dispatcher')
+        self.redis = redis_cli or get_redis_connection()
+        self.loop = loop or asyncio.get_running_loop()
+        self.interval = interval
+        self.coalesce = coalesce
+        self._dirty = set()
+        self._event = asyncio.Event()
+        self._last_timer = time.monotonic()
+
+    def attach(self, writer=None):
+        (writer or get_stream_writer()).add_listener(self._on_flush)
+        self.log.info(f"StreamDispatcher 啟動, 定時器: {self.interval}s, 合併等待: {self.coalesce}s")
+        return self
+
+    def _on_flush(self, keys): # 在 flusher 執行緒中被呼叫
+        self.loop.call_soon_threadsafe(self._mark, keys)
+
+    def _mark(self, keys):
+        self._dirty.update(keys)
+        self._event.set()
+
+    async def wait(self):
+        """等待新資料或定時器, 回傳 (有新資料的 stream key, 是否為定時執行)"""
+        timeout = max(self.interval - (time.monotonic() - self._last_timer), 0)
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            if self.coalesce:
+                await asyncio.sleep(self.coalesce)  # 讓同一波行情的其他 stream 一併寫入
+        except asyncio.TimeoutError:
+            pass
+
+        self._event.clear()
+        dirty, self._dirty = self._dirty, set()
+
+        timer = time.monotonic() - self._last_timer >= self.interval
+        if timer:
+            self._last_timer = time.monotonic()
+        return dirty, timer
+
+    @staticmethod
+    def position_key(symbol, item):
+        """策略的倉位 hash key(與 AbstractStrategy.position_redis_key 相同)"""
+        return f"{symbol}:{item['strategy']}:{'_'.join(item['code'])}"
+
+    def active(self, items):
+        """有倉位或未完成訂單(倉位 hash 存在)的項目, 以單次 pipeline 查詢"""
+        keys = [self.position_key(symbol, item) for symbol, item_list in items.items() for item in item_list]
+        if not keys:
+            return set()
+
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return {key for key, exists in zip(keys, pipe.execute()) if exists}
+
+    def select(self, items, dirty, timer=False):
+        """只保留有商品收到新資料的策略項目, 定時執行時另外加入有倉位的項目"""
+        active = self.active(items) if timer else set()
+        selected = {}
+        for symbol, item_list in items.items():
+            matched = [
+                item for item in item_list
+                if self.position_key(symbol, item) in active
+                or any(key in dirty for keys in get_stream_keys(item['params']['broker'], symbol, item['code']).values() for key in keys)
+            ]
+            if matched:
+                selected[symbol] = matched
+        return selected
+
+def get_dispatcher():
+    """依照 DISPATCH_MODE 建立排程器, poll 模式回傳 None(維持每秒輪詢)"""
+    if os.getenv('DISPATCH_MODE', 'event').lower() != 'event':
+        return None
+
+    return StreamDispatcher(
+        interval=float(os.getenv('DISPATCH_TIMER_SECONDS', 1)),
+        coalesce=float(os.getenv('DISPATCH_COALESCE_MS', 5)) / 1000
+    ).attach()
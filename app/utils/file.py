@@ -18,30 +18,42 @@ def open_json_file():
     return settings
 
 def update_settings(target_key, target_codes, strategy, new_params):
+    return update_settings_many([(target_key, target_codes, strategy, new_params)])
+
+def update_settings_many(updates):
+    """
+    一次讀取並寫回多個策略的參數更新, updates: [(target_key, target_codes, strategy, new_params), ...]
+    先寫入暫存檔再以 os.replace 取代, 讀取端不會讀到寫到一半的 setting.json
+    """
     try:
         # 读取 JSON 文件
         with open(json_file_path, 'r') as f:
             settings = json.load(f)
 
-        # 仅遍历指定的 item_key（例如 future, stock）
-        item_list = settings["items"].get(target_key, [])
-        for item in item_list:
-            # 完整比较两个列表是否相同
-            if item.get("strategy") == strategy:
-                if sorted(item.get("code", [])) == sorted(target_codes):
-
-                    # 检查是否存在 "$ref" 引用
-                    if "$ref" in item.get("params", {}):
-                        updated_params = copy.deepcopy(settings["params"])
-                        updated_params.update(new_params)
-                        item["params"] = updated_params
-                    else:
-                        item["params"].update(new_params)
-
-                    break
-
-        with open(json_file_path, "w") as file:
+        for target_key, target_codes, strategy, new_params in updates:
+            # 仅遍历指定的 item_key（例如 future, stock）
+            item_list = settings["items"].get(target_key, [])
+            for item in item_list:
+                # 完整比较两个列表是否相同
+                if item.get("strategy") == strategy:
+                    if sorted(item.get("code", [])) == sorted(target_codes):
+
+                        # 检查是否存在 "$ref" 引用
+                        if "$ref" in item.get("params", {}):
+                            updated_params = copy.deepcopy(settings["params"])
+                            updated_params.update(new_params)
+                            item["params"] = updated_params
+                        else:
+                            item["params"].update(new_params)
+
+                        break
+
+        tmp_path = f"{json_file_path}.tmp"
+        with open(tmp_path, "w") as file:
             json.dump(settings, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, json_file_path)
 
     except Exception as e:
         raise RuntimeError(f"update_settings Error: {e}")
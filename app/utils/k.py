@@ -1,89 +1,199 @@
+import math
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+
+# 交易時段邊界(距當日 00:00): 日盤 08:45~13:45, 夜盤 15:00~隔日 05:00(皆含端點)
+DAY_START = pd.Timedelta(hours=8, minutes=45)
+DAY_END = pd.Timedelta(hours=13, minutes=45)
+NIGHT_START = pd.Timedelta(hours=15)
+NIGHT_END = pd.Timedelta(hours=5)
+
+def naive_index(index):
+    """確保無時區(以當地時間判斷時段)且單位為 ns"""
+    index = pd.DatetimeIndex(index)
+    index = index.tz_localize(None) if index.tz is not None else index
+    return index.as_unit('ns')
+
+def classify_sessions(index):
+    """
+    回傳每根 K 棒所屬時段的開始時間(日盤為當日 08:45, 夜盤為開盤當日 15:00, 不在交易時段為 NaT)
+    以整個索引的時間比較計算, 不逐列解析
+    """
+    index = naive_index(index)
+    date = index.normalize()
+    time = index - date
+
+    day = (time >= DAY_START) & (time <= DAY_END)
+    night = time >= NIGHT_START
+    overnight = time <= NIGHT_END  # 夜盤跨日的部分, 屬於前一天開盤的夜盤
+
+    session_start = np.full(len(index), np.datetime64('NaT'), dtype='datetime64[ns]')
+    session_start[day] = (date[day] + DAY_START).to_numpy()
+    session_start[night] = (date[night] + NIGHT_START).to_numpy()
+    session_start[overnight] = (date[overnight] - pd.Timedelta(days=1) + NIGHT_START).to_numpy()
+    return pd.DatetimeIndex(session_start)
 
 def convert_ohlcv(df, freq=60):
-    freq = int(freq) if isinstance(freq, str) else int(freq)
-    
-    # 建立 session_type 與 session_start
-    def classify_session(ts):
-        try:
-            # 確保無時區
-            ts = ts.tz_localize(None) if ts.tzinfo else ts
-            time = ts.time()
-    
-            # 明確定義時間邊界
-            day_start = datetime.strptime("08:45", "%H:%M").time()
-            day_end = datetime.strptime("13:45", "%H:%M").time()
-            night_start = datetime.strptime("15:00", "%H:%M").time()
-            night_end = datetime.strptime("05:00", "%H:%M").time()
-
-            if day_start <= time <= day_end:
-                session_type = "day"
-                session_date = ts.date()
-                session_start = datetime.combine(session_date, day_start)
-            elif time >= night_start:
-                session_type = "night"
-                session_date = ts.date()
-                session_start = datetime.combine(session_date, night_start)
-            elif time <= night_end:
-                session_type = "night"
-                session_date = (ts - timedelta(days=1)).date()
-                session_start = datetime.combine(session_date, night_start)
-            else:
-                session_type = "other"
-                session_start = pd.NaT
-
-            return pd.Series([session_type, session_start], index=["session_type", "session_start"])
-        except Exception as e:
-            print(f"時間轉換出現錯誤 {ts}: {e}")
-            return pd.Series([None, None], index=["session_type", "session_start"])
-
-    # 修改1: 使用 .loc 明確賦值
-    df.loc[:, ["session_type", "session_start"]] = df.index.to_series().apply(classify_session)
-
-    # 修改2: 過濾後強制創建副本
-    df = df[df["session_type"].isin(["day", "night"])].copy()
-    
-    # ✅ 將 index 向前推 1 分鐘
-    df.index = df.index - pd.Timedelta(minutes=1)
-
-    # 設定 K 棒時間長度
-    window = timedelta(minutes=freq)
-    
-    # 分段處理每個 session 的資料
-    result = []
-
-    for session_start, session_data in df.groupby("session_start"):
-        current_time = session_start
-        max_time = session_data.index.max()
-
-        while current_time < max_time:
-            next_time = current_time + window
-            window_data = session_data[(session_data.index >= current_time) & (session_data.index < next_time)]
-
-            if not window_data.empty:
-                o = window_data["open"].iloc[0]
-                h = window_data["high"].max()
-                l = window_data["low"].min()
-                c = window_data["close"].iloc[-1]
-                v = window_data["volume"].sum()
-                complete = window_data.index[-1] >= next_time - timedelta(minutes=1)
-
-                result.append({
-                    "ts": current_time,
-                    "open": o,
-                    "high": h,
-                    "low": l,
-                    "close": c,
-                    "volume": v,
-                    "complete": complete
-                })
-
-            current_time = next_time
-
-    # 建立新的 DataFrame
-    agg_df = pd.DataFrame(result)
-    if 'ts' in agg_df.columns:
-        agg_df.set_index('ts', inplace=True, drop=False)
+    """
+    將 1 分 K 轉換為 freq 分鐘的 K 棒, 每個交易時段從開盤時間起切分:
+    K 棒時間先向前推 1 分鐘(1 分 K 以收盤時間標示), 落在 [開始, 開始 + freq) 的 K 棒合併為一根,
+    時段內最後一根 K 棒時間之後(含)開始的區間不輸出; complete 表示區間最後一根已到區間結尾
+    """
+    freq = int(freq)
+    window = pd.Timedelta(minutes=freq).value
+
+    session_start = classify_sessions(df.index)
+    keep = ~session_start.isna()
+    data = df[['open', 'high', 'low', 'close', 'volume']][keep]
+    if data.empty:
+        return pd.DataFrame()
+
+    start = session_start[keep].asi8
+    shifted = naive_index(data.index).asi8 - pd.Timedelta(minutes=1).value  # ✅ 將 index 向前推 1 分鐘
+
+    # 區間編號: 距時段開始的分鐘數整除 freq; 開始時間早於時段開始, 或晚於(等於)時段最後一根 K 棒的區間不輸出
+    offset = shifted - start
+    bucket = offset // window
+    bucket_start = start + bucket * window
+    last = pd.Series(shifted).groupby(start).transform('max').to_numpy()
+    valid = (offset >= 0) & (bucket_start < last)
+    if not valid.any():
+        return pd.DataFrame()
+
+    data, start, bucket, bucket_start, shifted = data[valid], start[valid], bucket[valid], bucket_start[valid], shifted[valid]
+
+    # 依 (時段, 區間) 穩定排序, 開盤/收盤取區間內第一筆/最後一筆(與原資料順序相同)
+    order = np.lexsort((bucket, start))
+    keys = np.column_stack([start[order], bucket[order]])
+    first = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+    final = np.r_[first[1:], len(order)] - 1
+
+    grouped = data.groupby([start, bucket], sort=True)
+    ts = pd.DatetimeIndex(bucket_start[order][first], name='ts')
+    agg_df = pd.DataFrame({
+        'ts': ts,
+        'open': data['open'].to_numpy()[order][first],
+        'high': grouped['high'].max().to_numpy(),
+        'low': grouped['low'].min().to_numpy(),
+        'close': data['close'].to_numpy()[order][final],
+        'volume': grouped['volume'].sum().to_numpy(),
+        'complete': shifted[order][final] >= bucket_start[order][first] + window - pd.Timedelta(minutes=1).value
+    }, index=ts)
 
     return agg_df
+
+class SessionBars:
+    """
+    單一週期的增量 K 棒轉換(與 convert_ohlcv 相同): 每推入一根 1 分 K 只更新所屬區間的 OHLCV,
+    區間以 (時段開始, 區間編號) 為 key, 依推入順序(時間順序)保存
+    """
+    def __init__(self, freq):
+        self.freq = int(freq)
+        self.window = pd.Timedelta(minutes=self.freq).value
+        self.bars = {}  # {(時段開始, 區間編號): [區間開始, open, high, low, close, volume, 最後一根時間]}
+        self.session_last = {}  # {時段開始: 時段內最後一根 K 棒時間}
+
+    def push(self, session_start, shifted, open_, high, low, close, volume):
+        """session_start, shifted: ns(int); shifted 為向前推 1 分鐘後的 K 棒時間"""
+        self.session_last[session_start] = max(self.session_last.get(session_start, shifted), shifted)
+        offset = shifted - session_start
+        if offset < 0:
+            return
+
+        bucket = offset // self.window
+        bar = self.bars.get((session_start, bucket))
+        if bar is None:
+            self.bars[(session_start, bucket)] = [session_start + bucket * self.window, open_, high, low, close, volume, shifted]
+            return
+
+        bar[2] = high if math.isnan(bar[2]) else bar[2] if math.isnan(high) else max(bar[2], high)  # 與 pandas max/min 相同略過 NaN
+        bar[3] = low if math.isnan(bar[3]) else bar[3] if math.isnan(low) else min(bar[3], low)
+        bar[4] = close
+        bar[5] += volume
+        bar[6] = shifted
+
+    def trim(self, start):
+        """移除開始時間早於 start(ns) 的時段"""
+        for session_start in [s for s in self.session_last if s < start]:
+            del self.session_last[session_start]
+        self.bars = {key: bar for key, bar in self.bars.items() if key[0] >= start}
+
+    def frame(self):
+        rows = [bar for key, bar in self.bars.items() if bar[0] < self.session_last[key[0]]]
+        if not rows:
+            return pd.DataFrame()
+
+        ts, open_, high, low, close, volume, last = map(list, zip(*rows))
+        ts = pd.DatetimeIndex(np.array(ts, dtype='datetime64[ns]'), name='ts')
+        last = np.array(last, dtype=np.int64)
+        return pd.DataFrame({
+            'ts': ts,
+            'open': open_,
+            'high': high,
+            'low': low,
+            'close': close,
+            'volume': volume,
+            'complete': last >= ts.asi8 + self.window - pd.Timedelta(minutes=1).value
+        }, index=ts)
+
+class MultiTimeframeBars:
+    """
+    多週期 K 棒快取: 以 1 分 K 逐根更新多個週期(例如 4 小時、15 分、5 分)的轉換結果,
+    每根新 K 棒只更新各週期的最後一個區間, 不需每分鐘重新讀取並轉換一整天的 1 分 K
+    """
+    def __init__(self, freqs):
+        self.frames = {int(freq): SessionBars(freq) for freq in freqs}
+        self.ts = None  # 最後套用的 1 分 K 時間(ns)
+        self.start = None
+
+    def reset(self):
+        self.frames = {freq: SessionBars(freq) for freq in self.frames}
+        self.ts = None
+        self.start = None
+
+    def _resume(self, ts):
+        """ts(ns, 由舊到新)中最後套用的 K 棒之後的位置, 不包含最後套用的 K 棒(無法接續)時為 None"""
+        if self.ts is None:
+            return None
+        index = int(np.searchsorted(ts, self.ts))
+        return index + 1 if index < len(ts) and ts[index] == self.ts else None
+
+    def covers(self, ts):
+        """ts(由舊到新)是否包含最後套用的 K 棒, 即 sync 可直接接續而不需重建(與 sync 的判斷相同)"""
+        return self._resume(naive_index(ts).asi8) is not None
+
+    def sync(self, ts, open_, high, low, close, volume):
+        """套用尚未處理的 1 分 K(由舊到新, 皆為已完成的 K 棒), 與已套用資料不連續時重建, 回傳套用的筆數"""
+        ts = naive_index(ts).asi8
+        start = 0
+        if self.ts is not None:
+            start = self._resume(ts)
+            if start is None:
+                self.reset()
+                start = 0
+
+        if start == len(ts):
+            return 0
+
+        session_start = classify_sessions(ts[start:]).asi8
+        shifted = ts[start:] - pd.Timedelta(minutes=1).value
+        columns = [np.asarray(column[start:]) for column in (open_, high, low, close, volume)]
+        for i in np.flatnonzero(session_start != pd.NaT.value):
+            values = [column[i].item() for column in columns]
+            for bars in self.frames.values():
+                bars.push(int(session_start[i]), int(shifted[i]), *values)
+
+        self.ts = int(ts[-1])
+        return len(ts) - start
+
+    def trim(self, start):
+        """只保留開始時間不早於 start 的時段, start 為時段開始時間時與以 start 過濾 1 分 K 後轉換相同"""
+        start = pd.Timestamp(start)
+        start = (start.tz_localize(None) if start.tz else start).value
+        if start != self.start:
+            for bars in self.frames.values():
+                bars.trim(start)
+            self.start = start
+
+    def frame(self, freq):
+        return self.frames[int(freq)].frame()
@@ -0,0 +1,63 @@
+import json
+from sortedcontainers import SortedDict
+
+class PriceLevels:
+    """
+    各價位的累計成交量(依價格排序):
+    以 SortedDict 保存 {價格: 成交量}, 既有價位累加 O(1), 新價位 O(log n), 最高/最低價位 O(1)
+    保存到 Redis 時只寫入價格與成交量兩個陣列
+    """
+    def __init__(self, levels=None):
+        self.levels = SortedDict(levels or {})
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __bool__(self):
+        return bool(self.levels)
+
+    @classmethod
+    def load(cls, data):
+        """讀取 Redis 保存的資料, 支援 to_dict 的格式與舊版依價格降序的 [(price, volume), ...]"""
+        if not data:
+            return cls()
+        if isinstance(data, dict):
+            return cls(zip(data['prices'], data['volumes']))
+
+        levels = cls()
+        for price, volume in data:
+            levels.add(price, volume)
+        return levels
+
+    @classmethod
+    def from_json(cls, payload):
+        return cls.load(json.loads(payload)) if payload else cls()
+
+    def add(self, price, volume):
+        self.levels[price] = self.levels.get(price, 0) + volume
+
+    def update(self, trades):
+        """累加多筆成交, trades: [{'close': 價格, 'volume': 成交量}, ...]"""
+        for trade in trades:
+            self.add(trade['close'], trade['volume'])
+        return self
+
+    def highest(self):
+        """最高價位與其成交量, 沒有資料時為 (0, 0)"""
+        return self.levels.peekitem(-1) if self.levels else (0, 0)
+
+    def lowest(self):
+        return self.levels.peekitem(0) if self.levels else (0, 0)
+
+    def volume_at(self, price):
+        return self.levels.get(price, 0)
+
+    def to_list(self):
+        """依價格降序的 [(price, volume), ...](與舊版 pv_list 相同)"""
+        return list(reversed(self.levels.items()))
+
+    def to_dict(self):
+        return {'prices': list(self.levels.keys()), 'volumes': list(self.levels.values())}
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
@@ -0,0 +1,439 @@
+import os, json, math, operator, threading
+from abc import ABC, abstractmethod
+from collections import deque, OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+KERNEL_CACHE_SIZE = int(os.getenv('KERNEL_CACHE_SIZE', 256))
+
+class RollingWindow:
+    """
+    固定長度的滾動平均/標準差(樣本標準差, ddof=1, 與 pandas 相同):
+    以 Welford 方式新增, 視窗滿時以新值替換最舊的值, 每次更新 O(1)
+    每推入 size 筆以視窗內的值重新計算一次, 避免浮點誤差累積
+    """
+    def __init__(self, size, values=None, mean=None, m2=None):
+        self.size = int(size)
+        self.values = deque(values or [], maxlen=self.size)
+        self._pushes = 0
+        if mean is None or m2 is None or len(self.values) != len(values or []):
+            self.recompute()
+        else: # 還原保存的統計量, 不需重新走訪視窗
+            self.mean, self.m2 = mean, m2
+
+    def __len__(self):
+        return len(self.values)
+
+    def push(self, value):
+        value = float(value)
+        n = len(self.values)
+
+        if n < self.size:
+            self.values.append(value)
+            delta = value - self.mean
+            self.mean += delta / (n + 1)
+            self.m2 += delta * (value - self.mean)
+        else:
+            oldest = self.values[0]
+            self.values.append(value)  # deque 自動移除最舊的值
+            mean = self.mean + (value - oldest) / n
+            self.m2 += (value - oldest) * (value - mean + oldest - self.mean)
+            self.mean = mean
+
+        self._pushes += 1
+        if self._pushes >= self.size:
+            self.recompute()
+
+    def recompute(self):
+        n = len(self.values)
+        self.mean = sum(self.values) / n if n else 0.0
+        self.m2 = sum((value - self.mean) ** 2 for value in self.values)
+        self._pushes = 0
+
+    @property
+    def std(self):
+        n = len(self.values)
+        if n < 2:
+            return float('nan')
+        return math.sqrt(max(self.m2, 0.0) / (n - 1))
+
+    @property
+    def last(self):
+        return self.values[-1] if self.values else float('nan')
+
+class SpreadTransform:
+    """
+    將每根 K 棒的 (A, B) 轉為 z-score 使用的序列值, 與 Zscore 各 statarb_type 的序列定義相同:
+      - beta: B - beta * A
+      - shift_log: B 與 A 的報酬比(或對數報酬差)
+      - diff_change: 價差的差分(或變動率)
+      - diff_change_shift: 比率 B / A 的變動率
+    需要前一根資料的類型 lag 為 1(舊版序列長度為 z_window - 1)
+    bias 的 EMA 在每個視窗開頭重新起算(視窗內每個值都隨視窗移動而改變), 無法逐根更新, 由 Zscore 以整段視窗計算
+    """
+    LAG = {'beta': 0, 'shift_log': 1, 'diff_change': 1, 'diff_change_shift': 1}
+
+    def __init__(self, params, prev=None):
+        self.type = params['statarb_type']
+        self.params = params
+        self.prev = prev or {}  # 前一根的 a, b
+
+    @property
+    def lag(self):
+        return self.LAG[self.type]
+
+    def step(self, a, b):
+        """回傳新的序列值, 無法計算(NaN)時回傳 None"""
+        a, b = float(a), float(b)
+        prev, self.prev = self.prev, {'a': a, 'b': b}
+
+        if self.type == 'beta':
+            return b - self.params['beta'] * a
+
+        if 'a' not in prev:
+            return None
+        a0, b0 = prev['a'], prev['b']
+
+        if self.type == 'shift_log':
+            if self.params['use_log']:
+                value = _div_log(b, b0) - _div_log(a, a0)
+            else:
+                value = _div(_div(b, b0), _div(a, a0))
+        elif self.type == 'diff_change':
+            spread, spread0 = b - a, b0 - a0
+            value = _div(spread - spread0, spread0) if self.params['use_pct'] else spread - spread0
+        elif self.type == 'diff_change_shift':
+            ratio, ratio0 = _div(b, a), _div(b0, a0)
+            value = _div(ratio - ratio0, ratio0)
+        else:
+            raise ValueError(f"不支援的 statarb_type: {self.type}")
+
+        return self._finite(value)
+
+    @staticmethod
+    def _finite(value):
+        if math.isnan(value):
+            return None
+        if math.isinf(value):
+            return 0.0  # 與舊版 replace([inf, -inf], 0) 相同
+        return value
+
+def _div(x, y):
+    if y == 0:
+        return float('nan') if x == 0 else math.copysign(float('inf'), x)
+    return x / y
+
+def _div_log(x, y):
+    ratio = _div(x, y)
+    if math.isnan(ratio) or ratio < 0:
+        return float('nan')
+    return math.log(ratio) if ratio > 0 else float('-inf')
+
+class RollingZscore:
+    """
+    statarb 的滾動 z-score 引擎:
+    保留最近視窗的序列值與平均/變異數, 每根新 K 棒 O(1) 更新, 評估時只需計算最新值的 z-score
+    狀態(最後處理的 K 棒時間、視窗與轉換所需的前值)以 JSON 保存於 Redis, 跨輪沿用;
+    狀態不存在、參數變更或 K 棒不連續時, 以本輪載入的整段資料重建
+    """
+    PARAM_KEYS = ('statarb_type', 'z_window', 'beta', 'use_log', 'use_pct')
+
+    def __init__(self, params, state=None):
+        self.params = params
+        self.signature = [params.get(key) for key in self.PARAM_KEYS]
+        state = state if state and state.get('signature') == self.signature else {}
+
+        self.transform = SpreadTransform(params, state.get('prev'))
+        self.window = RollingWindow(params['z_window'] - self.transform.lag, state.get('values'), state.get('mean'), state.get('m2'))
+        self.ts = np.datetime64(state['ts']) if state.get('ts') else None
+
+    def sync(self, ts, a, b):
+        """
+        套用尚未處理的 K 棒, ts 需由舊到新排序(datetime64 陣列), 回傳套用的筆數
+        以二分搜尋找到上次處理的位置, 只迭代新的 K 棒
+        """
+        start = 0
+        if self.ts is not None:
+            index = int(np.searchsorted(ts, self.ts))
+            if index < len(ts) and ts[index] == self.ts:
+                start = index + 1
+            else: # 不連續(狀態過舊或資料被重建), 以整段資料重建
+                self.reset()
+
+        for i in range(start, len(ts)):
+            value = self.transform.step(a[i], b[i])
+            if value is not None:
+                self.window.push(value)
+
+        if len(ts):
+            self.ts = ts[-1]
+        return len(ts) - start
+
+    def reset(self):
+        self.transform = SpreadTransform(self.params)
+        self.window = RollingWindow(self.window.size)
+        self.ts = None
+
+    def zscore(self):
+        """最新值的 z-score, 資料不足時為 NaN(不產生訊號), 標準差為 0 時為 0"""
+        std = self.window.std
+        if math.isnan(std):
+            return float('nan')
+        if std == 0:
+            return 0
+        return (self.window.last - self.window.mean) / std
+
+    def to_json(self):
+        return json.dumps({
+            'signature': self.signature,
+            'ts': str(self.ts) if self.ts is not None else None,
+            'prev': self.transform.prev,
+            'values': list(self.window.values),
+            'mean': self.window.mean,
+            'm2': self.window.m2
+        })
+
+    @classmethod
+    def from_json(cls, params, payload):
+        return cls(params, json.loads(payload) if payload else None)
+
+class RecursiveBeta:
+    """
+    statarb 避險比例的線上估計:
+    以遺忘因子 lam 的遞迴最小平方法(指數加權的 B = alpha + beta * A 迴歸)逐根 K 棒更新, 每根 O(1)
+    保存加權筆數、加權平均與共變異數, 估計值以 prior 根虛擬資料向錨點(setting 的 beta, 例如 Johansen 結果)收縮,
+    錨點更新時不需重置統計量; 遺忘因子變更或 K 棒不連續時, 以本輪載入的資料重建
+    """
+    def __init__(self, lam=0.999, prior=20, state=None):
+        self.lam = float(lam)
+        self.prior = float(prior)
+        state = state if state and state.get('lam') == self.lam else {}
+
+        self.w = state.get('w', 0.0)  # 加權筆數
+        self.mean_a = state.get('mean_a', 0.0)
+        self.mean_b = state.get('mean_b', 0.0)
+        self.c_aa = state.get('c_aa', 0.0)
+        self.c_ab = state.get('c_ab', 0.0)
+        self.ts = np.datetime64(state['ts']) if state.get('ts') else None
+
+    def update(self, a, b):
+        a, b = float(a), float(b)
+        if math.isnan(a) or math.isnan(b):
+            return
+
+        self.w = self.lam * self.w + 1
+        delta_a = a - self.mean_a
+        self.mean_a += delta_a / self.w
+        self.mean_b += (b - self.mean_b) / self.w
+        self.c_aa = self.lam * self.c_aa + delta_a * (a - self.mean_a)
+        self.c_ab = self.lam * self.c_ab + delta_a * (b - self.mean_b)
+
+    def sync(self, ts, a, b):
+        """套用尚未處理的 K 棒(與 RollingZscore.sync 相同的續算方式), 回傳套用的筆數"""
+        start = 0
+        if self.ts is not None:
+            index = int(np.searchsorted(ts, self.ts))
+            if index < len(ts) and ts[index] == self.ts:
+                start = index + 1
+            else:
+                self.reset()
+
+        for i in range(start, len(ts)):
+            self.update(a[i], b[i])
+
+        if len(ts):
+            self.ts = ts[-1]
+        return len(ts) - start
+
+    def reset(self):
+        self.w = self.mean_a = self.mean_b = self.c_aa = self.c_ab = 0.0
+        self.ts = None
+
+    def beta(self, anchor):
+        """目前的避險比例, A 的變異數為 0 時回傳錨點"""
+        if self.c_aa <= 1e-12:
+            return float(anchor)
+        return (self.w * self.c_ab / self.c_aa + self.prior * float(anchor)) / (self.w + self.prior)
+
+    def to_json(self):
+        return json.dumps({
+            'lam': self.lam,
+            'ts': str(self.ts) if self.ts is not None else None,
+            'w': self.w,
+            'mean_a': self.mean_a,
+            'mean_b': self.mean_b,
+            'c_aa': self.c_aa,
+            'c_ab': self.c_ab
+        })
+
+    @classmethod
+    def from_json(cls, params, payload):
+        return cls(params.get('rls_lambda', 0.999), params.get('rls_prior', 20), json.loads(payload) if payload else None)
+
+class RollingExtremum:
+    """
+    單調佇列的滾動最小/最大值(與 pandas rolling(window).min()/max() 相同, 未滿 window 根為 NaN):
+    只保存最近 window - 1 根已確定的 K 棒, peek 時再加入最新一根, 每根攤銷 O(1)
+    """
+    def __init__(self, window, mode='min'):
+        self.window = int(window)
+        self.better = operator.le if mode == 'min' else operator.ge
+        self.queue = deque()  # (序號, 值), 值單調
+        self.count = 0
+
+    def push(self, value):
+        value = float(value)
+        while self.queue and self.better(value, self.queue[-1][1]):
+            self.queue.pop()
+        self.queue.append((self.count, value))
+        self.count += 1
+        while self.queue and self.queue[0][0] <= self.count - self.window:
+            self.queue.popleft()
+
+    def peek(self, value):
+        value = float(value)
+        if self.count + 1 < self.window:
+            return float('nan')
+        if not self.queue or self.better(value, self.queue[0][1]):
+            return value
+        return self.queue[0][1]
+
+class RollingSum:
+    """
+    滾動加總(與 pandas rolling(window, min_periods=1).sum() 相同, NaN 不計入):
+    保存最近 window - 1 根已確定的值, peek 時加入最新一根, 回傳 (加總, 有效筆數); 每推入 window 筆重新加總避免浮點誤差累積
+    """
+    def __init__(self, window):
+        self.values = deque(maxlen=max(int(window) - 1, 0))
+        self.total = 0.0
+        self.count = 0
+        self._pushes = 0
+
+    def push(self, value):
+        if self.values.maxlen == 0:
+            return
+
+        if len(self.values) == self.values.maxlen and not math.isnan(self.values[0]):
+            self.total -= self.values[0]
+            self.count -= 1
+        value = float(value)
+        self.values.append(value)
+        if not math.isnan(value):
+            self.total += value
+            self.count += 1
+
+        self._pushes += 1
+        if self._pushes >= self.values.maxlen:
+            valid = [v for v in self.values if not math.isnan(v)]
+            self.total, self.count, self._pushes = math.fsum(valid), len(valid), 0
+
+    def peek(self, value):
+        value = float(value)
+        if math.isnan(value):
+            return self.total, self.count
+        return self.total + value, self.count + 1
+
+class StreamingKernel(ABC):
+    """
+    逐根更新的指標狀態: 已確定的 K 棒(最後一根以外)以 push 保存, 最後一根(可能尚未完成, 例如轉換週期後的最新一根)
+    只以 peek 試算不保存; 以最後確定的 K 棒時間續算, 不連續時重建
+    """
+    @abstractmethod
+    def reset(self):
+        """清除狀態(含最後確定的 K 棒時間 ts)"""
+        pass
+
+    @abstractmethod
+    def push(self, *bar):
+        """保存一根已確定的 K 棒"""
+        pass
+
+    @abstractmethod
+    def peek(self, *bar):
+        """以最後一根 K 棒試算指標值, 不保存"""
+        pass
+
+    def sync(self, ts, *columns):
+        """ts 由舊到新, columns 為對應的數值陣列, 回傳最後一根 K 棒的指標值"""
+        start = 0
+        if self.ts is not None:
+            index = int(np.searchsorted(ts, self.ts))
+            if index < len(ts) - 1 and ts[index] == self.ts:
+                start = index + 1
+            else:
+                self.reset()
+
+        for i in range(start, len(ts) - 1):
+            self.push(*(column[i] for column in columns))
+        if len(ts) > 1 and start <= len(ts) - 2:
+            self.ts = ts[-2]
+        return self.peek(*(column[-1] for column in columns))
+
+class RsvKernel(StreamingKernel):
+    """RSV = (收盤 - 最近 window 根最低) / (最高 - 最低) * 100, 無法計算時為 0(與 Rsv 的 pandas 計算相同)"""
+    def __init__(self, window):
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        self.lowest = RollingExtremum(self.window, 'min')
+        self.highest = RollingExtremum(self.window, 'max')
+        self.ts = None
+
+    def push(self, high, low, close):
+        self.lowest.push(low)
+        self.highest.push(high)
+
+    def peek(self, high, low, close):
+        lowest, highest = self.lowest.peek(low), self.highest.peek(high)
+        rsv = _div(float(close) - lowest, highest - lowest) * 100
+        return 0.0 if math.isnan(rsv) else rsv
+
+class VwapKernel(StreamingKernel):
+    """
+    滾動 VWAP 與標準差(與 Vwap.calculate_vwap 的 pandas 計算相同):
+    典型價格 × 成交量與成交量的滾動加總, 標準差為各根典型價格相對當根 VWAP 的平方差的滾動平均開根號
+    """
+    def __init__(self, window):
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        self.price_volume = RollingSum(self.window)
+        self.volume = RollingSum(self.window)
+        self.squared = RollingSum(self.window)
+        self.ts = None
+
+    def evaluate(self, high, low, close, volume):
+        typical_price = (float(high) + float(low) + float(close)) / 3
+        price_volume = typical_price * float(volume)
+        vwap = _div(self.price_volume.peek(price_volume)[0], self.volume.peek(volume)[0])
+        squared = (typical_price - vwap) ** 2
+        total, count = self.squared.peek(squared)
+        std = math.sqrt(total / count) if count else float('nan')
+        return price_volume, squared, vwap, std
+
+    def push(self, high, low, close, volume):
+        price_volume, squared, _, _ = self.evaluate(high, low, close, volume)
+        self.price_volume.push(price_volume)
+        self.volume.push(volume)
+        self.squared.push(squared)
+
+    def peek(self, high, low, close, volume):
+        """回傳 (vwap, 標準差)"""
+        return self.evaluate(high, low, close, volume)[2:]
+
+_kernels = OrderedDict()
+_kernels_lock = threading.Lock()
+
+def get_kernel(key, factory):
+    """取得(或建立)每個進程以 key 快取的指標狀態, 以 LRU 保留 KERNEL_CACHE_SIZE 個"""
+    with _kernels_lock:
+        kernel = _kernels.get(key)
+        if kernel is None:
+            kernel = _kernels[key] = factory()
+        _kernels.move_to_end(key)
+        while len(_kernels) > KERNEL_CACHE_SIZE:
+            _kernels.popitem(last=False)
+        return kernel
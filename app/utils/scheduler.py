@@ -31,6 +31,11 @@ class TaskScheduler:
                 "trigger": CronTrigger(hour=6, minute=0),
                 "kwargs": {"lock": self.process_lock, "redo": True}
             },
+            {
+                "name": "screen_pairs",
+                "trigger": CronTrigger(hour=6, minute=5),
+                "kwargs": {"lock": self.process_lock} # 同一交易日只計算一次, 結果快取於 data/screener
+            },
             {
                 "name": "calculate_smc",
                 "trigger": CronTrigger(hour=6, minute=10),
@@ -0,0 +1,145 @@
+import os, json
+import concurrent.futures, multiprocessing
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.adfvalues import mackinnonp
+
+"""
+配對篩選:
+將 N 個商品對齊後的收盤價矩陣(列: K 棒, 欄: 商品)一次計算 N×(N−1)/2 組配對的
+Engle–Granger 協整 p 值、避險比例、半衰期與 Hurst 指數
+  - 避險比例: 以共變異數閉式解批次做 OLS (B = alpha + beta * A), 不需逐對呼叫 statsmodels
+  - 協整檢定: 殘差做固定 lag 的 ADF(無常數), 以批次正規方程(np.linalg.pinv)求解, p 值使用 MacKinnon 近似(與 statsmodels coint 相同)
+  - 半衰期: 殘差 lag 1 自相關 rho, ln(2) / -ln(rho) (單位: K 棒)
+  - Hurst: 殘差各 lag 差分標準差對 lag 的 log-log 斜率, < 0.5 為均值回歸
+配對以區塊分給進程池計算, 每個配對取 p 值較低的迴歸方向, 輸出的 code 順序為 [A, B](與策略 B - beta * A 相同)
+"""
+
+SCREENER_DIR = 'data/screener'
+PARALLEL_MIN_CHUNKS = 4
+
+def engle_granger(prices, y_idx, x_idx, adf_lag=1, hurst_lags=20):
+    """批次計算 y = alpha + beta * x 的協整統計量, prices: (T, N) 陣列, 回傳各欄為 (M,) 陣列的 dict"""
+    Y, X = prices[:, y_idx], prices[:, x_idx]
+    dx, dy = X - X.mean(axis=0), Y - Y.mean(axis=0)
+    var_x, var_y, cov = (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = cov / var_x
+        corr = cov / np.sqrt(var_x * var_y)
+        resid = dy - beta * dx  # (T, M), 截距已由去平均吸收
+
+        # ADF: d[t] = g * e[t] + sum(c_k * d[t - k]), t = adf_lag..T-2
+        d = np.diff(resid, axis=0)
+        target = d[adf_lag:]
+        regressors = [resid[adf_lag:-1]] + [d[adf_lag - k:len(d) - k] for k in range(1, adf_lag + 1)]
+        design = np.stack(regressors, axis=-1)  # (n, M, p)
+        nobs, params = target.shape[0], design.shape[-1]
+
+        xtx = np.einsum('nmp,nmq->mpq', design, design)
+        xty = np.einsum('nmp,nm->mp', design, target)
+        xtx_inv = np.linalg.pinv(xtx)
+        coef = np.einsum('mpq,mq->mp', xtx_inv, xty)
+        error = target - np.einsum('nmp,mp->nm', design, coef)
+        sigma2 = (error ** 2).sum(axis=0) / (nobs - params)
+        adf_stat = coef[:, 0] / np.sqrt(sigma2 * xtx_inv[:, 0, 0])
+
+        # 半衰期(lag 1 自相關)
+        e0, e1 = resid[:-1] - resid[:-1].mean(axis=0), resid[1:] - resid[1:].mean(axis=0)
+        rho = (e0 * e1).sum(axis=0) / np.sqrt((e0 * e0).sum(axis=0) * (e1 * e1).sum(axis=0))
+        half_life = np.where((rho > 0) & (rho < 1), np.log(2) / -np.log(rho), np.nan)
+
+        # Hurst(各 lag 差分標準差的 log-log 斜率)
+        lags = np.arange(2, max(3, min(hurst_lags, len(resid) // 2)))
+        tau = np.log(np.stack([np.std(resid[lag:] - resid[:-lag], axis=0) for lag in lags]))  # (L, M)
+        log_lags = np.log(lags) - np.log(lags).mean()
+        hurst = (log_lags[:, None] * (tau - tau.mean(axis=0))).sum(axis=0) / (log_lags ** 2).sum()
+
+    p_value = np.array([mackinnonp(stat, regression='c', N=2) if np.isfinite(stat) else np.nan for stat in adf_stat])
+    return {
+        'beta': beta, 'corr': corr, 'adf_stat': adf_stat, 'p_value': p_value,
+        'half_life': half_life, 'hurst': hurst, 'nobs': np.full(len(beta), nobs)
+    }
+
+def screen_chunk(prices, y_idx, x_idx, adf_lag, hurst_lags):
+    """進程池執行的入口(模組層級函式才能被 pickle)"""
+    return engle_granger(prices, y_idx, x_idx, adf_lag, hurst_lags)
+
+def screen_pairs(prices, adf_lag=1, hurst_lags=20, workers=1, chunk_size=1024):
+    """
+    篩選所有配對, prices: 以時間對齊的收盤價 DataFrame(欄為商品代號)
+    回傳 DataFrame(每個配對一列: A, B, beta, p_value, adf_stat, half_life, hurst, corr, nobs)
+    進程啟動成本約數秒, 區塊數達 PARALLEL_MIN_CHUNKS 才使用進程池
+    """
+    codes = list(prices.columns)
+    values = prices.to_numpy(dtype=float)
+    i, j = np.triu_indices(len(codes), k=1)
+
+    # 兩個迴歸方向都計算, 前半為 i 對 j 迴歸, 後半為 j 對 i
+    y_idx, x_idx = np.concatenate([i, j]), np.concatenate([j, i])
+    chunks = [(y_idx[s:s + chunk_size], x_idx[s:s + chunk_size]) for s in range(0, len(y_idx), chunk_size)]
+
+    if workers > 1 and len(chunks) >= PARALLEL_MIN_CHUNKS:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            parts = list(pool.map(screen_chunk, *zip(*[(values, y, x, adf_lag, hurst_lags) for y, x in chunks])))
+    else:
+        parts = [screen_chunk(values, y, x, adf_lag, hurst_lags) for y, x in chunks]
+
+    if not parts:
+        return pd.DataFrame(columns=['A', 'B', 'beta', 'p_value', 'adf_stat', 'half_life', 'hurst', 'corr', 'nobs'])
+
+    stats = pd.DataFrame({key: np.concatenate([part[key] for part in parts]) for key in parts[0]})
+    stats['A'] = [codes[k] for k in x_idx]
+    stats['B'] = [codes[k] for k in y_idx]
+
+    # 每個配對保留 p 值較低的方向
+    forward, backward = stats.iloc[:len(i)].reset_index(drop=True), stats.iloc[len(i):].reset_index(drop=True)
+    swap = (backward['p_value'] < forward['p_value']) | (forward['p_value'].isna() & backward['p_value'].notna())
+    result = forward.copy()
+    result.loc[swap] = backward.loc[swap]
+    return result[['A', 'B', 'beta', 'p_value', 'adf_stat', 'half_life', 'hurst', 'corr', 'nobs']]
+
+def rank_candidates(result, significance=0.05, min_half_life=2, max_half_life=120, max_hurst=0.5, top=20):
+    """依協整 p 值、半衰期與 Hurst 過濾並排序, 回傳候選配對列表(含建議的 beta 與 z_window)"""
+    candidates = result[
+        (result['p_value'] < significance)
+        & result['half_life'].between(min_half_life, max_half_life)
+        & (result['hurst'] < max_hurst)
+    ].sort_values(['p_value', 'half_life']).head(top)
+
+    return [
+        {
+            'code': [row.A, row.B],
+            'beta': float(row.beta),
+            'p_value': float(row.p_value),
+            'adf_stat': float(row.adf_stat),
+            'half_life': float(row.half_life),
+            'hurst': float(row.hurst),
+            'corr': float(row.corr),
+            'nobs': int(row.nobs),
+            'z_window': int(min(max(round(row.half_life * 2), 10), 200))  # 建議滾動視窗: 約兩倍半衰期
+        }
+        for row in candidates.itertuples()
+    ]
+
+def cache_path(date):
+    return os.path.join(SCREENER_DIR, f"{date}.json")
+
+def save_candidates(date, payload):
+    """寫入當日快取與最新候選清單(candidates.json), 先寫暫存檔再取代"""
+    os.makedirs(SCREENER_DIR, exist_ok=True)
+    for path in (cache_path(date), os.path.join(SCREENER_DIR, 'candidates.json')):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(payload, file, indent=4)
+        os.replace(tmp_path, path)
+
+def load_candidates(category=None):
+    """讀取最新的候選配對清單, 不存在時回傳空結果"""
+    path = os.path.join(SCREENER_DIR, 'candidates.json')
+    if not os.path.exists(path):
+        return [] if category else {}
+
+    with open(path, 'r') as file:
+        candidates = json.load(file).get('candidates', {})
+    return candidates.get(category, []) if category else candidates
@@ -0,0 +1,200 @@
+import os, threading
+import concurrent.futures
+from collections import deque, OrderedDict
+from itertools import islice
+from distutils.util import strtobool
+import numpy as np
+from scipy import stats
+from statsmodels.tsa.stattools import adfuller
+from utils.log import get_module_logger
+from dotenv import load_dotenv
+load_dotenv()
+
+STATIONARY_CACHE_SIZE = int(os.getenv('STATIONARY_CACHE_SIZE', 256))
+STATIONARY_ADF_ASYNC = bool(strtobool(os.getenv('STATIONARY_ADF_ASYNC', 'false')))
+
+class RunningAcf:
+    """
+    固定視窗的自相關(與 statsmodels acf(fft=False) 相同)與偏自相關(Yule-Walker adjusted, 與 pacf 預設相同):
+    保存視窗內的和、平方和與各 lag 的交叉乘積和, 每推入一根 K 棒 O(nlags) 更新,
+    PACF 由自共變異數以 Levinson-Durbin 遞迴求得; 每推入 window 筆重新計算一次避免浮點誤差累積
+    """
+    def __init__(self, window, nlags):
+        self.window = int(window)
+        self.nlags = int(nlags)
+        self.values = deque(maxlen=self.window)
+        self.ts = None
+        self.recompute()
+
+    def recompute(self):
+        values = np.array(self.values, dtype=float)
+        self.s1 = float(values.sum())
+        self.s2 = float((values * values).sum())
+        self.cross = [0.0] + [float((values[:-k] * values[k:]).sum()) if k < len(values) else 0.0 for k in range(1, self.nlags + 1)]
+        self._pushes = 0
+
+    def push(self, value):
+        value = float(value)
+        values = self.values
+
+        if len(values) == self.window: # 移除最舊的值與其形成的交叉乘積
+            oldest = values[0]
+            for k in range(1, min(self.nlags, len(values) - 1) + 1):
+                self.cross[k] -= oldest * values[k]
+            values.popleft()
+            self.s1 -= oldest
+            self.s2 -= oldest * oldest
+
+        for k in range(1, min(self.nlags, len(values)) + 1):
+            self.cross[k] += value * values[-k]
+        values.append(value)
+        self.s1 += value
+        self.s2 += value * value
+
+        self._pushes += 1
+        if self._pushes >= self.window:
+            self.recompute()
+
+    def sync(self, ts, values):
+        """套用尚未處理的 K 棒(ts 由舊到新), 不連續時以傳入資料重建, 回傳套用的筆數"""
+        start = 0
+        if self.ts is not None:
+            index = int(np.searchsorted(ts, self.ts))
+            if index < len(ts) and ts[index] == self.ts:
+                start = index + 1
+            else:
+                self.values.clear()
+                self.recompute()
+
+        for value in values[max(start, len(values) - self.window):]:
+            self.push(value)
+
+        if len(ts):
+            self.ts = ts[-1]
+        return len(ts) - start
+
+    def acov(self):
+        """各 lag 的自共變異數(除以 n), 長度 nlags + 1"""
+        n = len(self.values)
+        mean = self.s1 / n
+        result = np.zeros(self.nlags + 1)
+        result[0] = (self.s2 - n * mean * mean) / n
+
+        for k in range(1, min(self.nlags, n - 1) + 1):
+            head = sum(islice(self.values, 0, k))  # 前 k 筆
+            tail = sum(islice(reversed(self.values), 0, k))  # 後 k 筆
+            result[k] = (self.cross[k] - mean * (2 * self.s1 - head - tail) + (n - k) * mean * mean) / n
+        return result
+
+    def acf(self):
+        acov = self.acov()
+        return acov / acov[0]
+
+    def pacf(self):
+        n = len(self.values)
+        acov = self.acov()
+        lags = np.arange(self.nlags + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            adjusted = acov * n / (n - lags)  # 與 yule_walker(method='adjusted') 相同的分母
+
+        result = np.ones(self.nlags + 1)
+        phi = np.zeros(0)
+        error = adjusted[0]
+        for k in range(1, self.nlags + 1): # Levinson-Durbin
+            reflection = (adjusted[k] - phi @ adjusted[1:k][::-1]) / error
+            phi = np.append(phi - reflection * phi[::-1], reflection)
+            error *= 1 - reflection * reflection
+            result[k] = reflection
+        return result
+
+class StationarityService:
+    """
+    平穩性檢定的快取服務(每個進程一個):
+    - 判斷結果以 (序列, K 棒週期, 最新 K 棒時間, 視窗, lag, 信賴水準) 為 key 做 LRU 快取, 同一根 K 棒不重複計算
+    - ACF/PACF 以 RunningAcf 逐根更新
+    - ADF(autolag) 可於新 K 棒時交給背景線程計算(STATIONARY_ADF_ASYNC), 策略讀取該序列最近一次完成的結果
+    """
+    def __init__(self, maxsize=STATIONARY_CACHE_SIZE, adf_async=STATIONARY_ADF_ASYNC):
+        self.log = get_module_logger('utils/stationarity')
+        self.maxsize = maxsize
+        self.verdicts = OrderedDict()
+        self.acfs = OrderedDict()
+        self.adf_results = OrderedDict()  # {(序列, 視窗): (K 棒時間, p 值)}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if adf_async else None
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def verdict(self, series, interval, ts, values, window, nlags, stricter_confidence=0.95, adf_significance=0.05):
+        """回傳 (是否平穩, 明細), 明細包含 acf/pacf 是否落在信賴區間內與 ADF p 值"""
+        latest = str(ts[-1])
+        key = (series, interval, latest, window, nlags, stricter_confidence, adf_significance)
+        with self.lock:
+            if key in self.verdicts:
+                self.verdicts.move_to_end(key)
+                return self.verdicts[key]
+
+            running = self.acfs.get((series, interval, window, nlags)) or RunningAcf(window, nlags)
+            running.sync(ts, values)
+            self._remember(self.acfs, (series, interval, window, nlags), running)
+            acf_values, pacf_values = running.acf(), running.pacf()
+
+        # 計算信賴區間 z-score (例如 99% 設為 2.58，97% 設為 1.88，等)
+        z_score = stats.norm.ppf(1 - (1 - stricter_confidence) / 2)
+        stricter_conf_interval = z_score / np.sqrt(min(len(values), window))
+        acf_in_blue_zone = bool(np.all(np.abs(acf_values[1:]) < stricter_conf_interval))
+        pacf_in_blue_zone = bool(np.all(np.abs(pacf_values[1:]) < stricter_conf_interval))
+
+        adf_p_value, complete = self.adf_p_value((series, interval, window), latest, values[-window:])
+        detail = {
+            'ts': latest, 'acf_in_blue_zone': acf_in_blue_zone, 'pacf_in_blue_zone': pacf_in_blue_zone,
+            'adf_p_value': adf_p_value
+        }
+        result = (acf_in_blue_zone and pacf_in_blue_zone and adf_p_value is not None and adf_p_value < adf_significance, detail)
+
+        if complete: # 背景 ADF 尚未算到本根 K 棒時不快取, 下次再讀取最新結果
+            with self.lock:
+                self._remember(self.verdicts, key, result)
+        return result
+
+    def adf_p_value(self, adf_key, latest, values):
+        """回傳 (p 值, 是否為本根 K 棒的結果), 背景模式下尚未有任何結果時 p 值為 None"""
+        if self.executor is None:
+            p_value = float(adfuller(values)[1])
+            with self.lock:
+                self._remember(self.adf_results, adf_key, (latest, p_value))
+            return p_value, True
+
+        with self.lock:
+            done = self.adf_results.get(adf_key)
+            if done and done[0] == latest:
+                return done[1], True
+
+            if (adf_key, latest) not in self.pending:
+                self.pending.add((adf_key, latest))
+                self.executor.submit(self._run_adf, adf_key, latest, np.array(values, dtype=float))
+        return (done[1] if done else None), False
+
+    def _run_adf(self, adf_key, latest, values):
+        try:
+            p_value = float(adfuller(values)[1])
+            with self.lock:
+                self._remember(self.adf_results, adf_key, (latest, p_value))
+        except Exception as e:
+            self.log.error(f"背景 ADF 計算失敗: {adf_key}, {latest}, {e}")
+        finally:
+            with self.lock:
+                self.pending.discard((adf_key, latest))
+
+_service = None
+
+def get_stationarity_service():
+    global _service
+    if _service is None:
+        _service = StationarityService()
+    return _service
@@ -1,19 +1,25 @@
 from utils.task.Task import Task
-from utils.technical_indicator.rsi import calculate_rsi
+from utils.technical_indicator.streaming import Rsi
 from utils.log import get_module_logger
 from utils.k import convert_ohlcv
 import pandas as pd
-import os, pytz
-from utils.file import open_json_file, update_settings
+import os, pytz, asyncio, multiprocessing
+import concurrent.futures
+from utils.file import open_json_file, update_settings_many
 from statsmodels.tsa.vector_ar.vecm import coint_johansen
 import shioaji as sj
 from datetime import timedelta, datetime
 from dotenv import load_dotenv
 load_dotenv()
 
+COEFF_WORKERS = int(os.getenv('COEFF_WORKERS', min(4, os.cpu_count() or 1)))
+
 class CalculateCoeffTask(Task):
     def __init__(self):
         self.log = get_module_logger('utils/task/CalculateCoeffTask')
+        self.indicator = { # 與策略端共用的逐根指標, 以 batch 計算整段歷史
+            'rsi': Rsi
+        }
     
     @property
     def name(self) -> str:
@@ -41,9 +47,6 @@ class CalculateCoeffTask(Task):
 
     def _init_params(self, **kwargs):
         self.strategy = {}
-        self.indicator = {
-            'rsi': calculate_rsi
-        }
         self.lock = kwargs.get('lock')
         return
     
@@ -79,120 +82,17 @@ class CalculateCoeffTask(Task):
 
     async def calculate_coeff(self, lock):
         try:
-            api = sj.Shioaji()
-            api.login(
-                api_key=os.getenv('DATA_KEY'),
-                secret_key=os.getenv('DATA_SECRET'),
-                fetch_contract=False,
-            )
-            api.fetch_contracts(contract_download=True)
-
-            try:
-                usage = api.usage()
-                self.log.info(f"剩餘可用API: {usage}\n")
-            except TimeoutError as e:
-                self.log.warning(f"無法獲得 API 使用量: {e}\n")
-
-            with lock:
-                setting = open_json_file()
-
-            for category, items in self.strategy.items():
-                for item in items:
-                    dt_dict = {}
-                    data_dict = {}
-                    statarb_type = item.get('params', {}).get('statarb_type', "beta")
-                    
-                    # 協整beta策略
-                    if statarb_type == 'beta':
-                        strategy = item["strategy"]
-                        base_path = f"data/coeff/{strategy}" # 定義歷史數據路徑
-                        window_trading_days = item["params"]["window_trading_days"]
-
-                        # 計算 end 和 begin 日期
-                        end = datetime.now(tz=pytz.timezone('Asia/Taipei')).strftime('%Y-%m-%d')  # 當前日期，例如 '2025-04-15'
-                        begin = (datetime.now(tz=pytz.timezone('Asia/Taipei')) - timedelta(days=14)).strftime('%Y-%m-%d')  # 當前日期減 14 天
-
-                        # 獲取歷史 K 棒資料
-                        for code in item['code']:
-                            if code in data_dict:
-                                self.log.info(f"跳過: {code} ({category}), 已經獲取過")
-                                continue
-                            
-                            # 根據 category 選擇合約類型
-                            if category == 'stock':
-                                contract = api.Contracts.Stocks[code]
-                            elif category == 'future':
-                                contract = api.Contracts.Futures[code]
-                            else:
-                                self.log.error(f"未知的分類 key：{category}")
-                                continue
-                            
-                            self.log.info(f"獲取k棒資料中:{code}, 開始日期: {begin}, 結束日期: {end}, 合約: {contract}")
-                            
-                            # 調用 API 獲取歷史 K 棒資料
-                            kbars = api.kbars(
-                                contract=contract,
-                                start=begin,  # 例如 '2025-04-14'
-                                end=end,      # 例如 '2025-04-14'
-                            )
-
-                            # 轉為 DataFrame
-                            df = pd.DataFrame({**kbars})
-                            
-                            self.log.info(f"k棒獲取完畢: {df.tail(5)}")
-
-                            # 確保 ts 欄位為 datetime，並設置為索引
-                            df['ts'] = pd.to_datetime(df['ts'])
-                            # 將 OHLCV 欄位名稱改為小寫
-                            df = df.rename(columns={'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'})
-                            if 'ts' in df.columns:
-                                df.set_index('ts', inplace=True, drop=False)
-
-                            data_dict[code] = df
-                            self.log.info(f"資料獲取完畢")
-
-                        # 檢查 data_dict 是否為空
-                        if not data_dict:
-                            self.log.error(f"未獲取到任何 {category} 的 K 棒資料，data_dict 為空")
-                            continue  # 跳過後續處理，例如窗口篩選
-                        
-                        # 如果數據足夠，開始正常處理
-                        for code in item['code']:
-                            # 篩選窗口
-                            window_df, _ = self.filter_and_check_window(data_dict[code], window_trading_days, code, f"{base_path}/{code}")  # 此處已確保數據足夠
-                            
-                            if window_df is None:
-                                self.log.error(f"篩選窗口失敗: {code}")
-                                continue
-
-                            # 判斷params中計算是否是使用技術指標, params中的多個技術指標「順序」對應 code「順序」, Ex: 商品A, B的coint計算 params.indicator: {rsi, macd} => {A: rsi(時間序列), B: macd(時間序列)}
-                            if item['params'].get('indicator'):
-                                indicator_dict = item['params']['indicator']
-                                for indicator_type, indicator_param in indicator_dict.items():
-                                    k_time = convert_ohlcv(window_df, item['params']['K_time'])
-                                    indicator_func = self.indicator.get(indicator_type)
-                                    if indicator_func:
-                                        dt_dict[code] = indicator_func(k_time['close'], indicator_param)
-                                    else:
-                                        raise ValueError(f"技術指標 '{indicator_type}' 在 self.indicator 中未找到")
-                                
-                            else: # 沒有使用技術指標, 默認使用收盤價
-                                dt_dict[code] = convert_ohlcv(window_df, item['params']['K_time'])['close']
-
-                        # 依照ABC生成時間序列
-                        column_names = [chr(65 + i) for i in range(len(dt_dict))]
-                        combined_df = pd.DataFrame(dict(zip(column_names, dt_dict.values()))).dropna()
-
-                        num_codes = len(combined_df.columns)
-                        if num_codes == 2: # 只有兩個標的協整beta計算
-                            beta, _ = self.analyze_two_cointegration(combined_df)
-
-                        with self.lock:
-                            update_settings(category, item['code'], item['strategy'], {'beta': beta})
+            jobs = self.collect_jobs()
+            if not jobs:
+                self.log.info("當前無 beta 策略需要計算")
+                return
 
-            # 登出 API
-            api.logout()
-            self.log.info("Shioaji API logged out")
+            # API 取得 K 棒在背景線程, Johansen 計算分散到進程池, 皆不阻塞交易迴圈所在的事件迴圈
+            data = await asyncio.to_thread(self.fetch_kbars, [(category, code) for category, item in jobs for code in item['code']])
+            updates = await self.compute_all(jobs, data)
+
+            if updates:
+                await asyncio.to_thread(self.save_updates, lock, updates)
             return
 
         except Exception as e:
@@ -200,6 +100,156 @@ class CalculateCoeffTask(Task):
             self.log.error(err)
             raise RuntimeError(err)
 
+    def collect_jobs(self):
+        """需要計算協整 beta 的 (category, item) 列表"""
+        jobs = []
+        for category, items in self.strategy.items():
+            for item in items:
+                if item.get('params', {}).get('statarb_type', "beta") != 'beta':
+                    continue
+
+                # 線上避險比例(beta_mode: rls)盤中逐根更新, 每日 Johansen 只在 reanchor 開啟時重新計算錨點
+                if item['params'].get('beta_mode') == 'rls' and not item['params'].get('reanchor', False):
+                    self.log.info(f"跳過: {item['strategy']} {item['code']} 使用線上避險比例且未開啟 reanchor")
+                    continue
+
+                jobs.append((category, item))
+        return jobs
+
+    def fetch_kbars(self, codes):
+        """登入 API 並取得 [(category, code), ...] 的歷史 K 棒, 重複的商品只取得一次, 回傳 {(category, code): DataFrame}"""
+        api = sj.Shioaji()
+        api.login(
+            api_key=os.getenv('DATA_KEY'),
+            secret_key=os.getenv('DATA_SECRET'),
+            fetch_contract=False,
+        )
+        api.fetch_contracts(contract_download=True)
+
+        try:
+            usage = api.usage()
+            self.log.info(f"剩餘可用API: {usage}\n")
+        except TimeoutError as e:
+            self.log.warning(f"無法獲得 API 使用量: {e}\n")
+
+        # 計算 end 和 begin 日期
+        end = datetime.now(tz=pytz.timezone('Asia/Taipei')).strftime('%Y-%m-%d')  # 當前日期，例如 '2025-04-15'
+        begin = (datetime.now(tz=pytz.timezone('Asia/Taipei')) - timedelta(days=14)).strftime('%Y-%m-%d')  # 當前日期減 14 天
+
+        data = {}
+        try:
+            for category, code in dict.fromkeys(codes):
+                # 根據 category 選擇合約類型
+                if category == 'stock':
+                    contract = api.Contracts.Stocks[code]
+                elif category == 'future':
+                    contract = api.Contracts.Futures[code]
+                else:
+                    self.log.error(f"未知的分類 key：{category}")
+                    continue
+
+                self.log.info(f"獲取k棒資料中:{code}, 開始日期: {begin}, 結束日期: {end}, 合約: {contract}")
+
+                # 調用 API 獲取歷史 K 棒資料
+                kbars = api.kbars(
+                    contract=contract,
+                    start=begin,  # 例如 '2025-04-14'
+                    end=end,      # 例如 '2025-04-14'
+                )
+
+                # 轉為 DataFrame
+                df = pd.DataFrame({**kbars})
+
+                self.log.info(f"k棒獲取完畢: {df.tail(5)}")
+
+                # 確保 ts 欄位為 datetime，並設置為索引
+                df['ts'] = pd.to_datetime(df['ts'])
+                # 將 OHLCV 欄位名稱改為小寫
+                df = df.rename(columns={'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'})
+                if 'ts' in df.columns:
+                    df.set_index('ts', inplace=True, drop=False)
+
+                data[(category, code)] = df
+        finally:
+            # 登出 API
+            api.logout()
+            self.log.info("Shioaji API logged out")
+
+        self.log.info(f"資料獲取完畢, 共 {len(data)} 個商品")
+        return data
+
+    async def compute_all(self, jobs, data):
+        """以進程池平行計算所有配對的 beta, 回傳 update_settings_many 使用的更新列表"""
+        loop = asyncio.get_running_loop()
+        workers = max(1, min(COEFF_WORKERS, len(jobs)))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                loop.run_in_executor(
+                    pool, compute_pair_beta, item,
+                    {code: data[(category, code)] for code in item['code'] if (category, code) in data}
+                )
+                for category, item in jobs
+            ]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+
+        updates = []
+        for (category, item), beta in zip(jobs, results):
+            if isinstance(beta, Exception):
+                self.log.error(f"{item['strategy']} {item['code']} 計算 beta 失敗: {beta}")
+            elif beta is not None:
+                updates.append((category, item['code'], item['strategy'], {'beta': beta}))
+
+        self.log.info(f"beta 計算完成: {len(updates)}/{len(jobs)} 組, 進程數: {workers}")
+        return updates
+
+    def save_updates(self, lock, updates):
+        with lock:
+            update_settings_many(updates)
+
+    def pair_beta(self, item, data_dict):
+        """篩選窗口、轉換週期與技術指標後以 Johansen 計算單一配對的 beta, 資料不足時回傳 None"""
+        base_path = f"data/coeff/{item['strategy']}" # 定義歷史數據路徑
+        window_trading_days = item["params"]["window_trading_days"]
+        dt_dict = {}
+
+        # 檢查 data_dict 是否為空
+        if len(data_dict) != len(item['code']):
+            self.log.error(f"未獲取到 {item['code']} 全部的 K 棒資料, 已取得: {list(data_dict)}")
+            return None
+
+        for code in item['code']:
+            # 篩選窗口
+            window_df, _ = self.filter_and_check_window(data_dict[code], window_trading_days, code, f"{base_path}/{code}")
+
+            if window_df is None:
+                self.log.error(f"篩選窗口失敗: {code}")
+                return None
+
+            # 判斷params中計算是否是使用技術指標, params中的多個技術指標「順序」對應 code「順序」, Ex: 商品A, B的coint計算 params.indicator: {rsi, macd} => {A: rsi(時間序列), B: macd(時間序列)}
+            if item['params'].get('indicator'):
+                indicator_dict = item['params']['indicator']
+                for indicator_type, indicator_param in indicator_dict.items():
+                    k_time = convert_ohlcv(window_df, item['params']['K_time'])
+                    indicator_class = self.indicator.get(indicator_type)
+                    if indicator_class:
+                        dt_dict[code] = indicator_class(indicator_param).batch(k_time['close']).dropna()
+                    else:
+                        raise ValueError(f"技術指標 '{indicator_type}' 在 self.indicator 中未找到")
+
+            else: # 沒有使用技術指標, 默認使用收盤價
+                dt_dict[code] = convert_ohlcv(window_df, item['params']['K_time'])['close']
+
+        # 依照ABC生成時間序列
+        column_names = [chr(65 + i) for i in range(len(dt_dict))]
+        combined_df = pd.DataFrame(dict(zip(column_names, dt_dict.values()))).dropna()
+
+        if len(combined_df.columns) != 2: # 只有兩個標的協整beta計算
+            return None
+
+        beta, _ = self.analyze_two_cointegration(combined_df)
+        return beta
+
     def analyze_two_cointegration(self, data, debug=True):
         """
         使用 Johansen 檢定計算協整參數，並回傳 beta_coefficient
@@ -292,3 +342,7 @@ class CalculateCoeffTask(Task):
             self.log.info(f"選出的計算數據範圍: {start_date} 至 {end_date}, 共 {unique_trading_days} 個交易日")
 
         return window_df, True  # 返回窗口數據和檢查成功的標誌
+
+def compute_pair_beta(item, data_dict):
+    """進程池執行的入口(需為模組層級函式才能被 pickle)"""
+    return CalculateCoeffTask().pair_beta(item, data_dict)
@@ -2,6 +2,7 @@ from utils.task.CalculateCoeffTask import CalculateCoeffTask
 from utils.task.ClearRedisTask import ClearRedisTask
 from utils.task.ReinitShioaji import ReinitShioaji
 from utils.task.CalculateSMC import CalculateSMC
+from utils.task.ScreenPairsTask import ScreenPairsTask
 from utils.log import get_module_logger
 
 class Facade:
@@ -14,7 +15,8 @@ class Facade:
             CalculateCoeffTask(),
             ClearRedisTask(),
             ReinitShioaji(),
-            CalculateSMC()
+            CalculateSMC(),
+            ScreenPairsTask()
         ]
 
     async def run_task(self, task_name, **kwargs) -> None:
@@ -0,0 +1,91 @@
+from utils.task.CalculateCoeffTask import CalculateCoeffTask, COEFF_WORKERS
+from utils.screener import screen_pairs, rank_candidates, save_candidates, cache_path
+from utils.file import open_json_file
+from utils.log import get_module_logger
+from utils.k import convert_ohlcv
+from datetime import datetime
+import pandas as pd
+import os, pytz, asyncio
+
+class ScreenPairsTask(CalculateCoeffTask):
+    """
+    配對篩選任務: 對商品池所有配對計算協整 p 值、避險比例、半衰期與 Hurst 指數, 排序後寫入 data/screener/candidates.json
+    商品池與條件讀取 setting.json 的 screener 區塊(可省略, 預設為目前 statarb 策略用到的商品):
+    {"universe": {"future": [...], "stock": [...]}, "K_time": 5, "window_trading_days": 5, "adf_lag": 1,
+     "significance": 0.05, "min_half_life": 2, "max_half_life": 120, "max_hurst": 0.5, "top": 20}
+    同一交易日已有結果時直接沿用(force=True 重新計算)
+    """
+    def __init__(self):
+        super().__init__()
+        self.log = get_module_logger('utils/task/ScreenPairsTask')
+
+    @property
+    def name(self) -> str:
+        return "screen_pairs"
+
+    async def execute(self, **kwargs) -> None:
+        try:
+            self.log.info(f"運行screen_pairs task")
+            self._init_params(**kwargs)
+
+            date = datetime.now(tz=pytz.timezone('Asia/Taipei')).strftime('%Y-%m-%d')
+            if os.path.exists(cache_path(date)) and not kwargs.get('force'):
+                self.log.info(f"{date} 已有配對篩選結果, 沿用快取: {cache_path(date)}")
+                return
+
+            config = self.load_config()
+            universe = {category: codes for category, codes in config['universe'].items() if len(codes) >= 2}
+            if not universe:
+                self.log.info("商品池不足兩個商品, 不進行配對篩選")
+                return
+
+            data = await asyncio.to_thread(self.fetch_kbars, [(category, code) for category, codes in universe.items() for code in codes])
+
+            candidates = {}
+            for category, codes in universe.items():
+                prices = self.build_prices(data, category, codes, config)
+                if prices.shape[1] < 2:
+                    self.log.warning(f"{category} 可用的商品不足兩個, 跳過")
+                    continue
+
+                result = await asyncio.to_thread(screen_pairs, prices, config['adf_lag'], workers=COEFF_WORKERS)
+                candidates[category] = rank_candidates(
+                    result, config['significance'], config['min_half_life'], config['max_half_life'], config['max_hurst'], config['top']
+                )
+                self.log.info(f"{category} 共 {prices.shape[1]} 個商品 {len(result)} 組配對, 候選: {candidates[category]}")
+
+            save_candidates(date, {'date': date, 'K_time': config['K_time'], 'candidates': candidates})
+        except Exception as e:
+            self.log.error(f"screen_pairs運行錯誤: {str(e)}")
+            raise
+
+    def load_config(self):
+        with self.lock:
+            settings = open_json_file()
+
+        config = {
+            'K_time': 5, 'window_trading_days': 5, 'adf_lag': 1, 'significance': 0.05,
+            'min_half_life': 2, 'max_half_life': 120, 'max_hurst': 0.5, 'top': 20,
+            **settings.get('screener', {})
+        }
+
+        if not config.get('universe'): # 預設使用 statarb 策略用到的商品
+            config['universe'] = {
+                category: list(dict.fromkeys(code for item in items if item.get('strategy', '').startswith("statarb") for code in item['code']))
+                for category, items in settings['items'].items() if items
+            }
+        return config
+
+    def build_prices(self, data, category, codes, config):
+        """篩選窗口並轉換週期後, 依時間對齊成收盤價矩陣(欄為商品代號)"""
+        closes = {}
+        for code in codes:
+            if (category, code) not in data:
+                continue
+
+            window_df, _ = self.filter_and_check_window(data[(category, code)], config['window_trading_days'], code)
+            if window_df is None:
+                continue
+            closes[code] = convert_ohlcv(window_df, config['K_time'])['close']
+
+        return pd.DataFrame(closes).dropna()
@@ -0,0 +1,19 @@
+import pandas as pd
+
+def calculate_true_range(high, low, close):
+    """真實波幅: max(high - low, |high - 前收|, |low - 前收|), 第一根只有 high - low"""
+    prev_close = close.shift(1)
+    return pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+
+def calculate_atr(df, window=14):
+    """
+    計算 ATR (Average True Range), 真實波幅的簡單移動平均(不足 window 根時以現有資料平均)
+
+    參數:
+    df (pd.DataFrame): 包含 'high', 'low', 'close' 欄位的 OHLCV 數據框
+    window (int): 滾動窗口大小，預設為 14
+    """
+    if not all(col in df.columns for col in ['high', 'low', 'close']):
+        raise ValueError("DataFrame must contain 'high', 'low', and 'close' columns")
+
+    return calculate_true_range(df['high'], df['low'], df['close']).rolling(window=window, min_periods=1).mean()
@@ -0,0 +1,15 @@
+def calculate_bollinger_bands(series, window=20, num_std=2):
+    """
+    計算布林通道(滾動平均 ± num_std 倍樣本標準差), 不足 window 根為 NaN
+    """
+    rolling_mean = series.rolling(window=window).mean()
+    rolling_std = series.rolling(window=window).std()
+    upper_band = rolling_mean + (rolling_std * num_std)
+    lower_band = rolling_mean - (rolling_std * num_std)
+
+    return {
+        'mean': rolling_mean,
+        'upper': upper_band,
+        'lower': lower_band,
+        'std': rolling_std
+    }
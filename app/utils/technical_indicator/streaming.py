@@ -0,0 +1,383 @@
+import json, math
+from abc import ABC, abstractmethod
+from collections import deque
+import numpy as np
+import pandas as pd
+from utils.rolling import RollingWindow, SpreadTransform, _div
+from utils.technical_indicator.rsi import calculate_rsi
+from utils.technical_indicator.ema import calculate_ema
+from utils.technical_indicator.bias import calculate_bias_ratio
+from utils.technical_indicator.diff import shift_log, diff_change, diff_change_shift
+from utils.technical_indicator.atr import calculate_atr
+from utils.technical_indicator.bollinger import calculate_bollinger_bands
+
+"""
+逐根更新的技術指標:
+每個指標保存計算下一根所需的最小狀態, update 每根 K 棒 O(1), batch 以 pandas 向量化計算整段序列(與 calculate_* 相同)
+並將狀態設定到序列結尾, 之後可直接接續 update; to_json/from_json 用於將狀態保存到 Redis
+update 在資料不足或無法計算時回傳 NaN, batch 回傳與輸入同索引的序列(calculate_* 去除的列為 NaN)
+"""
+
+class WindowMean:
+    """固定長度的滾動平均(與 pandas rolling(window, min_periods).mean() 相同), 視窗內皆為 0 時平均為 0; 每推入 window 筆重新加總避免浮點誤差累積"""
+    def __init__(self, window, min_periods=None, values=None):
+        self.window = int(window)
+        self.min_periods = self.window if min_periods is None else int(min_periods)
+        self.values = deque(maxlen=self.window)
+        self.load(values or [])
+
+    def __len__(self):
+        return len(self.values)
+
+    def load(self, values):
+        self.values.clear()
+        self.values.extend(map(float, values))
+        self.recompute()
+
+    def recompute(self):
+        self.total = math.fsum(self.values)
+        self.nonzero = sum(1 for value in self.values if value != 0)
+        self._pushes = 0
+
+    def push(self, value):
+        value = float(value)
+        if len(self.values) == self.window:
+            oldest = self.values[0]
+            self.total -= oldest
+            self.nonzero -= oldest != 0
+        self.values.append(value)
+        self.total += value
+        self.nonzero += value != 0
+
+        self._pushes += 1
+        if self._pushes >= self.window:
+            self.recompute()
+
+    @property
+    def mean(self):
+        if len(self.values) < max(self.min_periods, 1):
+            return float('nan')
+        return self.total / len(self.values) if self.nonzero else 0.0
+
+class StreamingIndicator(ABC):
+    """逐根更新指標的基底類別, 子類別定義 PARAMS(建構參數)、update、batch、state 與 load_state"""
+    PARAMS = ()
+
+    def params(self):
+        return {name: getattr(self, name) for name in self.PARAMS}
+
+    @abstractmethod
+    def reset(self):
+        """清除狀態"""
+        pass
+
+    @abstractmethod
+    def update(self, *values):
+        """推入一根 K 棒, 回傳該根的指標值"""
+        pass
+
+    @abstractmethod
+    def batch(self, *series):
+        """以 pandas 計算整段序列, 並將狀態設定到序列結尾"""
+        pass
+
+    @abstractmethod
+    def state(self):
+        """可 JSON 序列化的狀態"""
+        pass
+
+    @abstractmethod
+    def load_state(self, state):
+        """還原 state 保存的狀態"""
+        pass
+
+    def to_json(self):
+        return json.dumps({'type': type(self).__name__, 'params': self.params(), 'state': self.state()})
+
+    @staticmethod
+    def from_json(payload):
+        data = json.loads(payload)
+        indicator = INDICATORS[data['type']](**data['params'])
+        indicator.load_state(data['state'])
+        return indicator
+
+    def replay(self, *columns):
+        """以序列結尾重新建立狀態(只需最後幾根即可還原的指標)"""
+        self.reset()
+        for values in zip(*columns):
+            self.update(*values)
+
+class Rsi(StreamingIndicator):
+    """RSI(漲跌幅的簡單移動平均, 與 calculate_rsi 相同, 第一根的漲跌視為 0)"""
+    PARAMS = ('period',)
+
+    def __init__(self, period=14):
+        self.period = int(period)
+        self.reset()
+
+    def reset(self):
+        self.prev = None
+        self.gain = WindowMean(self.period)
+        self.loss = WindowMean(self.period)
+
+    def update(self, close):
+        close = float(close)
+        delta = 0.0 if self.prev is None else close - self.prev
+        self.prev = close
+        self.gain.push(max(delta, 0.0))
+        self.loss.push(max(-delta, 0.0))
+        return self.value
+
+    @property
+    def value(self):
+        gain, loss = self.gain.mean, self.loss.mean
+        if math.isnan(gain) or (gain == 0 and loss == 0):
+            return float('nan')
+        if loss == 0:
+            return 100.0
+        return 100 - 100 / (1 + gain / loss)
+
+    def batch(self, series):
+        result = calculate_rsi(series, self.period).reindex(series.index)
+        self.replay(series.to_numpy(dtype=float)[-(self.period + 1):])
+        return result
+
+    def state(self):
+        return {'prev': self.prev, 'gain': list(self.gain.values), 'loss': list(self.loss.values)}
+
+    def load_state(self, state):
+        self.prev = state['prev']
+        self.gain.load(state['gain'])
+        self.loss.load(state['loss'])
+
+class Ema(StreamingIndicator):
+    """EMA(span, adjust=False, 與 calculate_ema 相同)"""
+    PARAMS = ('span',)
+
+    def __init__(self, span=5):
+        self.span = int(span)
+        self.alpha = 2 / (self.span + 1)
+        self.reset()
+
+    def reset(self):
+        self.value = None
+
+    def update(self, value):
+        value = float(value)
+        self.value = value if self.value is None else self.alpha * value + (1 - self.alpha) * self.value
+        return self.value
+
+    def batch(self, series):
+        result = calculate_ema(series, self.span).reindex(series.index)
+        self.value = float(result.iloc[-1]) if len(result) else None
+        return result
+
+    def state(self):
+        return {'value': self.value}
+
+    def load_state(self, state):
+        self.value = state['value']
+
+class BiasRatio(StreamingIndicator):
+    """兩商品價差(或比率)相對 EMA 的乖離率 %(與 calculate_bias_ratio 相同)"""
+    PARAMS = ('ma_period', 'use_ratio')
+
+    def __init__(self, ma_period, use_ratio=False):
+        self.ma_period = int(ma_period)
+        self.use_ratio = bool(use_ratio)
+        self.ema = Ema(self.ma_period)
+
+    def reset(self):
+        self.ema.reset()
+
+    def update(self, close1, close2):
+        close1, close2 = float(close1), float(close2)
+        spread = _div(close2, close1) if self.use_ratio else close2 - close1
+        ema = self.ema.update(spread)
+        return _div(spread - ema, ema) * 100
+
+    def batch(self, close1, close2):
+        result = calculate_bias_ratio(close1, close2, self.ma_period, self.use_ratio)
+        close1, close2 = close1.align(close2, join='inner')
+        spread = close2 / close1 if self.use_ratio else close2 - close1
+        self.ema.batch(spread)
+        return result.reindex(close1.index)
+
+    def state(self):
+        return self.ema.state()
+
+    def load_state(self, state):
+        self.ema.load_state(state)
+
+class PairChange(StreamingIndicator):
+    """
+    兩商品相鄰 K 棒的變動序列(shift_log / diff_change / diff_change_shift), 逐根計算沿用 SpreadTransform,
+    第一根與無法計算時為 NaN, 無限大視為 0
+    """
+    TYPE = None
+
+    def reset(self):
+        self.transform = SpreadTransform(self.transform_params())
+
+    def transform_params(self):
+        return {'statarb_type': self.TYPE}
+
+    def update(self, close1, close2):
+        value = self.transform.step(close1, close2)
+        return float('nan') if value is None else value
+
+    def batch(self, close1, close2):
+        result = self.vectorized(close1, close2).reindex(close1.index)
+        self.replay(close1.to_numpy(dtype=float)[-1:], close2.to_numpy(dtype=float)[-1:])
+        return result
+
+    def state(self):
+        return self.transform.prev
+
+    def load_state(self, state):
+        self.transform.prev = dict(state or {})
+
+    @abstractmethod
+    def vectorized(self, close1, close2):
+        """對應的 pandas 批次計算"""
+        pass
+
+class ShiftLog(PairChange):
+    TYPE = 'shift_log'
+    PARAMS = ('log',)
+
+    def __init__(self, log=False):
+        self.log = bool(log)
+        self.reset()
+
+    def transform_params(self):
+        return {'statarb_type': self.TYPE, 'use_log': self.log}
+
+    def vectorized(self, close1, close2):
+        return shift_log(close1, close2, self.log)
+
+class DiffChange(PairChange):
+    TYPE = 'diff_change'
+    PARAMS = ('pct',)
+
+    def __init__(self, pct=False):
+        self.pct = bool(pct)
+        self.reset()
+
+    def transform_params(self):
+        return {'statarb_type': self.TYPE, 'use_pct': self.pct}
+
+    def vectorized(self, close1, close2):
+        return diff_change(close1, close2, self.pct)
+
+class DiffChangeShift(PairChange):
+    TYPE = 'diff_change_shift'
+
+    def __init__(self):
+        self.reset()
+
+    def vectorized(self, close1, close2):
+        return diff_change_shift(close1, close2)
+
+class Atr(StreamingIndicator):
+    """ATR(真實波幅的簡單移動平均, 不足 window 根時以現有資料平均, 與 calculate_atr 相同)"""
+    PARAMS = ('window',)
+
+    def __init__(self, window=14):
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        self.prev_close = None
+        self.true_range = WindowMean(self.window, min_periods=1)
+
+    def update(self, high, low, close):
+        high, low, close = float(high), float(low), float(close)
+        true_range = high - low
+        if self.prev_close is not None and not math.isnan(self.prev_close):
+            true_range = max(true_range, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        self.true_range.push(true_range)
+        return self.true_range.mean
+
+    def batch(self, df):
+        result = calculate_atr(df, self.window)
+        tail = df[['high', 'low', 'close']].to_numpy(dtype=float)[-(self.window + 1):]
+        self.replay(tail[:, 0], tail[:, 1], tail[:, 2])
+        return result
+
+    def state(self):
+        return {'prev_close': self.prev_close, 'true_range': list(self.true_range.values)}
+
+    def load_state(self, state):
+        self.prev_close = state['prev_close']
+        self.true_range.load(state['true_range'])
+
+class Bollinger(StreamingIndicator):
+    """布林通道(滾動平均 ± num_std 倍樣本標準差, 與 calculate_bollinger_bands 相同), update 回傳 dict(mean, upper, lower, std)"""
+    PARAMS = ('window', 'num_std')
+
+    def __init__(self, window=20, num_std=2):
+        self.window = int(window)
+        self.num_std = num_std
+        self.reset()
+
+    def reset(self):
+        self.rolling = RollingWindow(self.window)
+        self.flat = 0
+
+    def update(self, value):
+        value = float(value)
+        self.flat = self.flat + 1 if self.rolling.values and value == self.rolling.last else 1  # 連續相同價格的根數
+        self.rolling.push(value)
+        if len(self.rolling) < self.window:
+            return {'mean': float('nan'), 'upper': float('nan'), 'lower': float('nan'), 'std': float('nan')}
+
+        mean = self.rolling.mean
+        std = 0.0 if self.flat >= self.window else self.rolling.std  # 與 pandas 相同, 視窗內價格皆相同時標準差為 0
+        return {'mean': mean, 'upper': mean + std * self.num_std, 'lower': mean - std * self.num_std, 'std': std}
+
+    def batch(self, series):
+        result = pd.DataFrame(calculate_bollinger_bands(series, self.window, self.num_std))
+        self.load_state({'values': list(series.to_numpy(dtype=float)[-self.window:])})
+        return result
+
+    def state(self):
+        return {'values': list(self.rolling.values), 'mean': self.rolling.mean, 'm2': self.rolling.m2}
+
+    def load_state(self, state):
+        self.rolling = RollingWindow(self.window, state['values'], state.get('mean'), state.get('m2'))
+        values = list(self.rolling.values)
+        self.flat = next((i for i, value in enumerate(reversed(values)) if value != values[-1]), len(values))
+
+class IndicatorSeries:
+    """
+    以 K 棒時間同步的逐根指標: 保存指標狀態與最近 size 根 K 棒的輸出, 每輪只 update 上次之後的新 K 棒,
+    第一次或 K 棒不連續時以 batch 重建(與 RollingZscore.sync 相同), 搭配 get_kernel 於每個進程快取
+    """
+    def __init__(self, indicator, size):
+        self.indicator = indicator
+        self.values = deque(maxlen=int(size))
+        self.ts = None
+
+    def sync(self, ts, *columns):
+        """ts 由舊到新(datetime64 陣列), 回傳最近 size 根 K 棒的指標值(無法計算為 NaN)"""
+        start = None
+        if self.ts is not None:
+            index = int(np.searchsorted(ts, self.ts))
+            if index < len(ts) and ts[index] == self.ts:
+                start = index + 1
+
+        if start is None: # 第一次或不連續, 以本輪資料重建
+            result = self.indicator.batch(*[pd.Series(np.asarray(column, dtype=float)) for column in columns])
+            self.values.clear()
+            self.values.extend(result.to_numpy(dtype=float)[-self.values.maxlen:])
+        else:
+            for values in zip(*[column[start:] for column in columns]):
+                self.values.append(self.indicator.update(*values))
+
+        if len(ts):
+            self.ts = ts[-1]
+        return np.array(self.values, dtype=float)
+
+INDICATORS = {cls.__name__: cls for cls in (Rsi, Ema, BiasRatio, ShiftLog, DiffChange, DiffChangeShift, Atr, Bollinger)}
@@ -0,0 +1,135 @@
+import os
+import numpy as np
+
+# 超過此筆數且欄位為數值時改用 NumPy 聚合, 0 為停用
+# (輸入為 dict 列表時, 取出欄位的成本高於聚合本身, 實測單次走訪較快, 因此預設停用)
+NUMPY_THRESHOLD = int(os.getenv('TICK_NUMPY_THRESHOLD', 0))
+
+def tick_type_summary(outer_trades, inner_trades):
+    net_trades = outer_trades - inner_trades  # 淨成交量
+    return {
+        "outer_trades": outer_trades,
+        "inner_trades": inner_trades,
+        "dominant": "外盤" if net_trades > 0 else "內盤" if net_trades < 0 else "均衡"
+    }
+
+def aggregate_ticks_by_second(tick_data):
+    """
+    將 tick 依照相同秒數合併, ts 已是 '%Y-%m-%d %H:%M:%S' 字串, 直接以前 19 碼分組
+    單次走訪即算出 OHLCV、委買委賣量與內外盤筆數, 輸出與逐筆 pd.to_datetime 分組的舊版相同
+    """
+    if not tick_data:
+        return []
+
+    if NUMPY_THRESHOLD and len(tick_data) >= NUMPY_THRESHOLD and not isinstance(tick_data[0]['close'], str):
+        return _aggregate_numpy(tick_data)
+    return _aggregate_python(tick_data)
+
+def _aggregate_python(tick_data):
+    buckets = {}  # {ts: [code, close, high, low, volume, bid_set, bid_volume, ask_set, ask_volume, outer, inner]}
+
+    for tick in tick_data:
+        ts = tick['ts'][:19]
+        bid, ask, tick_type = tick['bid_side_total_vol'], tick['ask_side_total_vol'], tick['tick_type']
+        bucket = buckets.get(ts)
+
+        if bucket is None:
+            buckets[ts] = [
+                tick['code'], tick['close'], tick['high'], tick['low'], int(tick['volume']),
+                {bid} if bid != 0 else set(), int(bid),
+                {ask} if ask != 0 else set(), int(ask),
+                int(tick_type == 1), int(tick_type == -1)
+            ]
+            continue
+
+        bucket[1] = tick['close']  # 取最後一筆 close
+        if tick['high'] > bucket[2]:
+            bucket[2] = tick['high']
+        if tick['low'] < bucket[3]:
+            bucket[3] = tick['low']
+        bucket[4] += int(tick['volume'])
+        if bid != 0:
+            bucket[5].add(bid)
+        bucket[6] += int(bid)
+        if ask != 0:
+            bucket[7].add(ask)
+        bucket[8] += int(ask)
+        if tick_type == 1:
+            bucket[9] += 1
+        elif tick_type == -1:
+            bucket[10] += 1
+
+    return [
+        {
+            'ts': ts,
+            'code': code,
+            'close': close,
+            'high': high,
+            'low': low,
+            'volume': volume,
+            'bid_price': tuple(sorted(bid_set)),
+            'bid_volume': bid_volume,
+            'ask_price': tuple(sorted(ask_set)),
+            'ask_volume': ask_volume,
+            'tick_type': tick_type_summary(outer, inner)
+        }
+        for ts, (code, close, high, low, volume, bid_set, bid_volume, ask_set, ask_volume, outer, inner) in buckets.items()
+    ]
+
+def _group_values(group, values, size):
+    """每組不重複且非 0 的值(已排序)"""
+    mask = values != 0
+    pairs = np.unique(np.stack([group[mask], values[mask]]), axis=1) if mask.any() else np.empty((2, 0), dtype=values.dtype)
+    splits = np.searchsorted(pairs[0], np.arange(1, size))
+    return [tuple(part.tolist()) for part in np.split(pairs[1], splits)]
+
+def _aggregate_numpy(tick_data):
+    ts = np.array([tick['ts'][:19] for tick in tick_data])
+    close = np.array([tick['close'] for tick in tick_data], dtype=np.float64)
+    high = np.array([tick['high'] for tick in tick_data], dtype=np.float64)
+    low = np.array([tick['low'] for tick in tick_data], dtype=np.float64)
+    volume = np.array([tick['volume'] for tick in tick_data], dtype=np.int64)
+    bid = np.array([tick['bid_side_total_vol'] for tick in tick_data], dtype=np.int64)
+    ask = np.array([tick['ask_side_total_vol'] for tick in tick_data], dtype=np.int64)
+    tick_type = np.array([tick['tick_type'] for tick in tick_data], dtype=np.int64)
+
+    # 依照第一次出現的順序編號每一秒
+    keys, first, inverse = np.unique(ts, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    group = rank[inverse]
+    size = len(keys)
+
+    last = np.zeros(size, dtype=np.int64)
+    np.maximum.at(last, group, np.arange(len(tick_data)))
+    highs = np.full(size, -np.inf)
+    np.maximum.at(highs, group, high)
+    lows = np.full(size, np.inf)
+    np.minimum.at(lows, group, low)
+
+    volumes = np.bincount(group, weights=volume, minlength=size).astype(np.int64)
+    bid_volumes = np.bincount(group, weights=bid, minlength=size).astype(np.int64)
+    ask_volumes = np.bincount(group, weights=ask, minlength=size).astype(np.int64)
+    outer = np.bincount(group, weights=tick_type == 1, minlength=size).astype(np.int64)
+    inner = np.bincount(group, weights=tick_type == -1, minlength=size).astype(np.int64)
+    bid_prices = _group_values(group, bid, size)
+    ask_prices = _group_values(group, ask, size)
+
+    first_rows = first[order]
+    return [
+        {
+            'ts': str(keys[order[i]]),
+            'code': tick_data[first_rows[i]]['code'],
+            'close': tick_data[last[i]]['close'],
+            'high': highs[i].item(),
+            'low': lows[i].item(),
+            'volume': int(volumes[i]),
+            'bid_price': bid_prices[i],
+            'bid_volume': int(bid_volumes[i]),
+            'ask_price': ask_prices[i],
+            'ask_volume': int(ask_volumes[i]),
+            'tick_type': tick_type_summary(int(outer[i]), int(inner[i]))
+        }
+        for i in range(size)
+    ]
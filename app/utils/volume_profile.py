@@ -0,0 +1,111 @@
+from collections import deque
+import numpy as np
+
+class VolumeProfile:
+    """
+    成交量分佈(VPFR):
+    最近 window 根 K 棒的價格區間 [最低低點, 最高高點] 等分為 window 個右閉區間 (edges[k], edges[k + 1]],
+    依收盤價所在區間累計成交量, 以陣列保存區間邊界、各區間成交量與 K 棒數
+    append 新增一根 K 棒時, 若價格區間不變只需加入新 K 棒並移除最舊的 K 棒(O(1)), 區間改變時才以視窗重新計算
+    """
+    def __init__(self, window):
+        self.window = int(window)
+        self.bars = deque(maxlen=self.window)  # (high, low, close, volume)
+        self.edges = None
+        self.volumes = None
+        self.counts = None
+        self.total_volume = 0.0
+        self.ts = None  # 最後套用的 K 棒時間
+
+    @classmethod
+    def from_bars(cls, high, low, close, volume, window):
+        profile = cls(window)
+        profile.bars.extend(zip(map(float, high[-profile.window:]), map(float, low[-profile.window:]), map(float, close[-profile.window:]), map(float, volume[-profile.window:])))
+        profile.rebuild()
+        return profile
+
+    @property
+    def valid(self):
+        return self.edges is not None
+
+    @property
+    def observed(self):
+        """有 K 棒收在其中的區間"""
+        return self.counts > 0
+
+    @property
+    def mids(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    @property
+    def fractions(self):
+        """各區間成交量佔視窗總成交量的比例"""
+        if not self.total_volume:
+            return np.zeros(self.window)
+        return self.volumes / self.total_volume
+
+    def bin_index(self, close):
+        """收盤價所在區間的索引, 不在範圍內(含等於最低點)回傳 -1"""
+        index = int(np.searchsorted(self.edges, close, side='left')) - 1
+        return index if 0 <= index < self.window else -1
+
+    def rebuild(self):
+        bars = np.array(self.bars, dtype=float).reshape(-1, 4)
+        self.total_volume = float(bars[:, 3].sum())
+
+        if len(bars) < self.window or not np.all(np.isfinite(bars[:, :2])) or bars[:, 0].max() <= bars[:, 1].min():
+            self.edges = self.volumes = self.counts = None
+            return
+
+        self.edges = np.linspace(bars[:, 1].min(), bars[:, 0].max(), self.window + 1)
+        index = np.searchsorted(self.edges, bars[:, 2], side='left') - 1
+        inside = (index >= 0) & (index < self.window)
+        self.counts = np.bincount(index[inside], minlength=self.window)
+        self.volumes = np.bincount(index[inside], weights=bars[inside, 3], minlength=self.window)
+
+    def append(self, high, low, close, volume):
+        bar = (float(high), float(low), float(close), float(volume))
+        oldest = self.bars[0] if len(self.bars) == self.window else None
+        self.bars.append(bar)
+
+        # 新 K 棒在原區間內, 且移除的 K 棒不是區間的最高/最低點時, 價格區間不變
+        if (
+            self.valid and oldest is not None
+            and self.edges[0] <= bar[1] and bar[0] <= self.edges[-1]
+            and self.edges[0] < oldest[1] and oldest[0] < self.edges[-1]
+        ):
+            self._add(oldest, -1)
+            self._add(bar, 1)
+            self.total_volume += bar[3] - oldest[3]
+            return self
+
+        self.rebuild()
+        return self
+
+    def sync(self, ts, high, low, close, volume):
+        """套用尚未處理的 K 棒(ts 由舊到新, 皆為已完成的 K 棒), 不連續時以傳入資料重建"""
+        start = 0
+        if self.ts is not None:
+            index = int(np.searchsorted(ts, self.ts))
+            start = index + 1 if index < len(ts) and ts[index] == self.ts else 0
+            if start == 0:
+                self.bars.clear()
+
+        if len(ts) - start >= self.window: # 新 K 棒已超過整個視窗, 直接以最近 window 根重建
+            self.bars.clear()
+            start = len(ts) - self.window
+            self.bars.extend((float(high[i]), float(low[i]), float(close[i]), float(volume[i])) for i in range(start, len(ts)))
+            self.rebuild()
+        else:
+            for i in range(start, len(ts)):
+                self.append(high[i], low[i], close[i], volume[i])
+
+        if len(ts):
+            self.ts = ts[-1]
+        return self
+
+    def _add(self, bar, sign):
+        index = self.bin_index(bar[2])
+        if index >= 0:
+            self.counts[index] += sign
+            self.volumes[index] += sign * bar[3]
@@ -0,0 +1,90 @@
+"""
+aggregate_ticks_by_second 效能比較: 舊版(逐筆 pd.to_datetime)與新版(字串分組 / NumPy)
+執行: python backtest/reference/bench_aggregate_ticks.py
+"""
+import os, sys, time, random
+from collections import defaultdict
+from datetime import datetime, timedelta
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import tick as tick_module
+
+# ---------------- 舊版實作(對照組) ----------------
+def legacy_analyze_tick_types(tick_types):
+    outer_trades = tick_types.count(1)
+    inner_trades = tick_types.count(-1)
+    net_trades = outer_trades - inner_trades
+    dominant = "外盤" if net_trades > 0 else "內盤" if net_trades < 0 else "均衡"
+    return {"outer_trades": outer_trades, "inner_trades": inner_trades, "dominant": dominant}
+
+def legacy_aggregate_ticks_by_second(tick_data):
+    tick_buffer = defaultdict(list)
+    for tick in tick_data:
+        ts = pd.to_datetime(tick['ts']).floor('s')
+        tick_buffer[ts].append(tick)
+
+    aggregated_ticks = []
+    for ts, ticks in tick_buffer.items():
+        aggregated_ticks.append({
+            'ts': ts.strftime('%Y-%m-%d %H:%M:%S'),
+            'code': ticks[0]['code'],
+            'close': ticks[-1]['close'],
+            'high': max(t['high'] for t in ticks),
+            'low': min(t['low'] for t in ticks),
+            'volume': sum(int(t['volume']) for t in ticks),
+            'bid_price': tuple(sorted(set(t['bid_side_total_vol'] for t in ticks if t['bid_side_total_vol'] != 0))),
+            'bid_volume': sum(int(t['bid_side_total_vol']) for t in ticks),
+            'ask_price': tuple(sorted(set(t['ask_side_total_vol'] for t in ticks if t['ask_side_total_vol'] != 0))),
+            'ask_volume': sum(int(t['ask_side_total_vol']) for t in ticks),
+            'tick_type': legacy_analyze_tick_types([t['tick_type'] for t in ticks])
+        })
+    return aggregated_ticks
+
+# ---------------- 測試資料 ----------------
+def make_ticks(n, ticks_per_second=8, seed=7):
+    random.seed(seed)
+    start = datetime(2025, 3, 24, 8, 45)
+    price = 20000.0
+    ticks = []
+    for i in range(n):
+        price += random.choice([-1, 0, 1])
+        ts = start + timedelta(seconds=i // ticks_per_second)
+        ticks.append({
+            'ts': ts.strftime('%Y-%m-%d %H:%M:%S'),
+            'code': 'TMFR1',
+            'close': price,
+            'high': price + random.choice([0, 1]),
+            'low': price - random.choice([0, 1]),
+            'volume': random.randint(1, 5),
+            'bid_side_total_vol': random.choice([0, random.randint(1, 50000)]),
+            'ask_side_total_vol': random.choice([0, random.randint(1, 50000)]),
+            'tick_type': random.choice([1, -1, 0])
+        })
+    return ticks
+
+def bench(fn, data, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == '__main__':
+    for n in (10_000, 100_000):
+        ticks = make_ticks(n)
+        legacy_time, expected = bench(legacy_aggregate_ticks_by_second, ticks, repeat=1)
+        python_time, python_result = bench(tick_module._aggregate_python, ticks)
+        numpy_time, numpy_result = bench(tick_module._aggregate_numpy, ticks)
+        current_time, current_result = bench(tick_module.aggregate_ticks_by_second, ticks)
+
+        assert python_result == expected, "單次走訪版本結果與舊版不同"
+        assert numpy_result == expected, "NumPy 版本結果與舊版不同"
+        assert current_result == expected, "aggregate_ticks_by_second 結果與舊版不同"
+
+        print(f"{n:>7} ticks / {len(expected)} 秒")
+        print(f"  舊版 pd.to_datetime : {legacy_time * 1000:9.2f} ms")
+        print(f"  單次走訪            : {python_time * 1000:9.2f} ms ({legacy_time / python_time:6.1f}x)")
+        print(f"  NumPy               : {numpy_time * 1000:9.2f} ms ({legacy_time / numpy_time:6.1f}x)")
+        print(f"  aggregate (自動選擇) : {current_time * 1000:9.2f} ms ({legacy_time / current_time:6.1f}x)")
@@ -0,0 +1,116 @@
+"""
+convert_ohlcv 效能比較: 舊版(逐列 classify_session + 逐區間布林篩選)與新版(向量化時段判斷 + 一次分組聚合)
+測試資料為 14 天 1 分 K, 並確認兩者輸出相同(含 complete 欄位)
+執行: python backtest/reference/bench_convert_ohlcv.py
+"""
+import os, sys, time, io, contextlib
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils.k import convert_ohlcv
+
+# ---------------- 舊版實作(對照組) ----------------
+def legacy_convert_ohlcv(df, freq=60):
+    freq = int(freq) if isinstance(freq, str) else int(freq)
+
+    def classify_session(ts):
+        try:
+            ts = ts.tz_localize(None) if ts.tzinfo else ts
+            time = ts.time()
+
+            day_start = datetime.strptime("08:45", "%H:%M").time()
+            day_end = datetime.strptime("13:45", "%H:%M").time()
+            night_start = datetime.strptime("15:00", "%H:%M").time()
+            night_end = datetime.strptime("05:00", "%H:%M").time()
+
+            if day_start <= time <= day_end:
+                session_type = "day"
+                session_date = ts.date()
+                session_start = datetime.combine(session_date, day_start)
+            elif time >= night_start:
+                session_type = "night"
+                session_date = ts.date()
+                session_start = datetime.combine(session_date, night_start)
+            elif time <= night_end:
+                session_type = "night"
+                session_date = (ts - timedelta(days=1)).date()
+                session_start = datetime.combine(session_date, night_start)
+            else:
+                session_type = "other"
+                session_start = pd.NaT
+
+            return pd.Series([session_type, session_start], index=["session_type", "session_start"])
+        except Exception as e:
+            print(f"時間轉換出現錯誤 {ts}: {e}")
+            return pd.Series([None, None], index=["session_type", "session_start"])
+
+    df.loc[:, ["session_type", "session_start"]] = df.index.to_series().apply(classify_session)
+    df = df[df["session_type"].isin(["day", "night"])].copy()
+    df.index = df.index - pd.Timedelta(minutes=1)
+    window = timedelta(minutes=freq)
+
+    result = []
+    for session_start, session_data in df.groupby("session_start"):
+        current_time = session_start
+        max_time = session_data.index.max()
+
+        while current_time < max_time:
+            next_time = current_time + window
+            window_data = session_data[(session_data.index >= current_time) & (session_data.index < next_time)]
+
+            if not window_data.empty:
+                result.append({
+                    "ts": current_time,
+                    "open": window_data["open"].iloc[0],
+                    "high": window_data["high"].max(),
+                    "low": window_data["low"].min(),
+                    "close": window_data["close"].iloc[-1],
+                    "volume": window_data["volume"].sum(),
+                    "complete": window_data.index[-1] >= next_time - timedelta(minutes=1)
+                })
+
+            current_time = next_time
+
+    agg_df = pd.DataFrame(result)
+    if 'ts' in agg_df.columns:
+        agg_df.set_index('ts', inplace=True, drop=False)
+    return agg_df
+
+# ---------------- 測試資料 ----------------
+def make_bars(days=14, seed=7):
+    """每天 1440 根 1 分 K(含非交易時段, 由 convert_ohlcv 過濾), 隨機缺漏 5%"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2025-03-03', periods=days * 1440, freq='1min')
+    index = index[rng.random(len(index)) >= 0.05]
+    close = 20000 + np.cumsum(rng.choice([-2.0, -1.0, 0.0, 1.0, 2.0], len(index)))
+    return pd.DataFrame({
+        'open': close + rng.integers(-2, 3, len(index)),
+        'high': close + rng.integers(0, 5, len(index)),
+        'low': close - rng.integers(0, 5, len(index)),
+        'close': close,
+        'volume': rng.integers(1, 200, len(index))
+    }, index=index)
+
+def bench(fn, df, freq, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn(data, freq)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+if __name__ == '__main__':
+    df = make_bars()
+    print(f"{len(df)} 根 1 分 K (14 天)")
+    for freq in (5, 15, 60):
+        legacy_time, expected = bench(legacy_convert_ohlcv, df, freq, repeat=1)
+        current_time, result = bench(convert_ohlcv, df, freq)
+        pd.testing.assert_frame_equal(result, expected, check_freq=False)
+
+        print(f"  {freq:>3} 分 K / {len(expected)} 根")
+        print(f"    舊版     : {legacy_time * 1000:9.2f} ms")
+        print(f"    向量化   : {current_time * 1000:9.2f} ms ({legacy_time / current_time:6.1f}x)")
@@ -0,0 +1,85 @@
+"""
+逐根更新指標(utils/technical_indicator/streaming.py)與 pandas 批次計算(calculate_*)的一致性檢查與效能比較:
+  - 逐根 update 的輸出與 batch 相同
+  - 前半段 batch 後將狀態 to_json/from_json, 再逐根 update 後半段, 結果與整段 batch 相同
+  - IndicatorSeries 每輪讀取最近的視窗並只續算新 K 棒, 結果與每輪以視窗重新 batch 相同
+執行: python backtest/reference/check_streaming_indicators.py
+"""
+import os, sys, time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils.technical_indicator.streaming import (
+    StreamingIndicator, IndicatorSeries, Rsi, Ema, BiasRatio, ShiftLog, DiffChange, DiffChangeShift, Atr, Bollinger
+)
+
+# ---------------- 測試資料 ----------------
+def make_bars(n, seed=7):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2025-03-24 08:45', periods=n, freq='5min')
+    close1 = 20000 + np.cumsum(rng.choice([-2.0, -1.0, 0.0, 0.0, 1.0, 2.0], n))
+    close2 = 600 + np.cumsum(rng.choice([-0.5, 0.0, 0.0, 0.5], n))
+    close2[n // 3:n // 3 + 30] = close2[n // 3]  # 一段不動的價格(RSI 漲跌皆為 0、布林標準差為 0)
+    high = close1 + rng.integers(0, 5, n)
+    low = close1 - rng.integers(0, 5, n)
+    bars = pd.DataFrame({'high': high, 'low': low, 'close': close1}, index=index)
+    return bars, pd.Series(close1, index=index), pd.Series(close2, index=index)
+
+def streamed(indicator, *columns):
+    values = [indicator.update(*row) for row in zip(*[column.to_numpy() for column in columns])]
+    return pd.DataFrame(values, index=columns[0].index) if isinstance(values[0], dict) else pd.Series(values, index=columns[0].index)
+
+def assert_same(name, expected, result):
+    np.testing.assert_allclose(result.to_numpy(dtype=float), expected.to_numpy(dtype=float), rtol=1e-9, atol=1e-8, equal_nan=True, err_msg=name)
+
+def check(name, factory, inputs, columns):
+    """inputs: batch 的參數, columns: 逐根 update 的各欄序列"""
+    expected = factory().batch(*inputs)
+    assert_same(f"{name} 逐根更新", expected, streamed(factory(), *columns))
+
+    # 前半段 batch 後保存/還原狀態, 再逐根接續後半段
+    half = len(expected) // 2
+    head = factory()
+    head.batch(*[data.iloc[:half] for data in inputs])
+    restored = StreamingIndicator.from_json(head.to_json())
+    assert_same(f"{name} 狀態還原後接續", expected.iloc[half:], streamed(restored, *[column.iloc[half:] for column in columns]))
+
+    start = time.perf_counter()
+    streamed(factory(), *columns)
+    per_bar = (time.perf_counter() - start) / len(expected)
+    start = time.perf_counter()
+    factory().batch(*inputs)
+    batch_time = time.perf_counter() - start
+    print(f"  {name:<16} 逐根 {per_bar * 1e6:7.2f} us/根, 批次 {batch_time * 1000:7.2f} ms")
+
+def check_series(name, factory, series, size, extra, seed=11):
+    """每輪讀取最近 size + extra 根(不固定前進 1~3 根, 偶爾跳過一大段), 最近 size 根的值與以視窗重新 batch 相同"""
+    rng = np.random.default_rng(seed)
+    ts = series.index.to_numpy().astype('datetime64[s]')
+    values = series.to_numpy(dtype=float)
+    cached, end, rounds = IndicatorSeries(factory(), size), size + extra, 0
+    while end <= len(series):
+        window = slice(end - size - extra, end)
+        expected = factory().batch(series.iloc[window]).iloc[-size:]
+        assert_same(f"{name} 第 {rounds} 輪", expected, pd.Series(cached.sync(ts[window], values[window]), index=expected.index))
+        end += int(rng.integers(1, 4)) if rng.random() > 0.01 else 200
+        rounds += 1
+    print(f"  {name:<16} 續算 {rounds} 輪與視窗 batch 相同")
+
+if __name__ == '__main__':
+    bars, close1, close2 = make_bars(20_000)
+    print(f"{len(bars)} 根 K 棒")
+    check('Rsi', lambda: Rsi(14), (close2,), (close2,))
+    check('Ema', lambda: Ema(20), (close1,), (close1,))
+    check('BiasRatio', lambda: BiasRatio(10), (close1, close2), (close1, close2))
+    check('BiasRatio(ratio)', lambda: BiasRatio(10, use_ratio=True), (close1, close2), (close1, close2))
+    check('ShiftLog', lambda: ShiftLog(), (close1, close2), (close1, close2))
+    check('ShiftLog(log)', lambda: ShiftLog(log=True), (close1, close2), (close1, close2))
+    check('DiffChange', lambda: DiffChange(), (close1, close2), (close1, close2))
+    check('DiffChange(pct)', lambda: DiffChange(pct=True), (close1, close2), (close1, close2))
+    check('DiffChangeShift', lambda: DiffChangeShift(), (close1, close2), (close1, close2))
+    check('Atr', lambda: Atr(14), (bars,), (bars['high'], bars['low'], bars['close']))
+    check('Bollinger', lambda: Bollinger(20, 2), (close2,), (close2,))
+    check_series('IndicatorSeries', lambda: Rsi(14), close1.iloc[:5000], 40, 14)
+    print("逐根更新與批次計算結果一致")